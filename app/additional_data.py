@@ -1,9 +1,13 @@
 import yaml
 import pickle
-import pandas as pd
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from database import load_from_db, update_voivodeship
+from commons import get_session, RateLimiter, HTTP_TIMEOUT, RETRY_STATUSES
+from metrics import metrics
+from database import query_offers, update_geodata, load_geocodes, save_geocodes, count_technologies, normalize_city
 
 config_path = '../config.yaml'
 with open(config_path, 'r') as file:
@@ -11,24 +15,42 @@ with open(config_path, 'r') as file:
 
 GEO_DICT_PATH = config['GEO_DICT_PATH']
 TECH_DICT_PATH = config['TECH_DICT_PATH']
+NOMINATIM_URL = config['NOMINATIM_URL']
+NOMINATIM_RATE_LIMIT = config['NOMINATIM_RATE_LIMIT']
+NOMINATIM_WORKERS = config['NOMINATIM_WORKERS']
+NOMINATIM_APP_NAME = config['NOMINATIM_APP_NAME']
+NOMINATIM_CONTACT = config['NOMINATIM_CONTACT']
+NOMINATIM_RETRIES = config['NOMINATIM_RETRIES']
+NOMINATIM_RETRY_BACKOFF = config['NOMINATIM_RETRY_BACKOFF']
+GEO_MISS_TTL_DAYS = config['GEO_MISS_TTL_DAYS']
 
+# Nominatim usage policy allows at most 1 request per second
+nominatim_limiter = RateLimiter(NOMINATIM_RATE_LIMIT, name='nominatim')
 
-def create_tech_dict():
+
+def get_nominatim_headers(app_name: str = NOMINATIM_APP_NAME, contact: str = NOMINATIM_CONTACT):
     """
-    This function reads the job offers database and compiles a dictionary where each key
-    is a technology and its value is the count of how many times that technology appears
-    in the database. The resulting dictionary is then saved to a file.
+    This function builds the headers of requests to Nominatim. Its usage policy requires a User-Agent
+    identifying the application, so the browser User-Agent of the scrapers is never sent there.
     """
-    offers_db = load_from_db()
+    if not contact:
+        print("NOMINATIM_CONTACT is not set in config.yaml - Nominatim may block requests without a contact")
 
-    tech_dict = {}
+    return {
+        'User-Agent': f"{app_name} ({contact})" if contact else app_name,
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+    }
 
-    for offer_list in offers_db['technologies']:
-        for tech in offer_list:
-            if tech in tech_dict:
-                tech_dict[tech] += 1
-            else:
-                tech_dict[tech] = 1
+
+def create_tech_dict():
+    """
+    This function compiles a dictionary where each key is a technology and its value is the count
+    of how many offers in the database require that technology. The counts come from the technologies
+    index maintained by the database (see 'count_technologies'), so offers don't have to be loaded.
+    The resulting dictionary is then saved to a file.
+    """
+    tech_dict = count_technologies()
 
     with open(TECH_DICT_PATH, 'wb') as tech_file:
         pickle.dump(tech_dict, tech_file)
@@ -64,73 +86,127 @@ def extract_geofeatures(geodata: dict):
     return lat, lon, voivodeship
 
 
-def get_geodata():
+def get_retry_delay(response, attempt: int, backoff: float = NOMINATIM_RETRY_BACKOFF):
     """
-     This function reads the job offers database, extracts unique cities with unspecified voivodeships,
-     and queries the Nominatim API for each city to obtain geographic data. It then processes this data
-     to extract latitude, longitude, and voivodeship, storing the results in a dictionary. This dictionary
-     is then saved to a file.
-     """
-    offers_db = load_from_db()
+    This function returns how long to wait before retrying a failed Nominatim request: the exponential
+    backoff of the attempt, or longer if the response asks for it with a Retry-After header (in seconds).
+    """
+    delay = backoff * 2 ** attempt
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.strip().isdigit():
+        delay = max(delay, int(retry_after))
 
-    cities = offers_db[offers_db['voivodeship'].isna()]['location'].drop_duplicates()
+    return delay
 
-    geo_dict = {}
 
-    nominatim_url = "https://nominatim.openstreetmap.org/search?format=json&country=Poland&city="
+def geocode_city(session: requests.Session, city: str, retries: int = NOMINATIM_RETRIES):
+    """
+    This function queries the Nominatim API for a single city. Every request, retries included, is spaced
+    out by the shared rate limiter, so the session mustn't retry on its own (see 'get_session'). Connection
+    errors, 429 and 5xx responses are retried up to 'retries' times after a backoff (see 'get_retry_delay').
 
-    for city in cities:
-        geodata = requests.get(nominatim_url + city).json()
+    Parameters:
+    - session (requests.Session): The HTTP session used for the lookups.
+    - city (str): Name of the city.
+    - retries (int): Maximum number of retries of a failed request.
 
-        if geodata:
-            lat, lon, voivodeship = extract_geofeatures(geodata[0])
-            geo_dict[city] = {
-                'lat': lat,
-                'lon': lon,
-                'voivodeship': voivodeship
-            }
+    Returns:
+    - dict or None: Geographic data of the city ('found' is 0 if Nominatim doesn't know the city),
+                    or None if the lookup failed - such a city is not cached and will be looked up again.
+    """
+    for attempt in range(retries + 1):
+        nominatim_limiter.wait()
+        response = None
+        try:
+            response = session.get(NOMINATIM_URL, params={'format': 'json', 'country': 'Poland', 'city': city},
+                                   timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            geodata = response.json()
+            break
+        except (requests.RequestException, ValueError) as e:
+            retryable = (isinstance(e, (requests.ConnectionError, requests.Timeout))
+                         or (response is not None and response.status_code in RETRY_STATUSES))
+            if not retryable or attempt == retries:
+                print(f"Couldn't get geographic data of {city}, because: {e}")
+                metrics.inc('geocode_lookups_failed')
+                return None
+            metrics.inc('geocode_lookups_retried')
+            time.sleep(get_retry_delay(response, attempt))
 
-    with open(GEO_DICT_PATH, 'wb') as geo_file:
-        pickle.dump(geo_dict, geo_file)
+    if not geodata:
+        return {'city': city, 'found': 0, 'lat': None, 'lon': None, 'voivodeship': None}
 
+    lat, lon, voivodeship = extract_geofeatures(geodata[0])
 
-def fill_empty_voivodeship(row: pd.Series, geo_dict: dict):
-    """
-    This function checks if the 'voivodeship' field in a given job offer (represented as a pandas Series)
-    is missing. If so, it attempts to fill this field using the corresponding voivodeship from the
-    geographic data dictionary, based on the offer's location. If the location is not in the dictionary,
-    or if the voivodeship is already specified, the function returns the current voivodeship value.
+    return {'city': city, 'found': 1, 'lat': lat, 'lon': lon, 'voivodeship': voivodeship}
 
-    Parameters:
-    - row (pd.Series): A pandas Series representing a single job offer, including 'location' and
-                       'voivodeship' fields.
-    - geo_dict (dict): A dictionary containing geographic data, mapping locations to their
-                       respective voivodeships.
 
-    Returns:
-    - str: The voivodeship of the job offer, either retrieved from the geographic data dictionary or
-           the original value in the Series.
+def get_geodata():
     """
-    if pd.isna(row['voivodeship']):
-        if row['location'] in geo_dict:
-            return geo_dict[row['location']]['voivodeship']
-        else:
-            return 'Not specified'
-    else:
-        return row['voivodeship']
+     This function reads unique cities of offers with unspecified voivodeships and gets their geographic
+     data. Cities are first looked up in the persistent cache (the 'geocodes' table), which also remembers
+     cities unknown to Nominatim for GEO_MISS_TTL_DAYS. Only the remaining cities are queried from the
+     Nominatim API, concurrently but within its rate limit and with the headers required by its usage
+     policy (see 'get_nominatim_headers'), and the results are merged into the cache.
+     The geographic data of all cached cities is then saved to a file.
+     """
+    cities = query_offers(['location'], where="voivodeship IS NULL", distinct=True)['location'].dropna()
+
+    misses_since = (datetime.now() - timedelta(days=GEO_MISS_TTL_DAYS)).strftime("%Y-%m-%d %H:%M")
+    cached = load_geocodes(include_misses=True, misses_since=misses_since)
+
+    to_lookup = {}
+    for city in cities:
+        city_key = normalize_city(city)
+        if city_key not in cached:
+            to_lookup.setdefault(city_key, city)
+
+    print(f"Geographic data of {len(cities)} cities: {len(cities) - len(to_lookup)} cached, "
+          f"{len(to_lookup)} to look up")
+    metrics.inc('geocode_cache_hits', len(cities) - len(to_lookup))
+    metrics.inc('geocode_cache_misses', len(to_lookup))
+
+    if to_lookup:
+        session = get_session(NOMINATIM_WORKERS, get_nominatim_headers(), retries=0)
+        with ThreadPoolExecutor(max_workers=NOMINATIM_WORKERS) as executor:
+            results = executor.map(lambda city: geocode_city(session, city), to_lookup.values())
+            geocodes = {city_key: geo for city_key, geo in zip(to_lookup, results) if geo is not None}
+
+        save_geocodes(geocodes, datetime.now().strftime("%Y-%m-%d %H:%M"))
+
+    geo_dict = {
+        geo['city']: {'lat': geo['lat'], 'lon': geo['lon'], 'voivodeship': geo['voivodeship']}
+        for geo in load_geocodes().values()
+    }
+
+    with open(GEO_DICT_PATH, 'wb') as geo_file:
+        pickle.dump(geo_dict, geo_file)
 
 
 def geodata_todb():
     """
-    This function reads the existing job offers database and a geographic data dictionary from their
-    respective files. It then updates each job offer in DataFrame, filling in missing voivodeship
-    information using the geographic data dictionary. The updated DataFrame is used to update DB
+    This function fills in missing voivodeship information and coordinates of job offers using the cached
+    geographic data from the 'geocodes' table. Only offers with missing voivodeship are read from the database,
+    and their voivodeships and coordinates are assigned with vectorized maps of normalized locations (the same
+    normalization as 'normalize_city'). Cities cached as unknown to Nominatim get 'Not specified'. Offers
+    of cities which aren't cached at all (their lookup failed) stay missing so they can be filled in the next
+    run. Only the offers which got a voivodeship are written to DB, in one transaction.
     """
-    offers_db = load_from_db()
+    offers_db = query_offers(['id', 'location'], where="voivodeship IS NULL AND location IS NOT NULL")
+
+    if offers_db.empty:
+        return
 
-    with open(GEO_DICT_PATH, 'rb') as geo_file:
-        geo_dict = pickle.load(geo_file)
+    geocodes = load_geocodes(include_misses=True)
+    voivodeships = {
+        city_key: geo['voivodeship'] if geo['found'] else 'Not specified' for city_key, geo in geocodes.items()
+    }
 
-    offers_db['voivodeship'] = offers_db.apply(lambda row: fill_empty_voivodeship(row, geo_dict), axis=1)
+    city_keys = offers_db['location'].str.strip().str.lower()
+    offers_db['voivodeship'] = city_keys.map(voivodeships)
+    offers_db['lat'] = city_keys.map({city_key: geo['lat'] for city_key, geo in geocodes.items()})
+    offers_db['lon'] = city_keys.map({city_key: geo['lon'] for city_key, geo in geocodes.items()})
 
-    update_voivodeship(offers_db)
+    updated = update_geodata(offers_db.dropna(subset=['voivodeship']))
+    print(f"Voivodeship filled in {updated} of {offers_db.shape[0]} offers")
+    metrics.inc('geodata_updated', updated)
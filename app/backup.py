@@ -0,0 +1,290 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import yaml
+from datetime import datetime, timedelta
+
+from database import get_connection, get_table_columns, migrate, TIMESTAMP_FORMAT
+
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
+
+BACKUP_DIR = config['BACKUP_DIR']
+BACKUP_FULL_EVERY_DAYS = config['BACKUP_FULL_EVERY_DAYS']
+BACKUP_KEEP_FULL = config['BACKUP_KEEP_FULL']
+
+MANIFEST_NAME = 'manifest.json'
+
+# tables copied to a delta: offers changed since the previous backup, their technologies and updated geocodes
+create_delta_tables = """
+CREATE TABLE delta.offers AS SELECT * FROM main.offers WHERE updated_at >= :since;
+
+CREATE TABLE delta.offer_technologies AS
+SELECT * FROM main.offer_technologies WHERE offer_id IN (SELECT id FROM delta.offers);
+
+CREATE TABLE delta.technologies AS
+SELECT * FROM main.technologies WHERE id IN (SELECT technology_id FROM delta.offer_technologies);
+
+CREATE TABLE delta.geocodes AS SELECT * FROM main.geocodes WHERE updated_at >= substr(:since, 1, 16);
+"""
+
+
+def load_manifest():
+    """
+    This function loads the list of backups (from the oldest one) kept in the manifest of the backup directory.
+    Every backup is described by its 'file', 'kind' ('full' or 'delta'), 'created_at', 'since' (start
+    of the changes stored in a delta), 'offers' (number of offers in the database at that time) and 'sha256'.
+    """
+    manifest_path = os.path.join(BACKUP_DIR, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return []
+
+    with open(manifest_path, 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(backups: list):
+    """
+    This function saves the list of backups to the manifest. The manifest is replaced atomically,
+    so an interrupted write never leaves it corrupted.
+    """
+    manifest_path = os.path.join(BACKUP_DIR, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(backups, manifest_file, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def file_checksum(path: str):
+    """
+    This function returns SHA-256 checksum of the file, read in blocks.
+    """
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as checked_file:
+        for block in iter(lambda: checked_file.read(1 << 20), b''):
+            checksum.update(block)
+
+    return checksum.hexdigest()
+
+
+def compress_file(source: str, target: str):
+    """
+    This function compresses the source file with gzip into the target file and removes the source.
+    """
+    with open(source, 'rb') as source_file, gzip.open(target, 'wb') as target_file:
+        shutil.copyfileobj(source_file, target_file)
+    os.remove(source)
+
+
+def decompress_file(source: str, target: str):
+    """
+    This function decompresses the gzipped source file into the target file.
+    """
+    with gzip.open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+        shutil.copyfileobj(source_file, target_file)
+
+
+def create_backup(kind: str = None):
+    """
+    This function backs up the database into BACKUP_DIR. A full backup is a compressed copy of the whole
+    database made with SQLite's online backup API, so it's consistent even while the database is used.
+    Between full backups (made every BACKUP_FULL_EVERY_DAYS) only a compressed delta is written: offers
+    changed since the previous backup (by their 'updated_at'), their technologies and updated geocodes,
+    so daily backups grow with the day's changes rather than with the whole history. Old backups are
+    evicted afterwards (see 'evict_backups').
+
+    Parameters:
+    - kind (str, optional): 'full' or 'delta'. By default it's chosen according to BACKUP_FULL_EVERY_DAYS;
+                            a delta is never made before the first full backup.
+
+    Returns:
+    - dict: Description of the created backup, as stored in the manifest.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    backups = load_manifest()
+    now = datetime.now()
+    created_at = now.strftime(TIMESTAMP_FORMAT)
+
+    last_full = next((backup for backup in reversed(backups) if backup['kind'] == 'full'), None)
+    if last_full is None:
+        kind = 'full'
+    elif kind is None:
+        last_full_at = datetime.strptime(last_full['created_at'], TIMESTAMP_FORMAT)
+        full_due = last_full_at + timedelta(days=BACKUP_FULL_EVERY_DAYS)
+        kind = 'full' if now >= full_due else 'delta'
+
+    file_name = f"offers-{now.strftime('%Y%m%d-%H%M%S-%f')}-{kind}.sqlite.gz"
+    fd, tmp_path = tempfile.mkstemp(dir=BACKUP_DIR, suffix='.sqlite')
+    os.close(fd)
+
+    with get_connection() as connection:
+        since = None
+        if kind == 'full':
+            with sqlite3.connect(tmp_path) as backup_connection:
+                connection.backup(backup_connection)
+            backup_connection.close()
+        else:
+            since = backups[-1]['created_at']
+            os.remove(tmp_path)
+            connection.execute("ATTACH DATABASE ? AS delta", (tmp_path,))
+            for statement in create_delta_tables.split(';'):
+                if statement.strip():
+                    connection.execute(statement, {'since': since})
+            connection.commit()
+            connection.execute("DETACH DATABASE delta")
+        offers = connection.execute("SELECT COUNT(*) FROM offers").fetchone()[0]
+    connection.close()
+
+    backup_path = os.path.join(BACKUP_DIR, file_name)
+    compress_file(tmp_path, backup_path)
+
+    backup = {'file': file_name, 'kind': kind, 'created_at': created_at, 'since': since, 'offers': offers,
+              'sha256': file_checksum(backup_path)}
+    backups.append(backup)
+    save_manifest(backups)
+
+    evict_backups()
+
+    return backup
+
+
+def evict_backups(keep_full: int = BACKUP_KEEP_FULL):
+    """
+    This function applies the retention policy: only the 'keep_full' newest full backups are kept,
+    together with the deltas made after them. Older backups are removed from the disk and the manifest.
+    """
+    backups = load_manifest()
+    full_indexes = [i for i, backup in enumerate(backups) if backup['kind'] == 'full']
+    if len(full_indexes) <= keep_full:
+        return
+
+    first_kept = full_indexes[-keep_full]
+    for backup in backups[:first_kept]:
+        backup_path = os.path.join(BACKUP_DIR, backup['file'])
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+
+    save_manifest(backups[first_kept:])
+    print(f"Removed {first_kept} old backups")
+
+
+def apply_delta(connection: sqlite3.Connection, delta_path: str):
+    """
+    This function merges a delta backup into the restored database: offers and geocodes from the delta
+    replace the stored ones and technologies of the offers are rewritten. Only columns present in both
+    databases are copied, so deltas made before or after a schema migration can be applied as well.
+    """
+    connection.execute("ATTACH DATABASE ? AS delta", (delta_path,))
+
+    for table, conflict in [('technologies', 'IGNORE'), ('offers', 'REPLACE'), ('geocodes', 'REPLACE')]:
+        delta_columns = [column[1] for column in connection.execute(f"PRAGMA delta.table_info({table})")]
+        columns = ', '.join(column for column in get_table_columns(connection, table) if column in delta_columns)
+        connection.execute(f"INSERT OR {conflict} INTO main.{table} ({columns}) SELECT {columns} FROM delta.{table}")
+
+    connection.execute("DELETE FROM main.offer_technologies WHERE offer_id IN (SELECT id FROM delta.offers)")
+    connection.execute("""
+        INSERT INTO main.offer_technologies (offer_id, position, technology_id)
+        SELECT offer_id, position, technology_id FROM delta.offer_technologies
+        """)
+
+    connection.commit()
+    connection.execute("DETACH DATABASE delta")
+
+
+def restore_backup(target_path: str, until: str = None, force: bool = False):
+    """
+    This function restores the database from the backups into target_path: the newest full backup
+    made before 'until' is decompressed and the deltas made after it are applied in order. Checksums
+    of the backup files are checked before they are used, and the restored database is verified
+    with SQLite's integrity check and against the number of offers recorded in the manifest.
+
+    Parameters:
+    - target_path (str): Path of the restored database.
+    - until (str, optional): Restore the state from this time ('%Y-%m-%d %H:%M:%S', or a prefix
+                             of it, e.g. a date). Defaults to the newest backup.
+    - force (bool, optional): Whether to overwrite an existing file at target_path.
+
+    Returns:
+    - dict: Description of the last applied backup.
+    """
+    if os.path.exists(target_path) and not force:
+        raise FileExistsError(f"{target_path} already exists, use force to overwrite it")
+
+    backups = [backup for backup in load_manifest() if until is None or backup['created_at'][:len(until)] <= until]
+    full_indexes = [i for i, backup in enumerate(backups) if backup['kind'] == 'full']
+    if not full_indexes:
+        raise ValueError("No full backup to restore from")
+    chain = backups[full_indexes[-1]:]
+
+    for backup in chain:
+        if file_checksum(os.path.join(BACKUP_DIR, backup['file'])) != backup['sha256']:
+            raise ValueError(f"Checksum of backup {backup['file']} doesn't match the manifest")
+
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(target_path + suffix):
+            os.remove(target_path + suffix)
+    decompress_file(os.path.join(BACKUP_DIR, chain[0]['file']), target_path)
+
+    with get_connection(target_path) as connection:
+        migrate(connection, snapshot=False)
+        for backup in chain[1:]:
+            with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as tmp_dir:
+                delta_path = os.path.join(tmp_dir, 'delta.sqlite')
+                decompress_file(os.path.join(BACKUP_DIR, backup['file']), delta_path)
+                apply_delta(connection, delta_path)
+
+        integrity = connection.execute("PRAGMA integrity_check").fetchone()[0]
+        offers = connection.execute("SELECT COUNT(*) FROM offers").fetchone()[0]
+    connection.close()
+
+    if integrity != 'ok':
+        raise ValueError(f"Restored database is corrupted: {integrity}")
+    if offers != chain[-1]['offers']:
+        raise ValueError(f"Restored database has {offers} offers, but backup {chain[-1]['file']} "
+                         f"had {chain[-1]['offers']}")
+
+    print(f"Restored {offers} offers from {len(chain)} backups (state from {chain[-1]['created_at']}) "
+          f"to {target_path}")
+
+    return chain[-1]
+
+
+def verify_backups():
+    """
+    This function checks that the newest backups can be restored, by restoring them into a temporary file.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        restore_backup(os.path.join(tmp_dir, 'offers.sqlite'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backups of the offers database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help="back up the database")
+    backup_parser.add_argument('--kind', choices=['full', 'delta'])
+
+    subparsers.add_parser('list', help="list the backups")
+    subparsers.add_parser('verify', help="check that the newest backups can be restored")
+
+    restore_parser = subparsers.add_parser('restore', help="restore the database from the backups")
+    restore_parser.add_argument('target', help="path of the restored database")
+    restore_parser.add_argument('--until', help="restore the state from this time, e.g. 2024-05-01")
+    restore_parser.add_argument('--force', action='store_true', help="overwrite the target if it exists")
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        print(create_backup(args.kind))
+    elif args.command == 'list':
+        for backup in load_manifest():
+            print(f"{backup['created_at']}  {backup['kind']:5}  {backup['offers']:>8} offers  {backup['file']}")
+    elif args.command == 'verify':
+        verify_backups()
+    else:
+        restore_backup(args.target, args.until, args.force)
@@ -0,0 +1,657 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+import pandas as pd
+from bs4 import BeautifulSoup
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import additional_data
+import backup
+import database
+from cleaning import normalize_salaries, apply_offers_schema, concat_offers, offer_fingerprints, duplicates_columns
+from cleaning import SALARY_AMOUNT_JJIT, SALARY_AMOUNT_PRACUJ, SALARY_HOURLY_PRACUJ
+from commons import SeenLinks, HTML_PARSER
+from jjit import split_salary_jjit, parse_data_jjit, clear_data_jjit, parser_jjit
+from pracuj import clear_salary_pracuj, parse_page_pracuj, clear_data_pracuj, parser_pracuj
+from new_data import save_and_backup
+
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
+
+BENCHMARK_BASELINE_PATH = config['BENCHMARK_BASELINE_PATH']
+BENCHMARK_THRESHOLD = config['BENCHMARK_THRESHOLD']
+
+# number of offer cards on one generated listing page
+PAGE_SIZE = 50
+
+technologies = ['Python', 'SQL', 'Java', 'JavaScript', 'TypeScript', 'React', 'Docker', 'Kubernetes', 'AWS', 'Azure',
+                'Git', 'Linux', 'C#', '.NET', 'Go', 'Spark', 'Kafka', 'PostgreSQL', 'Terraform', 'Angular']
+
+
+def generate_salaries_jjit(n: int, seed: int = 0):
+    """
+    This function generates n synthetic salary strings in the justjoin.it format
+    (ranges, single values and undisclosed salaries in different currencies).
+    """
+    rng = random.Random(seed)
+    salaries = []
+
+    for _ in range(n):
+        kind = rng.random()
+        low = rng.randrange(3000, 40000, 100)
+        currency = rng.choice(['PLN', 'PLN', 'PLN', 'EUR', 'USD'])
+        if kind < 0.2:
+            salaries.append('Undisclosed Salary')
+        elif kind < 0.8:
+            high = low + rng.randrange(0, 15000, 500)
+            salaries.append(f"{low:,} - {high:,} {currency}".replace(',', ' '))
+        else:
+            salaries.append(f"{low:,} {currency}".replace(',', ' '))
+
+    return pd.Series(salaries)
+
+
+def generate_salaries_pracuj(n: int, seed: int = 0):
+    """
+    This function generates n synthetic salary strings in the pracuj.pl format
+    (monthly and hourly ranges, single values and undisclosed salaries).
+    """
+    rng = random.Random(seed)
+    salaries = []
+
+    for _ in range(n):
+        kind = rng.random()
+        contract = rng.choice(['brutto', 'netto (+ VAT)'])
+        if kind < 0.3:
+            salaries.append('Undisclosed Salary')
+        elif kind < 0.8:
+            low = rng.randrange(3000, 40000, 100)
+            high = low + rng.randrange(0, 15000, 500)
+            salaries.append(f"{low}–{high}zł/mies. {contract}")
+        elif kind < 0.9:
+            low = rng.randrange(30, 250, 5)
+            salaries.append(f"{low}–{low + 20}zł/godz. {contract}")
+        else:
+            salaries.append(f"{rng.randrange(3000, 40000, 100)}zł/mies. {contract}")
+
+    return pd.Series(salaries)
+
+
+def benchmark_salaries(n: int = 100000):
+    """
+    This function compares the row-wise salary cleaners ('split_salary_jjit', 'clear_salary_pracuj')
+    with the vectorized 'normalize_salaries' on n synthetic salary strings of each site. It checks
+    that both give identical results and prints the time of each of them and the speedup.
+    """
+    cases = [
+        ('justjoin.it', generate_salaries_jjit(n), split_salary_jjit, (SALARY_AMOUNT_JJIT,)),
+        ('pracuj.pl', generate_salaries_pracuj(n), clear_salary_pracuj, (SALARY_AMOUNT_PRACUJ, SALARY_HOURLY_PRACUJ)),
+    ]
+
+    for site, salaries, row_function, patterns in cases:
+        start_time = time.perf_counter()
+        expected = salaries.apply(row_function)
+        row_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        result = normalize_salaries(salaries, *patterns)
+        vectorized_time = time.perf_counter() - start_time
+
+        expected.columns = ['salary_low', 'salary_high', 'salary_avg']
+        pd.testing.assert_frame_equal(expected.astype(float), result)
+
+        print(f"{site}: {n} salaries - row-wise {row_time:.3f} s, vectorized {vectorized_time:.3f} s "
+              f"({row_time / vectorized_time:.1f}x faster), results identical")
+
+
+# columns of the offers generated by 'generate_offers'
+offers_columns = ['site', 'experience', 'name', 'company', 'location', 'work_mode', 'salary_avg', 'salary_low',
+                  'salary_high', 'link', 'added_at', 'voivodeship']
+
+
+def generate_offers(n: int, seed: int = 0, added_at: str = None):
+    """
+    This function generates n synthetic offers with 'offers_columns' (the columns filled in
+    by scraping), as tuples ready to be inserted into the database.
+    """
+    rng = random.Random(seed)
+    sites = ['justjoin.it', 'pracuj.pl']
+    experiences = ['junior', 'mid', 'senior', 'c-level']
+    cities = ['Warszawa', 'Kraków', 'Wrocław', 'Gdańsk', 'Poznań', 'Łódź', 'Katowice', 'Lublin', 'Szczecin']
+    voivodeships = ['mazowieckie', 'małopolskie', 'dolnośląskie', 'pomorskie', 'wielkopolskie', 'łódzkie',
+                    'śląskie', 'lubelskie', 'zachodniopomorskie', None]
+    work_modes = ['Praca zdalna', 'Praca hybrydowa', 'Praca stacjonarna']
+
+    offers = []
+    for i in range(n):
+        site = rng.choice(sites)
+        salary_low = rng.randrange(3000, 40000, 100)
+        salary_high = salary_low + rng.randrange(0, 15000, 500)
+        offers.append((
+            site, rng.choice(experiences), f"Offer {seed}-{i}", f"Company {rng.randrange(n // 10 + 1)}",
+            rng.choice(cities), rng.choice(work_modes), (salary_low + salary_high) / 2, salary_low, salary_high,
+            f"https://{site}/offers/{seed}-{i}",
+            added_at or f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00", rng.choice(voivodeships),
+        ))
+
+    return offers
+
+
+def time_queries(connection: sqlite3.Connection, repeat: int = 3):
+    """
+    This function measures the best of 'repeat' runs of the queries used by the pipeline.
+
+    Returns:
+    - dict: A dictionary mapping names of the queries to their times in seconds.
+    """
+    queries = {
+        'known links': ("SELECT DISTINCT link FROM offers WHERE link IS NOT NULL", ()),
+        'cities without voivodeship': (
+            "SELECT DISTINCT location FROM offers WHERE voivodeship IS NULL AND location IS NOT NULL", ()),
+        'offers added since date': ("SELECT COUNT(*) FROM offers WHERE added_at >= ?", ('2024-12-01',)),
+        'offers from voivodeship': ("SELECT COUNT(*) FROM offers WHERE voivodeship = ?", ('pomorskie',)),
+        '100 lookups by link': ("SELECT id FROM offers WHERE link = ?", None),
+    }
+
+    times = {}
+    for name, (query, params) in queries.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            if params is None:
+                for i in range(100):
+                    connection.execute(query, (f"https://pracuj.pl/offers/0-{i * 997}",)).fetchall()
+            else:
+                connection.execute(query, params).fetchall()
+            best = min(best, time.perf_counter() - start_time)
+        times[name] = best
+
+    return times
+
+
+def time_save(n: int, seed: int):
+    """
+    This function measures the time of saving a batch of n new offers with 'save_to_db'.
+    """
+    offers = pd.DataFrame(generate_offers(n, seed, added_at='2025-01-01 10:00'), columns=offers_columns)
+    offers['technologies'] = [['Python', 'SQL']] * n
+
+    start_time = time.perf_counter()
+    database.save_to_db(offers)
+
+    return time.perf_counter() - start_time
+
+
+def benchmark_database(n: int = 1000000, batch: int = 1000):
+    """
+    This function generates a database with n offers and compares query and insert latency before
+    and after the tuning done by 'database.py': without the pipeline indexes and with default
+    connection settings, then with the indexes created by 'create_indexes' and connections
+    from 'get_connection' (WAL, synchronous=NORMAL, mmap and cache size).
+    """
+    db_path, pragmas = database.DB_PATH, database.DB_PRAGMAS
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, 'offers.sqlite')
+        try:
+            database.DB_PRAGMAS = {}
+            database.create_db_if_not_exists()
+            with sqlite3.connect(database.DB_PATH) as connection:
+                for index in database.offers_indexes:
+                    connection.execute(f"DROP INDEX {index}")
+                connection.execute("PRAGMA journal_mode = DELETE")
+                placeholders = ','.join('?' * len(offers_columns))
+                connection.executemany(
+                    f"INSERT INTO offers ({', '.join(offers_columns)}) VALUES ({placeholders})",
+                    generate_offers(n)
+                )
+                connection.commit()
+
+            with sqlite3.connect(database.DB_PATH) as connection:
+                before = time_queries(connection)
+            before['save batch of new offers'] = time_save(batch, seed=1)
+
+            database.DB_PRAGMAS = pragmas
+            with database.get_connection() as connection:
+                database.create_indexes(connection)
+                after = time_queries(connection)
+            after['save batch of new offers'] = time_save(batch, seed=2)
+        finally:
+            database.DB_PATH = db_path
+            database.DB_PRAGMAS = pragmas
+
+    print(f"Database with {n} offers (batch of {batch} offers saved):")
+    for name in before:
+        print(f"{name}: before {before[name] * 1000:.1f} ms, after {after[name] * 1000:.1f} ms "
+              f"({before[name] / after[name]:.1f}x)")
+
+
+def benchmark_memory(n: int = 1000000):
+    """
+    This function compares n generated offers kept with object columns (as they were before the typed
+    offers schema) and with the typed schema ('apply_offers_schema') and fingerprints computed while
+    cleaning: memory used by the DataFrames and time of the concat and dedup steps of 'merge_offers'
+    (on the duplicates columns for object columns, on fingerprints for the typed schema).
+    """
+    offers = pd.DataFrame(generate_offers(n), columns=offers_columns)
+    offers['technologies'] = [['Python', 'SQL']] * n
+    typed_offers = apply_offers_schema(offers.assign(fingerprint=offer_fingerprints(offers)))
+    halves = {
+        'object columns': [offers.iloc[:n // 2].astype(object), offers.iloc[n // 4:].astype(object)],
+        'typed schema': [typed_offers.iloc[:n // 2], typed_offers.iloc[n // 4:]],
+    }
+    concat = {'object columns': pd.concat, 'typed schema': concat_offers}
+    dedup = {
+        'object columns': lambda merged: merged.drop_duplicates(subset=duplicates_columns),
+        'typed schema': lambda merged: merged[~merged['fingerprint'].duplicated()],
+    }
+
+    for name, frames in halves.items():
+        memory = sum(frame.memory_usage(deep=True).sum() for frame in frames) / 2 ** 20
+
+        start_time = time.perf_counter()
+        merged = concat[name](frames)
+        concat_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        merged = dedup[name](merged)
+        dedup_time = time.perf_counter() - start_time
+
+        print(f"{name}: {memory:.1f} MiB, concat {concat_time:.3f} s, dedup {dedup_time:.3f} s "
+              f"({merged.shape[0]} offers)")
+
+
+def wrap_page(cards: str):
+    """
+    This function wraps offer cards into a listing page with the usual markup around them (head with styles
+    and a script with the state of the app, navigation, filters and footer), which makes up a large part
+    of real listing pages.
+    """
+    links = ''.join(f'<li class="nav-item"><a class="nav-link" href="/category/{i}"><span>Category {i}</span></a></li>'
+                    for i in range(100))
+    filters = ''.join(f'<label class="filter"><input type="checkbox" name="filter-{i}"><span>Filter {i}</span></label>'
+                      for i in range(100))
+    state = json.dumps({'offers': [{'id': i, 'slug': f'offer-{i}', 'tags': ['a', 'b', 'c']} for i in range(200)]})
+
+    return (f'<html><head><style>{".css-x { color: red; } " * 200}</style><script>window.__STATE__ = {state}'
+            f'</script></head><body><header><nav><ul>{links}</ul></nav></header><aside>{filters}</aside>'
+            f'<main><div>{cards}</div></main><footer><ul>{links}</ul></footer></body></html>')
+
+
+def generate_pages_jjit(n: int, seed: int = 0, page_size: int = PAGE_SIZE):
+    """
+    This function generates listing pages of justjoin.it with n offer cards in total (page_size cards per page).
+    The cards have the markup read by 'extract_features_jjit', so they stand in for recorded pages offline.
+    """
+    rng = random.Random(seed)
+    salaries = generate_salaries_jjit(n, seed)
+    cities = ['Warszawa', 'Warsaw', 'Kraków', 'Wrocław', 'Gdańsk', 'Poznań', 'Łódź', 'Katowice']
+
+    cards = []
+    for i, salary in enumerate(salaries):
+        work_mode = rng.choice(['Fully remote', 'Hybrid', None])
+        work_mode = f'<div class="css-7ktfgf">{work_mode}</div>' if work_mode else ''
+        techs = ''.join(f'<div class="css-1am4i4o">{tech}</div>' for tech in rng.sample(technologies, 3))
+        cards.append(
+            f'<div class="css-2crog7"><a class="offer_list_offer_link css-4lqp8g" href="/offers/{seed}-{i}"></a>'
+            f'<h2 class="css-1gehlh0">Offer {seed}-{i}</h2><div class="css-aryx9u">Company {rng.randrange(n // 10 + 1)}'
+            f'</div><div class="css-17pspck">{salary}</div><div class="css-11qgze1">{rng.choice(cities)}, Centrum</div>'
+            f'{work_mode}<div class="css-yicj0q">{techs}</div></div>'
+        )
+
+    return [wrap_page(''.join(cards[start:start + page_size])) for start in range(0, n, page_size)]
+
+
+def generate_pages_pracuj(n: int, seed: int = 0, page_size: int = PAGE_SIZE):
+    """
+    This function generates listing pages of pracuj.pl with n offer cards in total (page_size cards per page).
+    The cards have the markup read by 'extract_features_pracuj', so they stand in for recorded pages offline.
+    """
+    rng = random.Random(seed)
+    salaries = generate_salaries_pracuj(n, seed)
+    experiences = ['Młodszy specjalista (Junior)', 'Specjalista (Mid / Regular)', 'Starszy specjalista (Senior)',
+                   'Ekspert', 'Kierownik / Koordynator']
+    locations = ['Warszawa, Mokotów', 'Kraków, Podgórze', 'Siedziba firmy: Wrocław', 'Gdańsk', 'Poznań']
+    work_modes = ['Praca stacjonarna', 'Praca hybrydowa', 'Praca zdalna', 'Praca hybrydowa, Praca zdalna']
+
+    cards = []
+    for i, salary in enumerate(salaries):
+        salary = '' if salary == 'Undisclosed Salary' else f'<span class="s1jki39v">{salary}</span>'
+        techs = ''.join(f'<span>{tech}</span>' for tech in rng.sample(technologies, 3))
+        cards.append(
+            f'<div class="be8lukl core_po9665q"><div class="c1fljezf"><div class="c1wygkax">'
+            f'<h2>Offer {seed}-{i}</h2><h4>Company {rng.randrange(n // 10 + 1)}</h4><h5>{rng.choice(locations)}</h5>'
+            f'<a href="https://www.pracuj.pl/praca/{seed}-{i}"></a><ul><li>{rng.choice(experiences)}</li>'
+            f'<li>{rng.choice(work_modes)}</li></ul>{salary}</div><div class="b1fdzgc4">{techs}</div></div></div>'
+        )
+
+    return [wrap_page(''.join(cards[start:start + page_size])) for start in range(0, n, page_size)]
+
+
+def load_fixtures(directory: str, site: str):
+    """
+    This function loads listing pages of the site saved as HTML files in 'directory/site' (e.g. pages saved
+    from the browser or with 'fetch_page'), sorted by file name.
+    """
+    site_directory = os.path.join(directory, site)
+    pages = []
+    for file_name in sorted(os.listdir(site_directory)):
+        if file_name.endswith('.html'):
+            with open(os.path.join(site_directory, file_name), 'r', encoding='utf-8') as page_file:
+                pages.append(page_file.read())
+
+    return pages
+
+
+def parse_pages_jjit(pages: list):
+    """
+    This function parses listing pages of justjoin.it with 'parse_data_jjit', as if they were page sources of a driver.
+    """
+    offers, links = [], SeenLinks()
+    for page in pages:
+        offers, links = parse_data_jjit(SimpleNamespace(page_source=page), offers, links)
+
+    return offers
+
+
+def parse_pages_pracuj(pages: list):
+    """
+    This function parses listing pages of pracuj.pl with 'parse_page_pracuj'.
+    """
+    offers, links = [], SeenLinks()
+    for page in pages:
+        offers, links = parse_page_pracuj(page, offers, links)
+
+    return offers
+
+
+def reference_parse_jjit(pages: list):
+    """
+    Reference implementation of parsing justjoin.it pages as it was before 'PageParser': the tree of the whole
+    page is built with 'html.parser' and walked with 'find' calls on class names. It is kept to verify and
+    benchmark the parsing of offer cards with precompiled selectors.
+    """
+    offers, links = [], SeenLinks()
+    for page in pages:
+        for offer in BeautifulSoup(page, 'html.parser').find_all('div', class_="css-2crog7"):
+            link = offer.find('a', class_="offer_list_offer_link css-4lqp8g")['href']
+            if link in links:
+                continue
+            links.add(link)
+            try:
+                work_mode = offer.find('div', class_="css-7ktfgf").text
+            except (IndexError, AttributeError):
+                work_mode = "Not specified"
+            technology = offer.find('div', class_="css-yicj0q").find_all('div', class_='css-1am4i4o')
+            offers.append([offer.find('h2', class_="css-1gehlh0").text, offer.find('div', class_="css-aryx9u").text,
+                           offer.find('div', class_="css-17pspck").text, offer.find('div', class_="css-11qgze1").text,
+                           work_mode, [tech.text for tech in technology], link])
+
+    return offers
+
+
+def reference_parse_pracuj(pages: list):
+    """
+    Reference implementation of parsing pracuj.pl pages as it was before 'PageParser' (see 'reference_parse_jjit').
+    """
+    offers, links = [], SeenLinks()
+    for page in pages:
+        for offer in BeautifulSoup(page, 'html.parser').find_all('div', class_="be8lukl core_po9665q"):
+            whole_offer = offer.find('div', class_="c1fljezf")
+            offer_details = whole_offer.find('div', class_="c1wygkax")
+            keywords = whole_offer.find_all('div', class_='b1fdzgc4')
+            link = offer_details.a['href']
+            if link in links:
+                continue
+            links.add(link)
+            try:
+                salary = offer_details.find('span', class_="s1jki39v").text.replace(u'\xa0', u'')
+            except (IndexError, AttributeError):
+                salary = 'Undisclosed Salary'
+            techs = [keyword.text for keyword in keywords[0].find_all('span')] if keywords else []
+            offers.append([offer_details.find('li').text, offer_details.h2.text, offer_details.h4.text,
+                           offer_details.h5.text, offer_details.find_all('li')[-1].text, salary, techs, link])
+
+    return offers
+
+
+def benchmark_parsers(n: int = 10000, fixtures: str = None, repeat: int = 3):
+    """
+    This function compares parsing of listing pages of both sites before and after 'PageParser': the reference
+    implementations building the tree of whole pages with 'html.parser', then parsing of offer cards only,
+    with precompiled selectors, with 'html.parser' and with 'lxml' (if installed). It checks that all of them
+    extract identical fields and prints the parse time per page. Pages are loaded from the fixtures directory
+    (see 'load_fixtures') if given, otherwise n offers of each site are generated.
+    """
+    builders = ['html.parser', 'lxml'] if HTML_PARSER == 'lxml' else ['html.parser']
+    cases = [
+        ('justjoin.it', generate_pages_jjit, reference_parse_jjit, parse_pages_jjit, parser_jjit),
+        ('pracuj.pl', generate_pages_pracuj, reference_parse_pracuj, parse_pages_pracuj, parser_pracuj),
+    ]
+
+    for site, generate_pages, reference_parse, parse_pages, page_parser in cases:
+        pages = load_fixtures(fixtures, site) if fixtures else generate_pages(n)
+        expected = reference_parse(pages)
+        reference_time = measure(reference_parse, setup=lambda: (pages,), repeat=repeat)['seconds']
+        print(f"{site}: {len(pages)} pages, {len(expected)} offers - reference (whole page, html.parser) "
+              f"{reference_time / len(pages) * 1000:.2f} ms per page")
+
+        default_builder = page_parser.parser
+        try:
+            for builder in builders:
+                page_parser.parser = builder
+                if parse_pages(pages) != expected:
+                    raise AssertionError(f"Offers of {site} parsed with {builder} differ from the reference")
+                parse_time = measure(parse_pages, setup=lambda: (pages,), repeat=repeat)['seconds']
+                print(f"{site}: offer cards only, {builder} {parse_time / len(pages) * 1000:.2f} ms per page "
+                      f"({reference_time / parse_time:.1f}x faster), fields identical")
+        finally:
+            page_parser.parser = default_builder
+
+
+def generate_database(path: str, n: int, seed: int = 0):
+    """
+    This function creates a database with the schema of the pipeline (all migrations applied) and n generated
+    offers with fingerprints and three technologies each. Offers are inserted directly in chunks, which is much
+    faster than 'save_to_db', so databases of millions of offers can be generated in a reasonable time.
+    """
+    with database.get_connection(path) as connection:
+        database.migrate(connection)
+
+        columns = offers_columns + ['fingerprint', 'updated_at']
+        placeholders = ','.join('?' * len(columns))
+        for start in range(0, n, database.DB_CHUNK_SIZE):
+            offers = pd.DataFrame(generate_offers(min(database.DB_CHUNK_SIZE, n - start), seed + start),
+                                  columns=offers_columns)
+            offers['fingerprint'] = offer_fingerprints(offers)
+            offers['updated_at'] = offers['added_at']
+            connection.executemany(f"INSERT INTO offers ({', '.join(columns)}) VALUES ({placeholders})",
+                                   offers.itertuples(index=False, name=None))
+
+        connection.executemany("INSERT INTO technologies (name) VALUES (?)", [(tech,) for tech in technologies])
+        for position in range(3):
+            connection.execute(
+                "INSERT INTO offer_technologies (offer_id, position, technology_id) "
+                "SELECT id, ?, (id * 7 + ?) % ? + 1 FROM offers", (position, position * 5, len(technologies))
+            )
+        connection.commit()
+    connection.close()
+
+
+@contextmanager
+def sandbox(tmp_dir: str, db_path: str):
+    """
+    Points the database, backups and technologies dictionary of the pipeline to files in tmp_dir,
+    so the benchmarks never touch the real database.
+    """
+    paths = database.DB_PATH, backup.BACKUP_DIR, additional_data.TECH_DICT_PATH
+    database.DB_PATH = db_path
+    backup.BACKUP_DIR = os.path.join(tmp_dir, 'backups')
+    additional_data.TECH_DICT_PATH = os.path.join(tmp_dir, 'tech_dict')
+    try:
+        yield
+    finally:
+        database.DB_PATH, backup.BACKUP_DIR, additional_data.TECH_DICT_PATH = paths
+
+
+def measure(function, setup=None, repeat: int = 3):
+    """
+    This function measures the best time of 'repeat' runs of the function and the peak memory allocated
+    during one additional run (traced separately, since tracing slows the function down). If setup is
+    given, it is called before every run (outside of the measurement) and returns the arguments of the function.
+
+    Returns:
+    - dict: Time in seconds ('seconds') and peak allocated memory in MiB ('peak_mib').
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start_time = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start_time)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': best, 'peak_mib': peak / 2 ** 20}
+
+
+def run_suite(n: int = 10000, db_offers: int = 100000, batch: int = 1000, repeat: int = 3):
+    """
+    This function times the pipeline functions offline: parsing of generated listing pages of both sites
+    ('parse_data_jjit', 'parse_page_pracuj', which call 'extract_features_*'), cleaning of the parsed offers
+    ('clear_data_*'), saving a batch of new offers into a generated database of db_offers offers
+    ('save_and_backup', on a fresh copy of the database and an empty backup directory every time, so each run
+    makes a full backup) and 'create_tech_dict' on that database. The number of parsed offers is checked,
+    so a parser which stops finding the offer cards fails the suite instead of getting faster.
+
+    Returns:
+    - dict: A dictionary mapping names of the benchmarks to their times and peak memory (see 'measure').
+    """
+    pages_jjit, pages_pracuj = generate_pages_jjit(n), generate_pages_pracuj(n)
+
+    offers_jjit, offers_pracuj = parse_pages_jjit(pages_jjit), parse_pages_pracuj(pages_pracuj)
+    for site, offers in [('justjoin.it', offers_jjit), ('pracuj.pl', offers_pracuj)]:
+        if len(offers) != n:
+            raise AssertionError(f"Parsed {len(offers)} of {n} generated {site} offers")
+
+    results = {
+        'parse_jjit': measure(parse_pages_jjit, setup=lambda: (pages_jjit,), repeat=repeat),
+        'parse_pracuj': measure(parse_pages_pracuj, setup=lambda: (pages_pracuj,), repeat=repeat),
+        'clear_data_jjit': measure(lambda: clear_data_jjit(offers_jjit), repeat=repeat),
+        'clear_data_pracuj': measure(lambda: clear_data_pracuj(offers_pracuj), repeat=repeat),
+    }
+
+    new_offers = pd.DataFrame(generate_offers(batch, seed=n + db_offers, added_at='2025-01-01 10:00'),
+                              columns=offers_columns)
+    new_offers['technologies'] = [['Python', 'SQL']] * batch
+    new_offers = apply_offers_schema(new_offers.assign(fingerprint=offer_fingerprints(new_offers)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generated_path = os.path.join(tmp_dir, 'generated.sqlite')
+        db_path = os.path.join(tmp_dir, 'offers.sqlite')
+        generate_database(generated_path, db_offers)
+
+        def fresh_database():
+            shutil.rmtree(os.path.join(tmp_dir, 'backups'), ignore_errors=True)
+            shutil.copy(generated_path, db_path)
+            return (new_offers,)
+
+        with sandbox(tmp_dir, db_path):
+            results['save_and_backup'] = measure(save_and_backup, setup=fresh_database, repeat=repeat)
+            results['create_tech_dict'] = measure(additional_data.create_tech_dict, repeat=repeat)
+
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float = BENCHMARK_THRESHOLD):
+    """
+    This function prints the results next to the baseline and returns the regressions: benchmarks whose time
+    or peak memory exceeds the baseline more than 'threshold' times.
+
+    Returns:
+    - list: Descriptions of the regressions (empty if there are none).
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name}: {result['seconds'] * 1000:.1f} ms, {result['peak_mib']:.1f} MiB (no baseline)")
+            continue
+
+        print(f"{name}: {result['seconds'] * 1000:.1f} ms (baseline {base['seconds'] * 1000:.1f} ms), "
+              f"{result['peak_mib']:.1f} MiB (baseline {base['peak_mib']:.1f} MiB)")
+        for metric, unit in [('seconds', 's'), ('peak_mib', 'MiB')]:
+            if result[metric] > base[metric] * threshold:
+                regressions.append(f"{name}: {metric} {result[metric]:.3f} {unit} > {threshold} x "
+                                   f"baseline {base[metric]:.3f} {unit}")
+
+    return regressions
+
+
+def main():
+    """
+    Command line interface of the benchmarks. By default the suite ('run_suite') is run and compared with
+    the baseline stored for the same sizes in BENCHMARK_BASELINE_PATH; the exit code is 1 if any benchmark
+    regressed beyond the threshold. '--save-baseline' stores the results as the new baseline. Baselines
+    depend on the machine, so they should be recorded on the box where the suite is compared.
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the pipeline.")
+    parser.add_argument('--offers', type=int, default=10000, help="number of generated offers of each site")
+    parser.add_argument('--db-offers', type=int, default=100000, help="number of offers in the generated database")
+    parser.add_argument('--batch', type=int, default=1000, help="number of new offers saved by 'save_and_backup'")
+    parser.add_argument('--repeat', type=int, default=3, help="number of timed runs of each benchmark")
+    parser.add_argument('--threshold', type=float, default=BENCHMARK_THRESHOLD,
+                        help="allowed ratio of the result to the baseline")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--comparisons', action='store_true',
+                        help="run the before/after comparisons of salaries, parsers, database and memory instead")
+    parser.add_argument('--fixtures', help="directory with saved listing pages ('justjoin.it/*.html', "
+                                           "'pracuj.pl/*.html') for the parsers comparison")
+    args = parser.parse_args()
+
+    if args.comparisons:
+        benchmark_salaries()
+        benchmark_parsers(args.offers, args.fixtures, args.repeat)
+        benchmark_database()
+        benchmark_memory()
+        return
+
+    results = run_suite(args.offers, args.db_offers, args.batch, args.repeat)
+    key = f"offers={args.offers},db_offers={args.db_offers},batch={args.batch}"
+
+    baselines = {}
+    if os.path.exists(BENCHMARK_BASELINE_PATH):
+        with open(BENCHMARK_BASELINE_PATH, 'r') as baseline_file:
+            baselines = json.load(baseline_file)
+
+    regressions = compare_with_baseline(results, baselines.get(key, {}), args.threshold)
+
+    if args.save_baseline:
+        baselines[key] = results
+        os.makedirs(os.path.dirname(BENCHMARK_BASELINE_PATH) or '.', exist_ok=True)
+        with open(BENCHMARK_BASELINE_PATH, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2)
+        print(f"Baseline saved to {BENCHMARK_BASELINE_PATH} ({key})")
+    elif regressions:
+        print("Regressions:\n" + '\n'.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+import json
+import os
+import yaml
+from datetime import datetime, timedelta
+
+from database import get_connection, TIMESTAMP_FORMAT
+
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
+
+CRAWL_JOURNAL_PATH = config['CRAWL_JOURNAL_PATH']
+CRAWL_JOURNAL_MAX_AGE = config['CRAWL_JOURNAL_MAX_AGE']
+
+create_journal_tables = """
+CREATE TABLE IF NOT EXISTS crawl_runs (
+id INTEGER PRIMARY KEY,
+categories TEXT NOT NULL,
+started_at TEXT NOT NULL,
+finished_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS crawl_units (
+run_id INTEGER NOT NULL,
+site TEXT NOT NULL,
+url TEXT NOT NULL,
+page INTEGER NOT NULL,
+pages INTEGER,
+offers TEXT NOT NULL,
+completed_at TEXT NOT NULL,
+PRIMARY KEY (run_id, site, url, page)
+) WITHOUT ROWID;
+"""
+
+
+class CrawlJournal:
+    """
+    Checkpoint of a crawl, kept in a local SQLite file (CRAWL_JOURNAL_PATH), separate from the offers database.
+
+    Every completed unit of work - a page of a search URL of a site; the URL identifies the category and level
+    of experience - is recorded with the raw offers extracted from it as soon as it is scraped. If the run
+    crashes, the next run with the same categories resumes it: finished units are read back from the journal
+    instead of being scraped again. Runs older than max_age hours are not resumed, as their listings are stale.
+    When the whole run succeeds, its units are removed.
+
+    Usage:
+        journal = CrawlJournal()
+        journal.start(categories)
+        completed = journal.get('pracuj.pl', url)
+        if page not in completed:
+            journal.record('pracuj.pl', url, page, offers, pages)
+        journal.finish()
+    """
+
+    def __init__(self, path: str = CRAWL_JOURNAL_PATH, max_age: float = CRAWL_JOURNAL_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.run_id = None
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with get_connection(self.path) as connection:
+            connection.executescript(create_journal_tables)
+        connection.close()
+
+    def start(self, categories: list):
+        """
+        Resumes the last unfinished run with the same categories, started less than max_age hours ago,
+        or starts a new one. Other unfinished runs (with other categories or too old) can't be resumed
+        anymore, so they are removed.
+
+        Returns:
+        - int: The number of units already completed by the resumed run (0 for a new run).
+        """
+        categories = json.dumps(sorted(categories))
+        started_since = (datetime.now() - timedelta(hours=self.max_age)).strftime(TIMESTAMP_FORMAT)
+
+        with get_connection(self.path) as connection:
+            run = connection.execute(
+                "SELECT id, started_at FROM crawl_runs WHERE finished_at IS NULL AND categories = ? "
+                "AND started_at >= ? ORDER BY id DESC LIMIT 1", (categories, started_since)
+            ).fetchone()
+
+            stale = connection.execute(
+                "SELECT COUNT(*) FROM crawl_runs WHERE finished_at IS NULL AND categories = ? AND started_at < ?",
+                (categories, started_since)
+            ).fetchone()[0]
+            if stale:
+                print(f"Discarding {stale} unfinished crawls started more than {self.max_age} hours ago")
+
+            abandoned = [run_id for run_id, in connection.execute(
+                "SELECT id FROM crawl_runs WHERE finished_at IS NULL AND id != ?", (run[0] if run else -1,))]
+            connection.executemany("DELETE FROM crawl_units WHERE run_id = ?", [(run_id,) for run_id in abandoned])
+            connection.executemany("DELETE FROM crawl_runs WHERE id = ?", [(run_id,) for run_id in abandoned])
+
+            if run is None:
+                self.run_id = connection.execute(
+                    "INSERT INTO crawl_runs (categories, started_at) VALUES (?, ?)",
+                    (categories, datetime.now().strftime(TIMESTAMP_FORMAT))
+                ).lastrowid
+                completed = 0
+            else:
+                self.run_id = run[0]
+                completed = connection.execute(
+                    "SELECT COUNT(*) FROM crawl_units WHERE run_id = ?", (self.run_id,)).fetchone()[0]
+                print(f"Resuming crawl started at {run[1]}: {completed} units already scraped")
+        connection.close()
+
+        return completed
+
+    def get(self, site: str, url: str):
+        """
+        Returns the pages of the URL completed by the current run.
+
+        Returns:
+        - dict: A dictionary mapping numbers of the completed pages to tuples containing the list of raw
+                offers of the page and the number of pages of the URL (if it was recorded with the page).
+        """
+        with get_connection(self.path) as connection:
+            units = connection.execute(
+                "SELECT page, offers, pages FROM crawl_units WHERE run_id = ? AND site = ? AND url = ?",
+                (self.run_id, site, url)
+            ).fetchall()
+        connection.close()
+
+        return {page: (json.loads(offers), pages) for page, offers, pages in units}
+
+    def record(self, site: str, url: str, page: int, offers: list, pages: int = None):
+        """
+        Records the completed unit with its raw offers (lists of extracted fields). The unit is committed
+        right away, so it survives a crash of the run.
+        """
+        with get_connection(self.path) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO crawl_units (run_id, site, url, page, pages, offers, completed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.run_id, site, url, page, pages, json.dumps(offers, ensure_ascii=False),
+                 datetime.now().strftime(TIMESTAMP_FORMAT))
+            )
+        connection.close()
+
+    def finish(self):
+        """
+        Marks the current run as finished and removes its units, which are not needed anymore.
+        """
+        with get_connection(self.path) as connection:
+            connection.execute("DELETE FROM crawl_units WHERE run_id = ?", (self.run_id,))
+            connection.execute("UPDATE crawl_runs SET finished_at = ? WHERE id = ?",
+                               (datetime.now().strftime(TIMESTAMP_FORMAT), self.run_id))
+        connection.close()
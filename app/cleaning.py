@@ -0,0 +1,186 @@
+import hashlib
+import re
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# Part of the salary string containing the amounts: justjoin.it - everything before the currency
+# ('10 000 - 18 000 PLN'), pracuj.pl - everything before the period ('8000–12000zł/mies. brutto')
+SALARY_AMOUNT_JJIT = re.compile(r'^(.*)\s')
+SALARY_AMOUNT_PRACUJ = re.compile(r'^([^/]*)')
+
+# First and (optional) second number of the amount part, after whitespace is removed
+SALARY_RANGE = re.compile(r'^\D*(\d+)(?:\D+(\d+))?')
+
+# Hourly rate on pracuj.pl ('100zł/godz. brutto')
+SALARY_HOURLY_PRACUJ = re.compile(r'^[^/]*/\s*godz\.(?:\s|$)')
+
+HOURS_PER_MONTH = 160
+
+# if columns below are the same we treat offer as duplicate
+duplicates_columns = ['site', 'experience', 'name', 'company']
+
+# separator of the normalized columns hashed into fingerprints; fingerprints are stored in the database,
+# so the way they are computed must never change (or the 'rehash_fingerprints' migration has to be run again)
+FINGERPRINT_SEPARATOR = '\x1f'
+
+
+def normalize_salaries(salaries: pd.Series, amount_pattern: re.Pattern, hourly_pattern: re.Pattern = None):
+    """
+    This function splits salary strings of all offers at once into the lowest, highest and average salary.
+    Instead of calling a Python function for every offer, the amounts are extracted with compiled regexes
+    ('str.extract') and the arithmetic is done on whole NumPy arrays. It handles ranges, single values
+    (the lowest and highest salary are then equal) and undisclosed salaries (all three values are missing).
+    Currency and period suffixes are skipped, but hourly rates (if hourly_pattern is given) are converted
+    to monthly salaries assuming a standard 160-hour work month.
+
+    Parameters:
+    - salaries (pd.Series): Salary strings of the offers.
+    - amount_pattern (re.Pattern): Regex capturing the part of the string containing the amounts.
+    - hourly_pattern (re.Pattern, optional): Regex matching salaries given per hour.
+
+    Returns:
+    - pd.DataFrame: A DataFrame with 'salary_low', 'salary_high' and 'salary_avg' columns, indexed
+                    like the salaries.
+    """
+    salaries = salaries.astype(str)
+
+    amounts = salaries.str.extract(amount_pattern, expand=False).str.replace(r'\s+', '', regex=True)
+    salary_range = amounts.str.extract(SALARY_RANGE)
+
+    salary_low = pd.to_numeric(salary_range[0]).to_numpy(dtype=float)
+    salary_high = pd.to_numeric(salary_range[1]).to_numpy(dtype=float)
+    salary_high = np.where(np.isnan(salary_high), salary_low, salary_high)
+
+    if hourly_pattern is not None:
+        multiplier = np.where(salaries.str.contains(hourly_pattern), HOURS_PER_MONTH, 1)
+        salary_low = salary_low * multiplier
+        salary_high = salary_high * multiplier
+
+    undisclosed = salaries.str.contains('Undisclosed Salary', regex=False).to_numpy(dtype=bool)
+    salary_low = np.where(undisclosed, np.nan, salary_low)
+    salary_high = np.where(undisclosed, np.nan, salary_high)
+
+    return pd.DataFrame({
+        'salary_low': salary_low,
+        'salary_high': salary_high,
+        'salary_avg': (salary_low + salary_high) / 2,
+    }, index=salaries.index)
+
+
+# typed schema of offers used through the whole pipeline: low-cardinality text as categoricals,
+# the other text as Arrow-backed strings, salaries as float32 and ids as nullable integers
+offers_dtypes = {
+    'id': 'Int64',
+    'site': 'category',
+    'experience': 'category',
+    'name': 'string[pyarrow]',
+    'company': 'string[pyarrow]',
+    'location': 'category',
+    'work_mode': 'category',
+    'salary_avg': 'float32',
+    'salary_low': 'float32',
+    'salary_high': 'float32',
+    'link': 'string[pyarrow]',
+    'added_at': 'string[pyarrow]',
+    'voivodeship': 'category',
+    'lat': 'float64',
+    'lon': 'float64',
+    'fingerprint': 'int64',
+}
+
+
+def apply_offers_schema(offers: pd.DataFrame):
+    """
+    This function casts the columns of the offers DataFrame to the typed offers schema ('offers_dtypes').
+    Columns which are not part of the schema (e.g. lists of technologies) are left unchanged.
+
+    Parameters:
+    - offers (pd.DataFrame): Offers with any subset of the schema columns.
+
+    Returns:
+    - pd.DataFrame: The offers with typed columns.
+    """
+    dtypes = {column: dtype for column, dtype in offers_dtypes.items() if column in offers.columns}
+
+    return offers.astype(dtypes)
+
+
+def concat_offers(offers_list: list):
+    """
+    This function concatenates DataFrames of offers keeping the typed schema. Categories of every
+    categorical column are unified first, because pandas falls back to object columns when concatenating
+    categoricals with different categories. Empty DataFrames are skipped (categories of their columns
+    have no common dtype with the others) and categories are cast to strings before the union.
+
+    Parameters:
+    - offers_list (list): DataFrames of offers with typed columns.
+
+    Returns:
+    - pd.DataFrame: The concatenated offers, or an empty typed DataFrame with the columns of the given
+                    DataFrames if none of them contains any offer.
+    """
+    columns = list(dict.fromkeys(column for offers in offers_list for column in offers.columns))
+    offers_list = [apply_offers_schema(offers) for offers in offers_list if not offers.empty]
+
+    if not offers_list:
+        return apply_offers_schema(pd.DataFrame(columns=columns))
+
+    for column, dtype in offers_dtypes.items():
+        if dtype != 'category' or not all(column in offers.columns for offers in offers_list):
+            continue
+        categoricals = [offers[column].cat.set_categories(offers[column].cat.categories.astype(str))
+                        for offers in offers_list]
+        categories = pd.api.types.union_categoricals(categoricals).categories
+        offers_list = [offers.assign(**{column: categorical.cat.set_categories(categories)})
+                       for offers, categorical in zip(offers_list, categoricals)]
+
+    return pd.concat(offers_list)
+
+
+def report_memory(stage: str, offers: pd.DataFrame):
+    """
+    This function prints memory used by the offers DataFrame at the given stage of the pipeline
+    (including the contents of strings and lists) and the peak memory of the whole process,
+    if the platform reports it.
+    """
+    size = offers.memory_usage(deep=True).sum() / 2 ** 20
+    report = f"Memory of {stage}: {offers.shape[0]} offers, {size:.2f} MiB"
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+        report += f" (peak of the process: {peak:.0f} MiB)"
+
+    print(report)
+
+
+def offer_fingerprints(offers: pd.DataFrame, columns: list = duplicates_columns):
+    """
+    This function computes fingerprints of the offers: 64-bit hashes of their duplicates columns, normalized
+    (case, surrounding and repeated whitespace are ignored). The columns are normalized for all offers at once
+    and hashed with BLAKE2b ('hashlib'), which doesn't depend on the versions of pandas or Python, so the
+    fingerprints can be stored in the database. Offers with equal fingerprints are treated as duplicates,
+    so deduplication compares a single integer column instead of several string columns.
+
+    Parameters:
+    - offers (pd.DataFrame): Offers with the given columns.
+    - columns (list, optional): Columns identifying an offer. Defaults to duplicates_columns.
+
+    Returns:
+    - pd.Series: Fingerprints of the offers (int64), indexed like the offers.
+    """
+    normalized = [
+        offers[column].astype(object).fillna('').astype(str).str.strip().str.lower()
+        .str.replace(r'\s+', ' ', regex=True).tolist()
+        for column in columns
+    ]
+    digests = b''.join([hashlib.blake2b(FINGERPRINT_SEPARATOR.join(values).encode(), digest_size=8).digest()
+                        for values in zip(*normalized)])
+
+    # SQLite stores signed 64-bit integers
+    return pd.Series(np.frombuffer(digests, dtype='<i8').astype(np.int64), index=offers.index, name='fingerprint')
@@ -1,28 +1,90 @@
+import contextvars
+import re
 import yaml
 import sys
+import threading
+import time
+import requests
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from contextlib import contextmanager
+from queue import Queue, Empty
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 
+from database import query_offers
+from metrics import metrics
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
 config_path = '../config.yaml'
 with open(config_path, 'r') as file:
     config = yaml.safe_load(file)
 
 DRIVER_PATH = config['DRIVER_PATH']
+HEADLESS = config['HEADLESS']
+DISABLE_IMAGES = config['DISABLE_IMAGES']
+DISABLE_CSS = config['DISABLE_CSS']
+HTTP_TIMEOUT = config['HTTP_TIMEOUT']
+HTTP_POOL_SIZE = config['HTTP_POOL_SIZE']
+HTTP_RATE_LIMIT = config['HTTP_RATE_LIMIT']
+HTTP_HOST_CONCURRENCY = config['HTTP_HOST_CONCURRENCY']
+NORMALIZE_LINKS = config['NORMALIZE_LINKS']
+HTML_PARSER = config['HTML_PARSER'] or ('lxml' if lxml else 'html.parser')
+SELECTORS = config['SELECTORS']
+
+# URL patterns of stylesheets blocked in the browser when DISABLE_CSS is set
+STYLESHEET_PATTERNS = ['*.css', '*.css?*']
+
+# storage of an origin cleared before a driver is returned to the pool (cookies are cleared for all origins)
+CLEARED_STORAGE_TYPES = 'local_storage,session_storage,indexeddb,cache_storage,service_workers'
+
+# selectors consisting of a tag name and classes only ('div', 'div.offer.active', '.offer')
+SIMPLE_SELECTOR = re.compile(r'^([\w-]*)((?:\.[\w-]+)*)$')
+
+# responses retried with a backoff (by the session or by callers retrying on their own)
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/122.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'pl-PL,pl;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate',
+}
 
 
-def get_driver():
+def get_driver(headless: bool = HEADLESS, disable_images: bool = DISABLE_IMAGES, disable_css: bool = DISABLE_CSS):
     """
     The function sets up a Chrome WebDriver with options to disable popup
     blocking and notifications. The window size is set to 2048x1536 pixels.
+    If headless is set, the browser runs without a visible window, which allows
+    running several drivers side by side. Loading of images and stylesheets can
+    be disabled to cut page load time and memory. Chrome has no content setting for
+    stylesheets, so they are blocked by URL through the DevTools protocol instead.
     """
     try:
         service = Service(executable_path=DRIVER_PATH)
         chrome_options = Options()
         chrome_options.add_argument("--disable-popup-blocking")
         chrome_options.add_argument("--disable-notifications")
+        if headless:
+            chrome_options.add_argument("--headless=new")
+        if disable_images:
+            chrome_options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
         driver = webdriver.Chrome(service=service, options=chrome_options)
         driver.set_window_size(2048, 1536)
+        if disable_css:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": STYLESHEET_PATTERNS})
     except Exception as e:
         print(f"Error initializing WebDriver: {e}")
         sys.exit(1)
@@ -30,6 +92,422 @@ def get_driver():
     return driver
 
 
+def is_alive(driver):
+    """
+    The function checks if the browser controlled by the WebDriver still responds.
+    """
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+
+def quit_driver(driver):
+    """
+    The function quits the WebDriver ignoring errors of an already crashed browser.
+    """
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+class DriverPool:
+    """
+    Pool of warm WebDriver sessions shared by the scrapers.
+
+    Instead of starting a new browser for every URL, drivers are handed out from the pool and
+    returned to it after use. At most 'size' drivers are started, so the pool also bounds the number
+    of concurrently running browsers. Before a driver is returned to the pool its state (cookies,
+    storage of the visited site, current page) is reset. Drivers which crashed are quit and replaced by new ones.
+
+    Usage:
+        with DriverPool(size=2) as pool:
+            with pool.driver() as driver:
+                driver.get(url)
+    """
+
+    def __init__(self, size: int = 1, **driver_options):
+        """
+        Parameters:
+        - size (int): Maximal number of drivers started by the pool.
+        - driver_options: Options passed to 'get_driver' (headless, disable_images, disable_css).
+        """
+        self.size = max(1, size)
+        self.driver_options = driver_options
+        self.idle = Queue()
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Returns an idle driver, starts a new one if the pool is not full yet, or waits until
+        another user releases one. A driver which doesn't respond anymore is replaced.
+        """
+        start_new = False
+        with self.lock:
+            try:
+                driver = self.idle.get_nowait()
+            except Empty:
+                driver = None
+                if self.started < self.size:
+                    self.started += 1
+                    start_new = True
+
+        if start_new:
+            return get_driver(**self.driver_options)
+
+        if driver is None:
+            driver = self.idle.get()
+
+        if not is_alive(driver):
+            print("WebDriver session crashed - restarting")
+            quit_driver(driver)
+            driver = get_driver(**self.driver_options)
+
+        return driver
+
+    def release(self, driver):
+        """
+        Resets the state of the driver and returns it to the pool: cookies of all domains and storage
+        (localStorage, IndexedDB, service workers...) of the current origin are cleared through the DevTools
+        protocol - 'delete_all_cookies' would clear only cookies of the current domain - and the driver
+        navigates to a blank page. If the reset fails the driver is considered crashed and it is replaced by a new one.
+        """
+        try:
+            origin = driver.execute_script("return window.location.origin")
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            if origin and origin != 'null':
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin",
+                                       {"origin": origin, "storageTypes": CLEARED_STORAGE_TYPES})
+            driver.get("about:blank")
+        except Exception:
+            print("WebDriver session crashed - restarting")
+            quit_driver(driver)
+            driver = get_driver(**self.driver_options)
+
+        self.idle.put(driver)
+
+    @contextmanager
+    def driver(self):
+        """
+        Context manager handing out a driver from the pool and returning it after use.
+        """
+        driver = self.acquire()
+        try:
+            yield driver
+        finally:
+            self.release(driver)
+
+    def close(self):
+        """
+        Quits all idle drivers of the pool.
+        """
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except Empty:
+                break
+            quit_driver(driver)
+            with self.lock:
+                self.started -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_session(pool_size: int = HTTP_POOL_SIZE, headers: dict = None, retries: int = 3):
+    """
+    The function sets up a requests Session used by the HTTP fetch backend. Connections are kept
+    alive and pooled (up to pool_size per host), responses are gzip-compressed and failed requests
+    (connection errors, 429 and 5xx responses) are retried up to 'retries' times with an exponential
+    backoff. With retries=0 the session doesn't retry, so callers which have to stay within a rate limit
+    can retry through their limiter. Requests are sent with the browser headers (HTTP_HEADERS) unless
+    other headers are given.
+    """
+    max_retries = Retry(total=retries, backoff_factor=1, status_forcelist=RETRY_STATUSES) if retries else 0
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+
+    session = requests.Session()
+    session.headers.update(headers or HTTP_HEADERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing out requests so that no more than 'rate' requests per second
+    are started, regardless of how many threads are fetching pages. Time spent waiting is recorded
+    in the 'sleep_seconds' metric under the name of the limiter.
+    """
+
+    def __init__(self, rate: float, name: str = 'http'):
+        self.name = name
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the next request is allowed to start.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval
+
+        if start_time > now:
+            time.sleep(start_time - now)
+            metrics.inc('sleep_seconds', start_time - now, limiter=self.name)
+
+
+rate_limiter = RateLimiter(HTTP_RATE_LIMIT)
+host_slots = {}
+host_slots_lock = threading.Lock()
+
+
+def get_host_slot(url: str):
+    """
+    The function returns the semaphore capping the number of concurrent requests to the host of the url.
+    """
+    host = urlparse(url).netloc
+    with host_slots_lock:
+        if host not in host_slots:
+            host_slots[host] = threading.BoundedSemaphore(HTTP_HOST_CONCURRENCY)
+        return host_slots[host]
+
+
+def fetch_page(session: requests.Session, url: str, timeout: int = HTTP_TIMEOUT):
+    """
+    The function downloads a single page with the given session. Requests go through the global
+    rate limiter and the per-host concurrency cap, while retries with backoff are handled by the
+    session. It returns the HTML of the page or None if the page couldn't be downloaded.
+    """
+    host = urlparse(url).netloc
+    with get_host_slot(url):
+        rate_limiter.wait()
+        try:
+            with metrics.timer('fetch', host=host):
+                response = session.get(url, timeout=timeout)
+                response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Couldn't fetch {url}, because: {e}")
+            metrics.inc('pages_failed', host=host)
+            return None
+
+    metrics.inc('pages_fetched', host=host)
+    metrics.inc('bytes_downloaded', len(response.content), host=host)
+
+    return response.text
+
+
+def fetch_pages(session: requests.Session, urls: list, workers: int = HTTP_POOL_SIZE):
+    """
+    The function downloads the given pages concurrently with a pool of threads sharing the session.
+    Pages are returned in the same order as the urls, with None for pages which couldn't be downloaded.
+    Each download runs in a copy of the caller's context, so metrics keep the caller's labels.
+    """
+    if not urls:
+        return []
+
+    contexts = [contextvars.copy_context() for _ in urls]
+    with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as executor:
+        return list(executor.map(lambda context, url: context.run(fetch_page, session, url), contexts, urls))
+
+
+class PageParser:
+    """
+    Parser of listing pages of one site, driven by the CSS selectors declared for the site in SELECTORS.
+
+    Instead of building the tree of the whole page, only the subtrees matched by the first step of the selector
+    (e.g. offer cards) are parsed, with a SoupStrainer, and the selectors are compiled once (see 'compile_selector'),
+    so extracting fields of a card doesn't re-interpret them. The tree builder ('lxml' or 'html.parser') is pluggable.
+
+    Usage:
+        parser = PageParser('justjoin.it')
+        for card in parser.parse(page_source):
+            name = parser.text('name', card)
+    """
+
+    def __init__(self, site: str, parser: str = HTML_PARSER):
+        self.site = site
+        self.parser = parser
+        self.selectors = {field: self.compile_selector(selector) for field, selector in SELECTORS[site].items()}
+        self.strainers = {field: self.get_strainer(selector) for field, selector in SELECTORS[site].items()}
+
+    @staticmethod
+    def compile_selector(selector: str):
+        """
+        Compiles the selector into a pair of functions returning the first and all elements within a tag matched
+        by the selector. Simple selectors ('tag.class...') become 'find' calls, which are much faster than general
+        CSS matching; other selectors (e.g. with combinators) are compiled with soupsieve.
+        """
+        match = SIMPLE_SELECTOR.match(selector)
+        if match is None:
+            compiled = soupsieve.compile(selector)
+            return compiled.select_one, compiled.select
+
+        name = match.group(1) or True
+        classes = match.group(2).split('.')[1:]
+        attrs = {'class_': classes[0]} if classes else {}
+        other_classes = set(classes[1:])
+
+        def select(tag):
+            elements = tag.find_all(name, **attrs)
+            if not other_classes:
+                return elements
+            return [element for element in elements if other_classes <= set(element['class'])]
+
+        def select_one(tag):
+            if not other_classes:
+                return tag.find(name, **attrs)
+            return next(iter(select(tag)), None)
+
+        return select_one, select
+
+    @staticmethod
+    def get_strainer(selector: str):
+        """
+        Returns the SoupStrainer keeping elements matched by the first step of the selector ('tag.class...'):
+        the tag name and all its classes. The whole selector is applied to the kept subtrees afterwards.
+        """
+        name, *classes = selector.split()[0].split('.')
+        if not classes:
+            return SoupStrainer(name)
+
+        classes = set(classes)
+        # while parsing, the class attribute is matched as a single string
+        return SoupStrainer(name or None, class_=lambda value: value is not None and classes <= set(value.split()))
+
+    def parse(self, page_source: str, field: str = 'card'):
+        """
+        Parses only the parts of the page matched by the selector of the field and returns the matched elements.
+        """
+        soup = BeautifulSoup(page_source, self.parser, parse_only=self.strainers[field])
+
+        return self.select(field, soup)
+
+    def select_one(self, field: str, tag):
+        """
+        Returns the first element within the tag matched by the selector of the field, or None.
+        """
+        return self.selectors[field][0](tag)
+
+    def select(self, field: str, tag):
+        """
+        Returns all elements within the tag matched by the selector of the field.
+        """
+        return self.selectors[field][1](tag)
+
+    def text(self, field: str, tag, default: str = None):
+        """
+        Returns the text of the first element within the tag matched by the selector of the field,
+        or default if there is no such element.
+        """
+        element = self.select_one(field, tag)
+
+        return element.text if element is not None else default
+
+
+def normalize_link(link: str):
+    """
+    The function reduces the link of an offer to its path. Both relative links (justjoin.it) and
+    absolute links with tracking parameters (pracuj.pl: '?s=...&searchId=...') of the same offer
+    are then mapped to the same key, also when compared with full links stored in the database.
+    """
+    return urlparse(link).path
+
+
+class SeenLinks:
+    """
+    Hash-based set of links of already processed offers, used by both scrapers to skip duplicates.
+
+    Membership checks and insertions take constant time. Links can be normalized before they are
+    compared (see 'normalize_link'). A SeenLinks can be built on top of another, read-only one
+    ('known'), e.g. links of offers stored in the database, without copying it - a link is considered
+    seen if it is in either of them, while new links are added only to the local set.
+    For incremental crawls of listings sorted from the newest offers, it also counts how many offers
+    in a row had known links (see 'track' and 'exhausted').
+    """
+
+    def __init__(self, links=(), normalize: bool = NORMALIZE_LINKS, known=None, stop_after: int = None):
+        """
+        Parameters:
+        - links (iterable, optional): Links to start with.
+        - normalize (bool, optional): Whether links are normalized before comparison.
+                                      Defaults to NORMALIZE_LINKS from config.
+        - known (SeenLinks, optional): Read-only set of links which are also considered seen.
+        - stop_after (int, optional): Number of known offers in a row after which the listing is exhausted.
+        """
+        self.normalize = normalize
+        self.known = known
+        self.links = {self.key(link) for link in links}
+        self.stop_after = stop_after
+        self.tracked = set()
+        self.known_streak = 0
+
+    def key(self, link: str):
+        return normalize_link(link) if self.normalize else link
+
+    def __contains__(self, link: str):
+        key = self.key(link)
+        return key in self.links or (self.known is not None and link in self.known)
+
+    def __len__(self):
+        return len(self.links)
+
+    def add(self, link: str):
+        self.links.add(self.key(link))
+
+    def track(self, link: str):
+        """
+        Counts the offer in the run of consecutive offers with known links: a known link extends it,
+        a new one resets it. Offers seen before (e.g. when a page is parsed again) are not counted twice.
+        """
+        key = self.key(link)
+        if self.known is None or key in self.links or key in self.tracked:
+            return
+
+        if link in self.known:
+            self.tracked.add(key)
+            self.known_streak += 1
+        else:
+            self.known_streak = 0
+
+    @property
+    def exhausted(self):
+        """
+        Whether 'stop_after' offers in a row had known links - in a listing sorted from the newest offers,
+        the rest of it was already scraped by previous runs.
+        """
+        return self.stop_after is not None and self.known_streak >= self.stop_after
+
+    @classmethod
+    def from_db(cls, normalize: bool = NORMALIZE_LINKS):
+        """
+        Builds the set of links of offers already stored in the database, so they can be skipped
+        before any field of the offer is extracted.
+        """
+        return cls(query_offers(['link'], where="link IS NOT NULL", distinct=True)['link'], normalize)
+
+
+def show_duration(end_time, start_time):
+    """
+    This function displays duration in seconds or minutes regradless which is more appropriate
+    """
+    duration = end_time - start_time
+    if duration > 60:
+        return str(round(duration/60, 1)) + ' minutes'
+    else:
+        return str(round(duration, 2)) + ' seconds'
+
+
 # EXTRA FEATURES - FOR LATER USE
 
 # from selenium.webdriver.support.ui import WebDriverWait
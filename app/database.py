@@ -1,8 +1,10 @@
-import json
 import yaml
 import os
 import sqlite3
 import pandas as pd
+from datetime import datetime
+
+from cleaning import apply_offers_schema, offer_fingerprints, duplicates_columns
 
 
 config_path = '../config.yaml'
@@ -10,116 +12,873 @@ with open(config_path, 'r') as file:
     config = yaml.safe_load(file)
 
 DB_PATH = config['DB_PATH']
+DB_CHUNK_SIZE = config['DB_CHUNK_SIZE']
+
+# max number of '?' parameters of a query (the lowest default limit of SQLite builds)
+SQL_MAX_VARIABLES = 999
+DB_PRAGMAS = config['DB_PRAGMAS']
+
+# format of 'updated_at' of offers (seconds, so changes can be compared with the time of the last backup)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+offers_columns = ['site', 'experience', 'name', 'company', 'location', 'work_mode', 'salary_avg',
+                  'salary_low', 'salary_high', 'technologies', 'link', 'added_at', 'voivodeship', 'lat', 'lon',
+                  'fingerprint']
+
+# technologies of an offer are stored in separate tables, not in the 'offers' table
+offers_table_columns = [column for column in offers_columns if column != 'technologies']
+
+create_schema_version_table = """
+CREATE TABLE IF NOT EXISTS schema_version (
+version INTEGER PRIMARY KEY,
+description TEXT NOT NULL,
+applied_at TEXT NOT NULL
+);
+"""
+
+create_offers_table = """
+CREATE TABLE IF NOT EXISTS offers (
+id INTEGER PRIMARY KEY AUTOINCREMENT,
+site TEXT NOT NULL,
+experience TEXT NOT NULL,
+name TEXT NOT NULL,
+company TEXT NOT NULL,
+location TEXT,
+work_mode TEXT,
+salary_avg FLOAT,
+salary_low FLOAT,
+salary_high FLOAT,
+link TEXT,
+added_at TEXT,
+voivodeship TEXT
+);
+"""
+
+create_geocodes_table = """
+CREATE TABLE IF NOT EXISTS geocodes (
+city_key TEXT PRIMARY KEY,
+city TEXT NOT NULL,
+found INTEGER NOT NULL,
+lat FLOAT,
+lon FLOAT,
+voivodeship TEXT,
+updated_at TEXT NOT NULL
+);
+"""
+
+create_technologies_tables = """
+CREATE TABLE IF NOT EXISTS technologies (
+id INTEGER PRIMARY KEY,
+name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS offer_technologies (
+offer_id INTEGER NOT NULL,
+position INTEGER NOT NULL,
+technology_id INTEGER NOT NULL,
+PRIMARY KEY (offer_id, position)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_offer_technologies_technology ON offer_technologies (technology_id, offer_id);
+
+CREATE TRIGGER IF NOT EXISTS offers_technologies_delete AFTER DELETE ON offers
+BEGIN
+    DELETE FROM offer_technologies WHERE offer_id = OLD.id;
+END;
+"""
+
+# indexes used by the queries of the pipeline; changes to them need a new migration
+offers_indexes = {
+    'idx_offers_link': "CREATE INDEX IF NOT EXISTS idx_offers_link ON offers (link)",
+    'idx_offers_added_at': "CREATE INDEX IF NOT EXISTS idx_offers_added_at ON offers (added_at)",
+    'idx_offers_voivodeship': "CREATE INDEX IF NOT EXISTS idx_offers_voivodeship ON offers (voivodeship)",
+    'idx_offers_missing_voivodeship': """
+        CREATE INDEX IF NOT EXISTS idx_offers_missing_voivodeship ON offers (location)
+        WHERE voivodeship IS NULL
+        """,
+}
+
+
+def get_connection(path: str = None, pragmas: dict = None):
+    """
+    This function opens a connection to the database and tunes it with the configured pragmas
+    (DB_PRAGMAS in config): WAL journal mode, so readers don't block the writer, synchronous=NORMAL,
+    which is safe with WAL and avoids a disk flush on every commit, memory-mapped I/O and a larger
+    page cache. All database operations should use connections from this function.
+
+    Parameters:
+    - path (str, optional): Path to the database. Defaults to DB_PATH.
+    - pragmas (dict, optional): Pragmas to apply. Defaults to DB_PRAGMAS.
+
+    Returns:
+    - sqlite3.Connection: The connection to the database.
+    """
+    connection = sqlite3.connect(path or DB_PATH)
+
+    for pragma, value in (DB_PRAGMAS if pragmas is None else pragmas).items():
+        connection.execute(f"PRAGMA {pragma} = {value}")
+
+    return connection
+
+
+def normalize_city(city: str):
+    """
+    This function returns the key under which geographic data of the city is cached in the 'geocodes'
+    table, so that e.g. 'Kraków' and ' kraków' share one lookup.
+    """
+    return city.strip().lower()
+
+
+def get_table_columns(connection, table: str):
+    """
+    This function returns names of the columns of the given table, as stored in the database.
+    """
+    return [column[1] for column in connection.execute(f"PRAGMA table_info({table})")]
+
+
+def backfill(connection: sqlite3.Connection, update_query: str, chunksize: int = DB_CHUNK_SIZE):
+    """
+    This function runs an UPDATE of the 'offers' table in batches of ids instead of one statement
+    over the whole table. Every batch is committed separately, so the write lock is held only briefly
+    and other connections can use the database during a long backfill. The query should skip rows which
+    are already filled, so an interrupted backfill simply continues when it's run again.
+
+    Parameters:
+    - connection (sqlite3.Connection): Connection to the database.
+    - update_query (str): UPDATE query with two placeholders for the first and last id of a batch
+                          (e.g. "... WHERE lat IS NULL AND id BETWEEN ? AND ?").
+    - chunksize (int, optional): Number of ids in a single batch. Defaults to DB_CHUNK_SIZE.
+
+    Returns:
+    - int: The number of updated offers.
+    """
+    max_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM offers").fetchone()[0]
+
+    updated = 0
+    for first_id in range(1, max_id + 1, chunksize):
+        updated += connection.execute(update_query, (first_id, first_id + chunksize - 1)).rowcount
+        connection.commit()
+
+    return updated
+
+
+def create_tables(connection: sqlite3.Connection):
+    """
+    Migration 1: creates the 'offers' table with job offer details and the 'geocodes' table
+    caching results of geographic lookups.
+    """
+    connection.execute(create_offers_table)
+    connection.execute(create_geocodes_table)
+
+
+def create_unique_index(connection: sqlite3.Connection):
+    """
+    Migration 2: creates the UNIQUE index on the duplicates key. Databases created before the index
+    was introduced may contain duplicated offers - in that case the oldest copy of each offer is kept
+    and the rest is removed before the index is created.
+    """
+    remove_duplicates = f"""
+    DELETE FROM offers
+    WHERE id NOT IN (
+        SELECT MIN(id) FROM offers GROUP BY {', '.join(duplicates_columns)}
+    );
+    """
+
+    create_index = f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_offers_unique
+    ON offers ({', '.join(duplicates_columns)});
+    """
+
+    index_exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_offers_unique'"
+    ).fetchone()
+    if not index_exists:
+        removed = connection.execute(remove_duplicates).rowcount
+        if removed > 0:
+            print(f"Removed {removed} duplicated offers from Database")
+        connection.execute(create_index)
+
+
+def create_technologies(connection: sqlite3.Connection):
+    """
+    Migration 3: creates the normalized technologies tables. Every technology name is stored once in
+    the 'technologies' table and 'offer_technologies' links offers with technologies (keeping their order).
+    Databases which still keep technologies as a JSON list in the 'offers' table are migrated to this form
+    (see 'migrate_technologies').
+    """
+    if 'technologies' in get_table_columns(connection, 'offers'):
+        migrate_technologies(connection.cursor())
+    else:
+        connection.executescript(create_technologies_tables)
+
+
+def migrate_technologies(cursor: sqlite3.Cursor):
+    """
+    This function migrates technologies stored as JSON lists in the 'technologies' column of the 'offers'
+    table to the normalized 'technologies' and 'offer_technologies' tables. The technologies index
+    of the previous schema (table and triggers) is replaced and the JSON column is dropped.
+    """
+    migration = f"""
+    DROP TRIGGER IF EXISTS offers_technologies_insert;
+    DROP TRIGGER IF EXISTS offers_technologies_update;
+    DROP TRIGGER IF EXISTS offers_technologies_delete;
+    DROP TABLE IF EXISTS offer_technologies;
+
+    {create_technologies_tables}
+
+    INSERT OR IGNORE INTO technologies (name)
+    SELECT json_each.value FROM offers, json_each(offers.technologies)
+    ORDER BY offers.id, json_each.key;
+
+    INSERT INTO offer_technologies (offer_id, position, technology_id)
+    SELECT offers.id, json_each.key, technologies.id
+    FROM offers, json_each(offers.technologies)
+    JOIN technologies ON technologies.name = json_each.value;
+
+    ALTER TABLE offers DROP COLUMN technologies;
+    """
+
+    cursor.executescript(migration)
+    print("Technologies migrated to normalized tables")
+
+
+def create_indexes(connection: sqlite3.Connection):
+    """
+    Migration 4: creates the indexes used by the pipeline's queries ('offers_indexes') and refreshes
+    the statistics used by the query planner.
+    """
+    for create_index in offers_indexes.values():
+        connection.execute(create_index)
+
+    connection.execute("ANALYZE")
+
+
+def add_coordinates(connection: sqlite3.Connection):
+    """
+    Migration 5: adds 'lat' and 'lon' columns to the 'offers' table and backfills them (in batches,
+    see 'backfill') from the geographic data already cached in the 'geocodes' table.
+    """
+    offers_columns_db = get_table_columns(connection, 'offers')
+    for column in ['lat', 'lon']:
+        if column not in offers_columns_db:
+            connection.execute(f"ALTER TABLE offers ADD COLUMN {column} FLOAT")
+    connection.commit()
+
+    connection.create_function('normalize_city', 1, normalize_city, deterministic=True)
+
+    fill_coordinates = """
+    UPDATE offers
+    SET lat = geocodes.lat, lon = geocodes.lon
+    FROM geocodes
+    WHERE geocodes.city_key = normalize_city(offers.location) AND geocodes.found = 1
+        AND offers.lat IS NULL AND offers.location IS NOT NULL AND offers.id BETWEEN ? AND ?
+    """
+
+    filled = backfill(connection, fill_coordinates)
+    if filled > 0:
+        print(f"Coordinates filled in {filled} offers")
+
+
+def add_updated_at(connection: sqlite3.Connection):
+    """
+    Migration 6: adds the 'updated_at' column to the 'offers' table, so offers changed since a given
+    time (e.g. since the last backup) can be found with an index. Existing offers are backfilled
+    with their 'added_at'.
+    """
+    if 'updated_at' not in get_table_columns(connection, 'offers'):
+        connection.execute("ALTER TABLE offers ADD COLUMN updated_at TEXT")
+    connection.commit()
+
+    backfill(connection, """
+    UPDATE offers SET updated_at = added_at WHERE updated_at IS NULL AND id BETWEEN ? AND ?
+    """)
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_offers_updated_at ON offers (updated_at)")
+
+
+def add_fingerprint(connection: sqlite3.Connection, chunksize: int = DB_CHUNK_SIZE):
+    """
+    Migration 7: adds the 'fingerprint' column (see 'offer_fingerprints') to the 'offers' table and makes it
+    the key of offers instead of the duplicates columns. Fingerprints of existing offers are computed in batches
+    of ids, each committed separately. Offers which turn out to be duplicates (e.g. differing only in case)
+    are removed - the oldest copy is kept and ids of the removed ones are printed (the database from before
+    the migration is kept in the snapshot of 'migrate'). Then the UNIQUE index on fingerprints replaces
+    'idx_offers_unique'.
+    """
+    if 'fingerprint' not in get_table_columns(connection, 'offers'):
+        connection.execute("ALTER TABLE offers ADD COLUMN fingerprint INTEGER")
+    connection.commit()
+
+    select_query = f"""
+    SELECT id, {', '.join(duplicates_columns)} FROM offers
+    WHERE fingerprint IS NULL AND id BETWEEN ? AND ?
+    """
+
+    max_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM offers").fetchone()[0]
+    for first_id in range(1, max_id + 1, chunksize):
+        offers_chunk = pd.read_sql_query(select_query, connection, params=(first_id, first_id + chunksize - 1))
+        connection.executemany("UPDATE offers SET fingerprint = ? WHERE id = ?",
+                               zip(offer_fingerprints(offers_chunk).tolist(), offers_chunk['id'].tolist()))
+        connection.commit()
+
+    removed = [row[0] for row in connection.execute("""
+    SELECT id FROM offers
+    WHERE id NOT IN (
+        SELECT MIN(id) FROM offers GROUP BY fingerprint
+    )
+    ORDER BY id
+    """)]
+    if removed:
+        connection.executemany("DELETE FROM offers WHERE id = ?", [(offer_id,) for offer_id in removed])
+        print(f"Removed {len(removed)} duplicated offers from Database (ids: {', '.join(map(str, removed))})")
+
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_offers_fingerprint ON offers (fingerprint)")
+    connection.execute("DROP INDEX IF EXISTS idx_offers_unique")
+
+
+def rehash_fingerprints(connection: sqlite3.Connection):
+    """
+    Migration 8: recomputes fingerprints of all offers after the hash of 'offer_fingerprints' was changed
+    from pandas' internal hash to BLAKE2b, which doesn't change between library versions. The UNIQUE index
+    is dropped, fingerprints are cleared in batches and computed again by 'add_fingerprint', which also
+    recreates the index. The migration can be run again if the way fingerprints are computed ever changes.
+    """
+    connection.execute("DROP INDEX IF EXISTS idx_offers_fingerprint")
+    backfill(connection, """
+    UPDATE offers SET fingerprint = NULL WHERE fingerprint IS NOT NULL AND id BETWEEN ? AND ?
+    """)
+    add_fingerprint(connection)
+
+
+# ordered migrations of the database schema: (version, description, migration);
+# every migration has to be idempotent and new ones are only appended with the next version
+migrations = [
+    (1, 'create offers and geocodes tables', create_tables),
+    (2, 'unique index on duplicates key', create_unique_index),
+    (3, 'normalized technologies tables', create_technologies),
+    (4, 'indexes of offers', create_indexes),
+    (5, 'lat and lon of offers', add_coordinates),
+    (6, 'updated_at of offers', add_updated_at),
+    (7, 'fingerprints of offers', add_fingerprint),
+    (8, 'stable hash of fingerprints', rehash_fingerprints),
+]
+
+
+def snapshot_before_migration(connection: sqlite3.Connection, version: int):
+    """
+    This function copies the database with SQLite's online backup API to a side file next to it
+    ('<database>.pre-migration-<version>') before pending migrations are applied, as some of them remove
+    rows (duplicates) or columns. The database can be restored by replacing it with the snapshot. Nothing
+    is copied if the database has no offers yet, and an existing snapshot is kept, so if a migration fails
+    and is retried, the snapshot still holds the state from before the first attempt.
+
+    Parameters:
+    - connection (sqlite3.Connection): Connection to the database.
+    - version (int): Version of the first pending migration.
+
+    Returns:
+    - str or None: Path to the snapshot, or None if no snapshot was needed.
+    """
+    path = connection.execute("PRAGMA database_list").fetchone()[2]
+    if not path or 'offers' not in [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]:
+        return None
+    if connection.execute("SELECT EXISTS (SELECT 1 FROM offers)").fetchone()[0] == 0:
+        return None
+
+    snapshot_path = f"{path}.pre-migration-{version}"
+    if not os.path.exists(snapshot_path):
+        connection.commit()
+        snapshot = sqlite3.connect(snapshot_path)
+        connection.backup(snapshot)
+        snapshot.close()
+        print(f"Saved the database from before migration {version} to {snapshot_path}")
+
+    return snapshot_path
+
+
+def migrate(connection: sqlite3.Connection, snapshot: bool = True):
+    """
+    This function brings the schema of the database up to date. Versions of the applied migrations
+    are recorded in the 'schema_version' table and only the missing ones are run, in order. Each
+    migration is committed together with its version, so a failed migration is retried on the next run.
+    Databases created before the 'schema_version' table was introduced simply run all migrations,
+    which skip the changes already present. Before any migration is applied to a database with offers,
+    the database is saved to a snapshot (see 'snapshot_before_migration').
+
+    Parameters:
+    - connection (sqlite3.Connection): Connection to the database.
+    - snapshot (bool, optional): Whether to save the database before applying migrations (not needed
+                                 e.g. for a database restored from backups, which are kept anyway).
+
+    Returns:
+    - list: Versions of the migrations applied by this call.
+    """
+    connection.execute(create_schema_version_table)
+    applied = {row[0] for row in connection.execute("SELECT version FROM schema_version")}
+
+    pending = [version for version, _, _ in migrations if version not in applied]
+    if pending and snapshot:
+        snapshot_before_migration(connection, pending[0])
+
+    applied_now = []
+    for version, description, migration in migrations:
+        if version in applied:
+            continue
+
+        migration(connection)
+        connection.execute(
+            "INSERT INTO schema_version (version, description, applied_at) VALUES (?,?,?)",
+            (version, description, datetime.now().strftime("%Y-%m-%d %H:%M"))
+        )
+        connection.commit()
+        applied_now.append(version)
+        print(f"Applied migration {version}: {description}")
+
+    return applied_now
 
 
 def create_db_if_not_exists():
     """
     This function checks for the existence of a database at the specified DB_PATH. If the
-    database does not exist, it creates a new SQLite database and defines the 'offers' table
-    with columns for job offer details. If the database already exists, it simply connects
-    to the database without modifying it.
-    """
-    create_offers_table = """
-    CREATE TABLE IF NOT EXISTS offers (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    site TEXT NOT NULL,
-    experience TEXT NOT NULL, 
-    name TEXT NOT NULL,
-    company TEXT NOT NULL, 
-    location TEXT,
-    work_mode TEXT,
-    salary_avg FLOAT,
-    salary_low FLOAT,
-    salary_high FLOAT,
-    technologies TEXT,
-    link TEXT,
-    added_at TEXT,
-    voivodeship TEXT
-    );
+    database does not exist, it creates a new SQLite database, otherwise it connects to it.
+    In both cases the schema is brought up to date by the pending migrations (see 'migrate'),
+    so schema changes are rolled out to existing databases automatically.
     """
+    db_exists = os.path.exists(DB_PATH)
+
+    with get_connection() as connection:
+        migrate(connection)
 
-    if os.path.exists(DB_PATH):
+    if db_exists:
         print("Succesfully connected to Database")
     else:
-        with sqlite3.connect(DB_PATH) as connection:
-            cursor = connection.cursor()
-            cursor.execute(create_offers_table)
-            connection.commit()
         print("New database created")
 
 
+def to_db_values(column: pd.Series):
+    """
+    This function converts a column of the offers DataFrame into a list of values which can be written
+    to the database: Python scalars, with None for missing values (NaN, NA) of any dtype.
+    """
+    column = column.astype(object)
+
+    return column.where(column.notna(), None).tolist()
+
+
 def save_to_db(offers: pd.DataFrame):
     """
     This function processes the job offers DataFrame to prepare it for database insertion.
-    It converts the 'technologies' column to a JSON string and the 'added_at' column to a string type.
-    Then, it constructs the data for insertion, excluding the 'id' column, as it is auto-incremented
-    by the database. The function uses a SQL INSERT query to add the job offers to the 'offers' table
-    in the database.
+    It converts the 'added_at' column to a string type and keeps the fingerprints computed while cleaning
+    and merging the offers, so the stored key is the one they were deduplicated with (fingerprints are
+    computed only for offers which have none, see 'offer_fingerprints'). Then, it constructs the data
+    for insertion, excluding the 'id' column, as it is auto-incremented by the database. The offers are upserted
+    into the 'offers' table: offers which are not in the database yet are inserted, while offers
+    already stored (same fingerprint, found with its UNIQUE index) are updated only if any of their
+    details changed.
+    The original 'added_at' of stored offers is preserved and their geographic data ('voivodeship',
+    'lat' and 'lon') is reset only when the location changed, so it can be filled again later.
+    Technologies of the offers are saved with 'save_technologies'. 'updated_at' of all inserted and
+    changed offers is set to the current time. Everything is written in a single transaction.
 
     Parameters:
     - offers (pd.DataFrame): A DataFrame containing job offer data with columns corresponding to the
                              fields in the 'offers' database table.
+
+    Returns:
+    - tuple: The number of inserted and the number of updated offers.
     """
-    offers['technologies'] = offers['technologies'].apply(lambda row: json.dumps(row))
+    offers = offers.reindex(columns=offers_columns)
     offers['added_at'] = offers['added_at'].astype(str)
-    db_data = list(zip(*[offers[column].tolist() for column in offers.columns if column != 'id']))
+    fingerprints = offers['fingerprint'].astype('Int64')
+    missing = fingerprints.isna()
+    if missing.any():
+        # assigned as Int64 - int64 values would be assigned through float64 and lose precision
+        fingerprints[missing] = offer_fingerprints(offers[missing]).astype('Int64')
+    offers['fingerprint'] = fingerprints.astype('int64')
+    fingerprint_position = offers_table_columns.index('fingerprint')
+    technologies = offers['technologies'].tolist()
+    db_data = list(zip(*[to_db_values(offers[column]) for column in offers_table_columns]))
+
+    updated_columns = ['location', 'work_mode', 'salary_avg', 'salary_low', 'salary_high', 'link']
 
-    add_offer_to_db = """
+    upsert_offer_to_db = f"""
     INSERT INTO 
-        offers (site, experience, name, company, location, work_mode, salary_avg, 
-                salary_low, salary_high, technologies, link, added_at, voivodeship)
+        offers ({', '.join(offers_table_columns)})
     VALUES
-        (?,?,?,?,?,?,?,?,?,?,?,?,?)
+        ({','.join('?' * len(offers_table_columns))})
+    ON CONFLICT (fingerprint) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in updated_columns)},
+        voivodeship = CASE WHEN offers.location IS excluded.location THEN offers.voivodeship ELSE NULL END,
+        lat = CASE WHEN offers.location IS excluded.location THEN offers.lat ELSE NULL END,
+        lon = CASE WHEN offers.location IS excluded.location THEN offers.lon ELSE NULL END
+    WHERE
+        {' OR '.join(f'offers.{column} IS NOT excluded.{column}' for column in updated_columns)}
+    RETURNING id
+    """
+
+    select_offer_id = """
+    SELECT id FROM offers WHERE fingerprint = ?
     """
-    with sqlite3.connect(DB_PATH) as connection:
+
+    with get_connection() as connection:
         cursor = connection.cursor()
-        cursor.executemany(add_offer_to_db, db_data)
+        last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM offers").fetchone()[0]
+
+        offer_ids = []
+        changed_ids = set()
+        for row in db_data:
+            returned = cursor.execute(upsert_offer_to_db, row).fetchone()
+            if returned:
+                changed_ids.add(returned[0])
+                offer_ids.append(returned[0])
+            else:
+                offer_ids.append(cursor.execute(select_offer_id, (row[fingerprint_position],)).fetchone()[0])
+
+        changed_ids |= save_technologies(cursor, offer_ids, technologies)
+        cursor.executemany("UPDATE offers SET updated_at = ? WHERE id = ?",
+                           [(datetime.now().strftime(TIMESTAMP_FORMAT), offer_id) for offer_id in changed_ids])
         connection.commit()
 
+    inserted = len({offer_id for offer_id in changed_ids if offer_id > last_id})
 
-def load_from_db():
+    return inserted, len(changed_ids) - inserted
+
+
+def save_technologies(cursor: sqlite3.Cursor, offer_ids: list, technologies: list):
     """
-    This function executes a SQL query to select all columns from the 'offers' table in the database.
-    Function is loading the data into a DataFrame, on which format other operations are performed
-    It processes the 'technologies' column, converting JSON-formatted strings back into list object.
+    This function saves technologies of the given offers to the 'technologies' and 'offer_technologies'
+    tables. New technology names are interned in the 'technologies' table. Only the offers whose list
+    of technologies differs from the stored one are rewritten.
+
+    Parameters:
+    - cursor (sqlite3.Cursor): Cursor of the connection (transaction) used to save the offers.
+    - offer_ids (list): Ids of the offers.
+    - technologies (list): Lists of technologies of the offers, in the same order as offer_ids.
 
     Returns:
-    - pd.DataFrame: A DataFrame containing all the data from the 'offers' table.
+    - set: Ids of the offers whose technologies changed.
+    """
+    stored = load_technologies(cursor, offer_ids)
+
+    changed = {offer_id: list(techs) if isinstance(techs, (list, tuple)) else []
+               for offer_id, techs in zip(offer_ids, technologies)}
+    changed = {offer_id: techs for offer_id, techs in changed.items() if stored.get(offer_id, []) != techs}
+
+    if not changed:
+        return set()
+
+    new_names = {tech for techs in changed.values() for tech in techs}
+    cursor.executemany("INSERT OR IGNORE INTO technologies (name) VALUES (?)", [(tech,) for tech in new_names])
+    technology_ids = dict(cursor.execute("SELECT name, id FROM technologies"))
+
+    cursor.executemany("DELETE FROM offer_technologies WHERE offer_id = ?", [(offer_id,) for offer_id in changed])
+    cursor.executemany(
+        "INSERT INTO offer_technologies (offer_id, position, technology_id) VALUES (?,?,?)",
+        [(offer_id, position, technology_ids[tech])
+         for offer_id, techs in changed.items() for position, tech in enumerate(techs)]
+    )
+
+    return set(changed)
+
+
+def load_technologies(connection, offer_ids: list):
+    """
+    This function loads lists of technologies (in their original order) of the given offers. The offers
+    are looked up by their ids in chunks of SQL_MAX_VARIABLES ('offer_id IN (...)' on the primary key),
+    so the cost depends only on the number of the given offers, not on the size or ids of the whole table.
+
+    Parameters:
+    - connection: Connection (or cursor) to the database.
+    - offer_ids (list): Ids of the offers.
+
+    Returns:
+    - dict: A dictionary mapping offer ids to lists of technologies. Offers without technologies
+            are not included.
     """
+    offer_ids = sorted(set(offer_ids))
+
     select_query = """
-        SELECT 
-            id, site, experience, name, company, location, work_mode, salary_avg, 
-            salary_low, salary_high, technologies, link, added_at, voivodeship
+        SELECT offer_technologies.offer_id, technologies.name
+        FROM offer_technologies
+        JOIN technologies ON technologies.id = offer_technologies.technology_id
+        WHERE offer_technologies.offer_id IN ({})
+        ORDER BY offer_technologies.offer_id, offer_technologies.position
+        """
+
+    technologies = {}
+    for first in range(0, len(offer_ids), SQL_MAX_VARIABLES):
+        chunk = offer_ids[first:first + SQL_MAX_VARIABLES]
+        for offer_id, tech in connection.execute(select_query.format(','.join('?' * len(chunk))), chunk):
+            technologies.setdefault(offer_id, []).append(tech)
+
+    return technologies
+
+
+def build_select_query(columns: list = None, where: str = None, distinct: bool = False, order_by: str = None):
+    """
+    This function builds a SELECT query on the 'offers' table. Only the requested columns are selected
+    and an optional WHERE clause (with '?' placeholders for parameters) narrows down the rows.
+    Technologies are not stored in the 'offers' table - if they are requested, the 'id' column is
+    selected instead, so they can be attached afterwards ('attach_technologies').
+
+    Parameters:
+    - columns (list, optional): Columns to select. Defaults to all columns of the 'offers' table.
+    - where (str, optional): SQL condition, e.g. "voivodeship IS NULL" or "added_at > ?".
+    - distinct (bool, optional): Whether to return only distinct rows.
+    - order_by (str, optional): SQL ordering of the rows, e.g. "added_at".
+
+    Returns:
+    - str: The SELECT query.
+    """
+    columns = columns or ['id'] + offers_columns
+    unknown_columns = [column for column in columns if column not in ['id'] + offers_columns]
+    if unknown_columns:
+        raise ValueError(f"Unknown columns: {unknown_columns}")
+
+    table_columns = [column for column in columns if column != 'technologies']
+    if 'technologies' in columns and 'id' not in table_columns:
+        table_columns.append('id')
+
+    select_query = f"""
+        SELECT {'DISTINCT ' if distinct else ''}{', '.join(table_columns)}
         FROM offers
         """
+    if where:
+        select_query += f"WHERE {where}\n"
+    if order_by:
+        select_query += f"ORDER BY {order_by}\n"
 
-    with sqlite3.connect(DB_PATH) as connection:
-        db_df = pd.read_sql_query(select_query, connection)
+    return select_query
 
-        db_df['technologies'] = db_df['technologies'].apply(lambda row: json.loads(row))
+
+def attach_technologies(connection, db_df: pd.DataFrame, columns: list = None):
+    """
+    This function adds the 'technologies' column (lists of technologies) to the offers loaded from the
+    'offers' table, if it was requested. The 'id' column is dropped if it was selected only to do that.
+    """
+    columns = columns or ['id'] + offers_columns
+
+    if 'technologies' in columns:
+        technologies = load_technologies(connection, db_df['id'].tolist())
+        db_df['technologies'] = [technologies.get(offer_id, []) for offer_id in db_df['id']]
+        db_df = db_df[columns]
+
+    return db_df
+
+
+def query_offers(columns: list = None, where: str = None, params: tuple = (), distinct: bool = False,
+                 order_by: str = None):
+    """
+    This function loads into a DataFrame only the selected columns of the offers matching the
+    given condition, so that each stage of the pipeline reads no more than it needs.
+
+    Parameters:
+    - columns (list, optional): Columns to select. Defaults to all columns of the 'offers' table.
+    - where (str, optional): SQL condition with '?' placeholders, e.g. "added_at > ?".
+    - params (tuple, optional): Parameters substituted for the placeholders in the condition.
+    - distinct (bool, optional): Whether to return only distinct rows.
+    - order_by (str, optional): SQL ordering of the rows, e.g. "added_at".
+
+    Returns:
+    - pd.DataFrame: A DataFrame containing the selected data from the 'offers' table, typed according
+                    to the offers schema (see 'apply_offers_schema').
+    """
+    select_query = build_select_query(columns, where, distinct, order_by)
+
+    with get_connection() as connection:
+        db_df = pd.read_sql_query(select_query, connection, params=params)
+        db_df = apply_offers_schema(attach_technologies(connection, db_df, columns))
 
     return db_df
 
 
-def update_voivodeship(updated_df: pd.DataFrame):
+def iter_offers(columns: list = None, where: str = None, params: tuple = (), chunksize: int = DB_CHUNK_SIZE,
+                order_by: str = None):
     """
-    This function takes a pandas DataFrame that contains updated 'voivodeship' information
-    alongside corresponding 'id' values. It constructs a set of tuples containing the new
-    'voivodeship' values and their associated 'id's. These tuples are then used in a SQL UPDATE
-    query to modify the 'voivodeship' values in the database.
+    This function works like 'query_offers' but instead of loading the whole result at once it yields
+    DataFrames of at most 'chunksize' rows. Peak memory stays bounded regardless of the database size.
 
     Parameters:
-    - updated_df (pd.DataFrame): A DataFrame containing 'voivodeship' and 'id' columns with updated
-                                information to be saved to the database.
+    - columns (list, optional): Columns to select. Defaults to all columns of the 'offers' table.
+    - where (str, optional): SQL condition with '?' placeholders, e.g. "voivodeship IS NULL".
+    - params (tuple, optional): Parameters substituted for the placeholders in the condition.
+    - chunksize (int, optional): Maximal number of rows in a single chunk. Defaults to DB_CHUNK_SIZE.
+    - order_by (str, optional): SQL ordering of the rows, e.g. "added_at".
+
+    Yields:
+    - pd.DataFrame: Consecutive chunks of the selected data from the 'offers' table.
+    """
+    select_query = build_select_query(columns, where, order_by=order_by)
+
+    with get_connection() as connection:
+        for db_chunk in pd.read_sql_query(select_query, connection, params=params, chunksize=chunksize):
+            yield apply_offers_schema(attach_technologies(connection, db_chunk, columns))
+
+
+def query_offers_with_technology(tech: str, columns: list = None):
+    """
+    This function loads offers requiring the given technology. The offers are found with the index on
+    technologies, without scanning the 'offers' table.
+
+    Parameters:
+    - tech (str): Name of the technology, e.g. 'Python'.
+    - columns (list, optional): Columns to select. Defaults to all columns of the 'offers' table.
+
+    Returns:
+    - pd.DataFrame: A DataFrame containing the selected data of the offers requiring the technology.
+    """
+    where = """id IN (
+        SELECT offer_technologies.offer_id
+        FROM offer_technologies
+        JOIN technologies ON technologies.id = offer_technologies.technology_id
+        WHERE technologies.name = ?
+    )"""
+
+    return query_offers(columns, where, (tech,))
+
+
+def load_from_db():
+    """
+    This function loads all columns of all offers from the 'offers' table in the database.
+    Function is loading the data into a DataFrame, on which format other operations are performed.
+    The 'technologies' column is rebuilt from the normalized tables into list objects.
+    Prefer 'query_offers' or 'iter_offers' when only a part of the data is needed.
+
+    Returns:
+    - pd.DataFrame: A DataFrame containing all the data from the 'offers' table.
+    """
+    return query_offers()
+
+
+def update_geodata(updated_df: pd.DataFrame):
+    """
+    This function takes a pandas DataFrame that contains updated geographic information ('voivodeship',
+    'lat' and 'lon') alongside corresponding 'id' values. It constructs a set of tuples containing the new
+    values and their associated 'id's. These tuples are then used in a SQL UPDATE query to modify the
+    offers in the database (and their 'updated_at'). Missing coordinates are saved as NULL. All updates
+    are written in a single transaction, so the DataFrame should contain only the offers which actually changed.
+
+    Parameters:
+    - updated_df (pd.DataFrame): A DataFrame containing 'voivodeship', 'lat', 'lon' and 'id' columns
+                                with updated information to be saved to the database.
+
+    Returns:
+    - int: The number of updated offers.
     """
     update_query = """
         UPDATE offers
-        SET voivodeship = ?
+        SET voivodeship = ?, lat = ?, lon = ?, updated_at = ?
         WHERE id = ?
         """
 
-    update_data = list(zip(updated_df['voivodeship'], updated_df['id']))
+    updated_at = datetime.now().strftime(TIMESTAMP_FORMAT)
+    update_data = [(voivodeship, lat, lon, updated_at, offer_id) for voivodeship, lat, lon, offer_id
+                   in zip(*[to_db_values(updated_df[column]) for column in ['voivodeship', 'lat', 'lon', 'id']])]
 
-    with sqlite3.connect(DB_PATH) as connection:
+    with get_connection() as connection:
         cursor = connection.cursor()
         cursor.executemany(update_query, update_data)
+        connection.commit()
+
+    return cursor.rowcount
+
+
+def count_technologies(site: str = None, experience: str = None, added_from: str = None,
+                       added_to: str = None, voivodeship: str = None):
+    """
+    This function counts in how many offers each technology appears, using the 'offer_technologies'
+    table instead of loading the offers. Counts can be narrowed down to offers matching
+    the given filters.
+
+    Parameters:
+    - site (str, optional): Count only offers from this site, e.g. 'pracuj.pl'.
+    - experience (str, optional): Count only offers for this level of experience, e.g. 'junior'.
+    - added_from (str, optional): Count only offers added at or after this date ('%Y-%m-%d %H:%M').
+    - added_to (str, optional): Count only offers added before this date ('%Y-%m-%d %H:%M').
+    - voivodeship (str, optional): Count only offers from this voivodeship.
+
+    Returns:
+    - dict: A dictionary mapping technologies to the number of offers, from the most popular one.
+    """
+    filters = [('site = ?', site), ('experience = ?', experience), ('added_at >= ?', added_from),
+               ('added_at < ?', added_to), ('voivodeship = ?', voivodeship)]
+    conditions = [condition for condition, value in filters if value is not None]
+    params = [value for _, value in filters if value is not None]
+
+    if conditions:
+        count_query = f"""
+            SELECT technologies.name, COUNT(*)
+            FROM offer_technologies
+            JOIN technologies ON technologies.id = offer_technologies.technology_id
+            JOIN offers ON offers.id = offer_technologies.offer_id
+            WHERE {' AND '.join(conditions)}
+            GROUP BY technologies.name
+            ORDER BY COUNT(*) DESC
+            """
+    else:
+        count_query = """
+            SELECT technologies.name, COUNT(*)
+            FROM offer_technologies
+            JOIN technologies ON technologies.id = offer_technologies.technology_id
+            GROUP BY technologies.name
+            ORDER BY COUNT(*) DESC
+            """
+
+    with get_connection() as connection:
+        tech_counts = connection.execute(count_query, params).fetchall()
+
+    return dict(tech_counts)
+
+
+def load_geocodes(include_misses: bool = False, misses_since: str = None):
+    """
+    This function loads the cached results of geographic lookups from the 'geocodes' table.
+
+    Parameters:
+    - include_misses (bool, optional): Whether to include cities which couldn't be found (negative cache).
+    - misses_since (str, optional): Include only misses cached after this date ('%Y-%m-%d %H:%M'),
+                                    so older misses can be looked up again.
+
+    Returns:
+    - dict: A dictionary mapping normalized city names to dictionaries with 'city', 'found', 'lat',
+            'lon' and 'voivodeship' keys.
+    """
+    select_query = """
+        SELECT city_key, city, found, lat, lon, voivodeship
+        FROM geocodes
+        WHERE found = 1 OR (? AND updated_at >= COALESCE(?, ''))
+        """
+
+    with get_connection() as connection:
+        rows = connection.execute(select_query, (include_misses, misses_since)).fetchall()
+
+    return {
+        city_key: {'city': city, 'found': found, 'lat': lat, 'lon': lon, 'voivodeship': voivodeship}
+        for city_key, city, found, lat, lon, voivodeship in rows
+    }
+
+
+def save_geocodes(geocodes: dict, updated_at: str):
+    """
+    This function merges results of geographic lookups into the 'geocodes' table. Cities already
+    cached are updated, all the other cached cities are kept.
+
+    Parameters:
+    - geocodes (dict): A dictionary in the format returned by 'load_geocodes'.
+    - updated_at (str): Time of the lookups.
+    """
+    upsert_query = """
+        INSERT INTO geocodes (city_key, city, found, lat, lon, voivodeship, updated_at)
+        VALUES (?,?,?,?,?,?,?)
+        ON CONFLICT (city_key) DO UPDATE SET
+            city = excluded.city, found = excluded.found, lat = excluded.lat, lon = excluded.lon,
+            voivodeship = excluded.voivodeship, updated_at = excluded.updated_at
+        """
+
+    geocodes_data = [(city_key, geo['city'], geo['found'], geo['lat'], geo['lon'], geo['voivodeship'], updated_at)
+                     for city_key, geo in geocodes.items()]
+
+    with get_connection() as connection:
+        cursor = connection.cursor()
+        cursor.executemany(upsert_query, geocodes_data)
+        connection.commit()
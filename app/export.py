@@ -0,0 +1,191 @@
+import json
+import os
+import shutil
+import yaml
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from datetime import datetime
+
+from database import get_connection, iter_offers, TIMESTAMP_FORMAT
+
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
+
+EXPORT_PATH = config['EXPORT_PATH']
+
+SYNC_STATE_NAME = '_sync.json'
+
+# columns stored in the Parquet files; 'site' and 'month' of 'added_at' are the partitions (directories)
+export_columns = ['id', 'experience', 'name', 'company', 'location', 'work_mode', 'salary_avg', 'salary_low',
+                  'salary_high', 'technologies', 'link', 'added_at', 'voivodeship', 'lat', 'lon']
+
+# columns with few distinct values are dictionary encoded (stored as categoricals)
+categorical_columns = ['experience', 'work_mode', 'voivodeship']
+
+export_schema = pa.schema([
+    ('id', pa.int64()),
+    ('experience', pa.dictionary(pa.int8(), pa.string())),
+    ('name', pa.string()),
+    ('company', pa.string()),
+    ('location', pa.string()),
+    ('work_mode', pa.dictionary(pa.int8(), pa.string())),
+    ('salary_avg', pa.float64()),
+    ('salary_low', pa.float64()),
+    ('salary_high', pa.float64()),
+    ('technologies', pa.list_(pa.string())),
+    ('link', pa.string()),
+    ('added_at', pa.timestamp('s')),
+    ('voivodeship', pa.dictionary(pa.int8(), pa.string())),
+    ('lat', pa.float64()),
+    ('lon', pa.float64()),
+])
+
+partitioning = ds.partitioning(pa.schema([('site', pa.string()), ('month', pa.string())]), flavor='hive')
+
+
+def get_partitions(since: str = None):
+    """
+    This function returns partitions (site and month of 'added_at') of the offers in the database.
+    If 'since' is given, only partitions containing offers inserted or changed since then are returned.
+
+    Returns:
+    - list: A list of (site, month) tuples, e.g. ('pracuj.pl', '2024-05').
+    """
+    select_query = """
+        SELECT DISTINCT site, substr(added_at, 1, 7)
+        FROM offers
+        WHERE added_at IS NOT NULL AND (? IS NULL OR updated_at >= ?)
+        ORDER BY 1, 2
+        """
+
+    with get_connection() as connection:
+        partitions = connection.execute(select_query, (since, since)).fetchall()
+    connection.close()
+
+    return partitions
+
+
+def partition_path(site: str, month: str):
+    """
+    This function returns the directory of the partition, in the Hive layout ('site=.../month=...').
+    """
+    return os.path.join(EXPORT_PATH, f"site={site}", f"month={month}")
+
+
+def offers_to_table(offers: pd.DataFrame):
+    """
+    This function converts offers loaded from the database into an Arrow table with 'export_schema':
+    columns with few distinct values become dictionary encoded, technologies are kept as list columns
+    and 'added_at' becomes a timestamp, so it can be filtered by range.
+    """
+    offers = offers[export_columns].copy()
+    offers['added_at'] = pd.to_datetime(offers['added_at'], format='%Y-%m-%d %H:%M', errors='coerce')
+    for column in categorical_columns:
+        offers[column] = offers[column].astype('category')
+
+    return pa.Table.from_pandas(offers, schema=export_schema, preserve_index=False)
+
+
+def export_partition(site: str, month: str):
+    """
+    This function writes all offers of the partition from the database into a single Parquet file, sorted by
+    'added_at'. The offers are read in chunks and the file is written to a temporary directory first, which
+    then replaces the partition, so readers never see a partially written partition.
+
+    Returns:
+    - int: The number of exported offers.
+    """
+    year, month_number = map(int, month.split('-'))
+    next_month = f"{year + month_number // 12}-{month_number % 12 + 1:02d}"
+
+    path = partition_path(site, month)
+    # hidden from readers of the dataset, which skip names starting with '.'
+    tmp_path = os.path.join(os.path.dirname(path), f".month={month}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    exported = 0
+    with pq.ParquetWriter(os.path.join(tmp_path, 'part-0.parquet'), export_schema, compression='zstd') as writer:
+        for offers_chunk in iter_offers(export_columns, where="site = ? AND added_at >= ? AND added_at < ?",
+                                        params=(site, month, next_month), order_by='added_at'):
+            writer.write_table(offers_to_table(offers_chunk))
+            exported += offers_chunk.shape[0]
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    return exported
+
+
+def load_sync_state():
+    """
+    This function returns the time of the last export ('%Y-%m-%d %H:%M:%S'), or None if nothing was exported yet.
+    """
+    state_path = os.path.join(EXPORT_PATH, SYNC_STATE_NAME)
+    if not os.path.exists(state_path):
+        return None
+
+    with open(state_path, 'r') as state_file:
+        return json.load(state_file)['synced_at']
+
+
+def sync_parquet(full: bool = False):
+    """
+    This function exports the offers from the database into a Parquet dataset partitioned by site and month
+    of 'added_at' (EXPORT_PATH/site=.../month=.../part-0.parquet). The export is incremental: only partitions
+    containing offers inserted or changed since the previous export (by their 'updated_at') are rewritten,
+    so a daily run touches only the partitions of the current month. Offers without 'added_at' are not exported.
+
+    Parameters:
+    - full (bool, optional): Whether to rewrite all partitions instead of only the changed ones.
+
+    Returns:
+    - int: The number of exported offers.
+    """
+    synced_at = datetime.now().strftime(TIMESTAMP_FORMAT)
+    since = None if full else load_sync_state()
+
+    if full:
+        shutil.rmtree(EXPORT_PATH, ignore_errors=True)
+    os.makedirs(EXPORT_PATH, exist_ok=True)
+
+    partitions = get_partitions(since)
+    exported = sum(export_partition(site, month) for site, month in partitions)
+
+    with open(os.path.join(EXPORT_PATH, SYNC_STATE_NAME), 'w') as state_file:
+        json.dump({'synced_at': synced_at}, state_file)
+
+    print(f"Exported {exported} offers in {len(partitions)} partitions to {EXPORT_PATH}")
+
+    return exported
+
+
+def offers_dataset():
+    """
+    This function opens the exported offers as a lazy Arrow dataset, with 'site' and 'month' as partition
+    columns. Scans of the dataset read only the needed columns, files and row groups.
+    """
+    return ds.dataset(EXPORT_PATH, format='parquet', partitioning=partitioning)
+
+
+def read_offers(columns: list = None, filters=None):
+    """
+    This function reads exported offers into a DataFrame without touching the database. Filters are pushed
+    down to the dataset: partitions of other sites and months are skipped entirely and row groups are
+    skipped using Parquet statistics. Only the requested columns are read from the files.
+
+    Parameters:
+    - columns (list, optional): Columns to read. Defaults to all columns (including 'site' and 'month').
+    - filters (list or pyarrow.compute.Expression, optional): Conditions in the format of
+        'pyarrow.parquet.read_table', e.g. [('site', '=', 'pracuj.pl'), ('month', '>=', '2024-05'),
+        ('voivodeship', 'in', ['mazowieckie', 'pomorskie'])].
+
+    Returns:
+    - pd.DataFrame: A DataFrame with the selected offers; dictionary encoded columns become categoricals.
+    """
+    table = pq.read_table(EXPORT_PATH, columns=columns, filters=filters, partitioning=partitioning)
+
+    return table.to_pandas()
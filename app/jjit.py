@@ -1,42 +1,106 @@
-from bs4 import BeautifulSoup
 from bs4.element import Tag
+from concurrent.futures import ThreadPoolExecutor
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
 import pandas as pd
+import queue
 import time
-
-from commons import get_driver
-
-
-def extract_features_jjit(offer: Tag, links: list):
+import yaml
+from string import Template
+
+from commons import get_driver, show_duration, DriverPool, SeenLinks, PageParser, SELECTORS
+from metrics import metrics
+from checkpoint import CrawlJournal
+from cleaning import normalize_salaries, apply_offers_schema, concat_offers, offer_fingerprints, SALARY_AMOUNT_JJIT
+
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
+
+JJIT_WORKERS = config['JJIT_WORKERS']
+JJIT_EXTRACTION = config['JJIT_EXTRACTION']
+JJIT_MAX_WAIT = config['JJIT_MAX_WAIT']
+JJIT_POLL_FREQUENCY = config['JJIT_POLL_FREQUENCY']
+INCREMENTAL_CRAWL = config['INCREMENTAL_CRAWL']
+INCREMENTAL_STOP_AFTER = config['INCREMENTAL_STOP_AFTER']
+JJIT_SCROLL_STEP = 700
+
+parser_jjit = PageParser('justjoin.it')
+
+# Snapshot of the rendered list: number of cards, link of the last card and page height. The list
+# is virtualized, so new content shows up as a change of any of these values.
+LIST_STATE_JS = Template("""
+const cards = document.querySelectorAll('$card');
+const lastLink = cards.length ? cards[cards.length - 1].querySelector('a')?.getAttribute('href') : null;
+return [cards.length, lastLink, document.body.scrollHeight];
+""").substitute(SELECTORS['justjoin.it'])
+
+# Whether the viewport reached the end of the page.
+AT_BOTTOM_JS = "return window.scrollY + window.innerHeight >= document.body.scrollHeight - 1;"
+
+# Returns details of offer cards rendered since the previous call, in the same format as 'extract_features_jjit'.
+# Links of already returned offers are kept in the page, so every call reads only the new cards.
+EXTRACT_NEW_OFFERS_JS = Template("""
+window.scrapedLinks = window.scrapedLinks || new Set();
+const text = (card, selector) => {
+    const element = card.querySelector(selector);
+    return element ? element.textContent : null;
+};
+const newOffers = [];
+for (const card of document.querySelectorAll('$card')) {
+    const anchor = card.querySelector('$link');
+    if (!anchor) continue;
+    const link = anchor.getAttribute('href');
+    if (window.scrapedLinks.has(link)) continue;
+    window.scrapedLinks.add(link);
+    const technologies = card.querySelector('$technologies');
+    const techs = technologies
+        ? Array.from(technologies.querySelectorAll('$technology'), tech => tech.textContent) : [];
+    newOffers.push([
+        text(card, '$name'),
+        text(card, '$company'),
+        text(card, '$salary'),
+        text(card, '$location'),
+        text(card, '$work_mode') ?? 'Not specified',
+        techs,
+        link
+    ]);
+}
+return newOffers;
+""").substitute(SELECTORS['justjoin.it'])
+
+
+def extract_features_jjit(offer: Tag, links: SeenLinks):
     """
     Extracts key features from a single job offer.
 
     This function processes a BeautifulSoup Tag representing a job offer and extracts
-    various details like name, company, salary, location, work mode, and technologies.
+    various details like name, company, salary, location, work mode, and technologies
+    with the precompiled selectors of the site (see 'PageParser').
     It also keeps track of processed links to avoid duplicates.
 
     Parameters:
     - offer (Tag): A BeautifulSoup Tag object representing the job offer.
-    - links (list): A list of links that have already been processed.
+    - links (SeenLinks): Links that have already been processed.
 
     Returns:
-    - tuple: A tuple containing the extracted offer details and the updated list of links.
+    - tuple: A tuple containing the extracted offer details and the updated set of links.
     """
-    link = offer.find('a', class_="offer_list_offer_link css-4lqp8g")['href']
+    link = parser_jjit.select_one('link', offer)['href']
+    links.track(link)
 
     if link in links:
+        metrics.inc('duplicates_skipped')
         return None, links
 
-    links.append(link)
+    links.add(link)
 
-    name = offer.find('h2', class_="css-1gehlh0").text
-    company = offer.find('div', class_="css-aryx9u").text
-    salary = offer.find('div', class_="css-17pspck").text
-    location = offer.find('div', class_="css-11qgze1").text
-    try:
-        work_mode = offer.find('div', class_="css-7ktfgf").text
-    except (IndexError, AttributeError):
-        work_mode = "Not specified"
-    technology = offer.find('div', class_="css-yicj0q").find_all('div', class_='css-1am4i4o')
+    name = parser_jjit.select_one('name', offer).text
+    company = parser_jjit.select_one('company', offer).text
+    salary = parser_jjit.select_one('salary', offer).text
+    location = parser_jjit.select_one('location', offer).text
+    work_mode = parser_jjit.text('work_mode', offer, default="Not specified")
+    technology = parser_jjit.select('technology', parser_jjit.select_one('technologies', offer))
     techs = [tech.text for tech in technology]
 
     new_offer = [name, company, salary, location, work_mode, techs, link]
@@ -44,25 +108,23 @@ def extract_features_jjit(offer: Tag, links: list):
     return new_offer, links
 
 
-def parse_data_jjit(driver, offers: list, links: list):
+def parse_data_jjit(driver, offers: list, links: SeenLinks):
     """
     Parses the job offers from the page source obtained via the WebDriver.
 
-    Initializes the soup object, iterate over the job offers in the page source
+    Parses only the offer cards of the page source (see 'PageParser'), iterates over them
     and extracts details from each offer.
     It uses the 'extract_features_jjit' function to extract details of each offer.
 
     Parameters:
     - driver: The Selenium WebDriver used to navigate the page.
     - offers (list): A list to collect the data of each job offer.
-    - links (list): A list of links that have already been processed.
+    - links (SeenLinks): Links that have already been processed.
 
     Returns:
-    - tuple: A tuple containing the list of offers and the list of processed links.
+    - tuple: A tuple containing the list of offers and the set of processed links.
     """
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
-
-    for offer in soup.find_all('div', class_="css-2crog7"):
+    for offer in parser_jjit.parse(driver.page_source):
 
         new_offer, links = extract_features_jjit(offer, links)
 
@@ -72,45 +134,148 @@ def parse_data_jjit(driver, offers: list, links: list):
     return offers, links
 
 
-def scrape_jjit(url: str):
+def extract_new_offers_jjit(driver, offers: list, links: SeenLinks):
+    """
+    Extracts only the offers rendered since the previous call, without re-parsing the whole page.
+
+    Instead of serializing the page source and parsing it with BeautifulSoup, a JS snippet reads
+    the offer cards directly in the browser and returns details of the cards with unseen links,
+    in the same format as 'extract_features_jjit'. The cost of each scroll step depends only on
+    the number of new cards, not on the length of the whole list.
+
+    Parameters:
+    - driver: The Selenium WebDriver used to navigate the page.
+    - offers (list): A list to collect the data of each job offer.
+    - links (SeenLinks): Links that have already been processed.
+
+    Returns:
+    - tuple: A tuple containing the list of offers and the set of processed links.
+    """
+    for new_offer in driver.execute_script(EXTRACT_NEW_OFFERS_JS):
+        link = new_offer[-1]
+        links.track(link)
+
+        if link in links:
+            metrics.inc('duplicates_skipped')
+            continue
+
+        links.add(link)
+        offers.append(new_offer)
+
+    return offers, links
+
+
+def wait_for_change(driver, state: list, max_wait: float = JJIT_MAX_WAIT):
+    """
+    Waits until the rendered list differs from the given state (new cards, different last card or
+    page height), but no longer than max_wait seconds.
+
+    Parameters:
+    - driver: The Selenium WebDriver used to navigate the page.
+    - state (list): State of the list returned by LIST_STATE_JS before the change.
+    - max_wait (float, optional): Maximal waiting time in seconds. Defaults to JJIT_MAX_WAIT.
+
+    Returns:
+    - bool: True if the list changed, False if waiting timed out.
+    """
+    try:
+        WebDriverWait(driver, max_wait, poll_frequency=JJIT_POLL_FREQUENCY).until(
+            lambda d: d.execute_script(LIST_STATE_JS) != state)
+        return True
+    except TimeoutException:
+        return False
+
+
+def scrape_jjit(url: str, driver=None, extraction: str = JJIT_EXTRACTION, stats: dict = None,
+                known: SeenLinks = None, stop_after: int = None):
     """
     Scrapes job offers from a given URL using a Selenium WebDriver.
 
-    Initializes a WebDriver, navigates to the given URL, and repeatedly scrolls through
-    the page to load all job offers. Scrolling is necessary because site doesn't reveal
-    all offers. Instead, they appear while user scrolls down.
-    Extracts the data from each offer and compiles it into a list.
+    Navigates to the given URL, and scrolls through the page to load all job offers.
+    Scrolling is necessary because site doesn't reveal all offers. Instead, they appear while
+    user scrolls down. Extracts the data from each offer and compiles it into a list.
+    If no driver is given, a new one is initialized and quit after scraping.
+
+    Instead of sleeping a fixed time after every scroll step, the function waits only when the step
+    didn't reveal any new offer, and only until the list actually changes (at most JJIT_MAX_WAIT).
+    Scraping stops as soon as the bottom of the page is reached and nothing new appears. In the incremental
+    mode (stop_after is given and the offers are sorted from the newest), scrolling stops as soon as
+    stop_after offers in a row are already known - the rest of the list was scraped by previous runs.
 
     Parameters:
     - url (str): The URL of the website to scrape.
+    - driver (optional): The Selenium WebDriver to reuse.
+    - extraction (str, optional): 'js' to read only newly rendered cards after each scroll step
+                                  ('extract_new_offers_jjit'), 'soup' to re-parse the whole page
+                                  source ('parse_data_jjit'). Defaults to JJIT_EXTRACTION from config.
+    - stats (dict, optional): Dictionary in which time spent on waiting ('wait_time') and on parsing
+                              ('parse_time') is accumulated, as well as the number of urls where scrolling
+                              stopped early ('stopped_early'). The times of this url are also recorded
+                              in the 'wait_seconds' and 'parse_seconds' metrics.
+    - known (SeenLinks, optional): Links of offers to skip, e.g. offers already stored in the database.
+    - stop_after (int, optional): Number of known offers in a row after which scrolling stops.
 
     Returns:
     - list: A list of extracted job offers.
     """
-    driver = get_driver()
-    driver.get(url)
+    parse_step = extract_new_offers_jjit if extraction == 'js' else parse_data_jjit
+    stats = stats if stats is not None else {}
+    stats.setdefault('wait_time', 0.0)
+    stats.setdefault('parse_time', 0.0)
+    stats.setdefault('stopped_early', 0)
+    wait_time, parse_time = stats['wait_time'], stats['parse_time']
 
-    start_point = 0
-    height = driver.execute_script("return document.body.scrollHeight")
+    own_driver = driver is None
+    if own_driver:
+        driver = get_driver()
+
+    driver.get(url)
+    metrics.inc('pages_fetched')
 
     offers = []
-    links = []
+    links = SeenLinks(known=known, stop_after=stop_after)
+    position = 0
+
+    start_time = time.time()
+    wait_for_change(driver, [0, None, driver.execute_script("return document.body.scrollHeight")])
+    stats['wait_time'] += time.time() - start_time
 
     while True:
-        for i in range(start_point, height, 700):
-            driver.execute_script(f"window.scrollTo(0, {i});")
-            time.sleep(0.5)
-            offers, links = parse_data_jjit(driver, offers, links)
+        state = driver.execute_script(LIST_STATE_JS)
+        driver.execute_script(f"window.scrollTo(0, {position});")
 
-        new_height = driver.execute_script("return document.body.scrollHeight")
+        start_time = time.time()
+        offers_number = len(offers)
+        offers, links = parse_step(driver, offers, links)
+        stats['parse_time'] += time.time() - start_time
 
-        if new_height == height:
+        if links.exhausted:
             break
 
-        start_point = height
-        height = new_height
+        if len(offers) == offers_number:
+            start_time = time.time()
+            changed = wait_for_change(driver, state)
+            stats['wait_time'] += time.time() - start_time
+
+            if changed:
+                start_time = time.time()
+                offers, links = parse_step(driver, offers, links)
+                stats['parse_time'] += time.time() - start_time
+
+            if links.exhausted or (len(offers) == offers_number and driver.execute_script(AT_BOTTOM_JS)):
+                break
+
+        position += JJIT_SCROLL_STEP
+
+    if own_driver:
+        driver.quit()
 
-    driver.quit()
+    if links.exhausted:
+        stats['stopped_early'] += 1
+        metrics.inc('listings_stopped_early')
+
+    metrics.inc('wait_seconds', stats['wait_time'] - wait_time)
+    metrics.inc('parse_seconds', stats['parse_time'] - parse_time)
 
     return offers, links
 
@@ -120,6 +285,9 @@ def split_salary_jjit(row):
     Splits salary strings into lowest, highest and average salary.
     If salary in offer is undisclosed returs empty pd.Series
 
+    Row-wise reference implementation - 'clear_data_jjit' uses the vectorized 'normalize_salaries',
+    which gives the same results. It is kept to verify and benchmark the vectorized version.
+
     Parameters:
     - row (str): salary.
 
@@ -143,7 +311,8 @@ def split_salary_jjit(row):
 
 def clear_data_jjit(offers_list: list):
     """
-    Turns lists into DataFrame and performs basic cleaning operations
+    Turns lists into DataFrame and performs basic cleaning operations. Columns of the DataFrame
+    are typed according to the offers schema (see 'apply_offers_schema').
 
     Parameters:
     - offers_list (list): list of all offers.
@@ -158,63 +327,177 @@ def clear_data_jjit(offers_list: list):
     offers_df['location'] = offers_df['location'].apply(lambda x: x.split(',')[0])
     offers_df['location'] = offers_df['location'].apply(lambda x: x.replace("Warsaw", "Warszawa"))
     offers_df['work_mode'] = offers_df['work_mode'].apply(lambda x: x.replace("Fully remote", "Praca zdalna"))
-    offers_df[['salary_low', 'salary_high', 'salary_avg']] = offers_df['salary'].apply(split_salary_jjit)
+    offers_df = offers_df.join(normalize_salaries(offers_df['salary'], SALARY_AMOUNT_JJIT))
 
     offers_df = offers_df[['name', 'company', 'location', 'work_mode', 'salary_avg',
                            'salary_low', 'salary_high', 'technologies', 'link']]
 
-    return offers_df
+    return apply_offers_schema(offers_df)
 
 
-def merge_new_offers_jjit(url: str, exp: str, offers_all: pd.DataFrame):
+def worker_jjit(worker_id: int, tasks: queue.Queue, results: dict, pool: DriverPool, known: SeenLinks = None,
+                journal: CrawlJournal = None, stop_after: int = None):
     """
-    Perfoms scraping one url, cleans results and merges them with previous results
+    Scrapes URLs taken from the shared queue until it is empty, using drivers handed out by the pool.
+    Scraped offers are stored in the shared results dictionary under the URL. A failure of a single URL
+    is reported and skipped, so it doesn't stop the other tasks. Metrics recorded while scraping a URL
+    are labeled with its category and level of experience. If a crawl journal is given, every scraped URL
+    is recorded in it and URLs completed by a resumed run are read from it instead of being scraped.
 
     Parameters:
-    - url (str): url
-    - exp (str): currently scrapping level of experience
-    - offers_all (pd.DataFrame): previosuly scraped offers
+    - worker_id (int): Number of the worker, used in the reported statistics.
+    - tasks (queue.Queue): Queue of URLs to scrape.
+    - results (dict): Dictionary collecting scraped offers of each URL.
+    - pool (DriverPool): Pool of WebDriver sessions.
+    - known (SeenLinks, optional): Links of offers to skip.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl.
+    - stop_after (int, optional): Number of known offers in a row after which scrolling stops (see 'scrape_jjit').
 
     Returns:
-    - offers_all (pd.DataFrame): df of merged offers.
+    - dict: Timing statistics of the worker (number of URLs, offers, busy time, time spent on waiting
+            for content and on parsing and number of URLs where scrolling stopped early).
     """
-    offers, links = scrape_jjit(url)
+    stats = {'worker': worker_id, 'urls': 0, 'offers': 0, 'time': 0.0, 'wait_time': 0.0, 'parse_time': 0.0,
+             'stopped_early': 0}
 
-    if offers:
-        new_offers = clear_data_jjit(offers)
-        new_offers['experience'] = exp
-        return pd.concat([offers_all, new_offers])
+    while True:
+        try:
+            url = tasks.get_nowait()
+        except queue.Empty:
+            break
 
-    else:
-        return offers_all
+        category, experience = url.split('?')[0].rstrip('/').split('/')[-2:]
+        labels = {'site': 'justjoin.it', 'category': category, 'experience': experience.split('_')[-1]}
+
+        scraped = journal.get('justjoin.it', url).get(1) if journal else None
+        if scraped is not None:
+            results[url] = scraped[0]
+            metrics.inc('units_resumed', **labels)
+            continue
+
+        start_time = time.time()
+        with metrics.labels(**labels):
+            try:
+                with pool.driver() as driver:
+                    offers, _ = scrape_jjit(url, driver, stats=stats, known=known, stop_after=stop_after)
+                if journal:
+                    journal.record('justjoin.it', url, 1, offers)
+            except Exception as e:
+                print(f"Worker {worker_id} couldn't scrape {url}, because: {e}")
+                metrics.inc('pages_failed')
+                offers = []
+            metrics.inc('offers_extracted', len(offers))
+        results[url] = offers
+
+        stats['urls'] += 1
+        stats['offers'] += len(offers)
+        stats['time'] += time.time() - start_time
+
+    return stats
+
+
+def scrape_all_jjit(urls: list, pool: DriverPool = None, workers: int = JJIT_WORKERS, known: SeenLinks = None,
+                    journal: CrawlJournal = None, stop_after: int = None):
+    """
+    Scrapes the given URLs concurrently with a bounded pool of workers sharing reusable WebDriver
+    sessions. The URLs are pulled from a shared queue, so the workers stay busy until all of them
+    are scraped. Timing statistics of each worker are printed.
 
+    Parameters:
+    - urls (list): URLs to scrape.
+    - pool (DriverPool, optional): Pool of WebDriver sessions. If not given, a pool of 'workers'
+                                   drivers is created for this call only.
+    - workers (int, optional): Number of concurrent workers. Defaults to JJIT_WORKERS.
+    - known (SeenLinks, optional): Links of offers to skip.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl (see 'worker_jjit').
+    - stop_after (int, optional): Number of known offers in a row after which scrolling stops (see 'scrape_jjit').
 
-def search_jjit(categories_list: list):
+    Returns:
+    - dict: Dictionary mapping each URL to the list of offers scraped from it.
+    """
+    if pool is None:
+        with DriverPool(size=workers) as own_pool:
+            return scrape_all_jjit(urls, own_pool, workers, known, journal, stop_after)
+
+    tasks = queue.Queue()
+    for url in urls:
+        tasks.put(url)
+
+    results = {}
+    workers = max(1, min(workers, len(urls)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker_jjit, worker_id, tasks, results, pool, known, journal, stop_after)
+                   for worker_id in range(1, workers + 1)]
+        workers_stats = [future.result() for future in futures]
+
+    for stats in workers_stats:
+        print(f"Worker {stats['worker']}: scraped {stats['offers']} offers from {stats['urls']} urls "
+              f"in {show_duration(stats['time'], 0)} (waiting: {show_duration(stats['wait_time'], 0)}, "
+              f"parsing: {show_duration(stats['parse_time'], 0)})"
+              + (f", stopped early on {stats['stopped_early']} urls" if stop_after else ''))
+
+    return results
+
+
+def clear_new_offers_jjit(offers: list, exp: str):
+    """
+    Cleans offers scraped from one url and sets their level of experience
+
+    Parameters:
+    - offers (list): offers scraped from one url
+    - exp (str): level of experience of scraped offers
+
+    Returns:
+    - new_offers (pd.DataFrame): df of cleaned offers.
+    """
+    new_offers = clear_data_jjit(offers)
+    new_offers['experience'] = exp
+
+    return new_offers
+
+
+def search_jjit(categories_list: list, pool: DriverPool = None, known: SeenLinks = None, journal: CrawlJournal = None,
+                incremental: bool = INCREMENTAL_CRAWL):
     """
     Searches and aggregates job offers from JustJoin.It for specified categories and experience levels.
-    This function iterates over a list of job categories and predefined experience levels, constructing URLs
-    to scrape job offers from JustJoin.It. It compiles the offers into a pd.DataFrame
+    This function constructs URLs for every combination of job category and predefined experience level
+    and scrapes them concurrently (see 'scrape_all_jjit'). It compiles the offers into a pd.DataFrame
+    (typed according to the offers schema, with fingerprints of the offers) in the same order as URLs
+    were constructed.
 
     Parameters:
     - categories_list (list): A list of job categories to be searched (e.g., ['it', 'marketing']).
+    - pool (DriverPool, optional): Pool of WebDriver sessions to use.
+    - known (SeenLinks, optional): Links of offers to skip, e.g. offers already stored in the database.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl, used to resume an interrupted run.
+    - incremental (bool, optional): Whether to list offers from the newest and stop scrolling each list after
+                                    INCREMENTAL_STOP_AFTER known offers in a row (requires known links).
+                                    Defaults to INCREMENTAL_CRAWL from config.
 
     Returns:
     - DataFrame: A pandas DataFrame containing the aggregated job offers.
     """
-    offers_all = pd.DataFrame(columns=['experience', 'name', 'company', 'location', 'work_mode', 'salary_avg',
-                                       'salary_low', 'salary_high', 'technologies', 'link'])
-
     experience_list = ['junior', 'mid', 'senior', 'c-level']
 
-    for category in categories_list:
-        for exp in experience_list:
+    incremental = incremental and known is not None
+    # in the incremental mode the newest offers are listed first
+    sorting = '?orderBy=DESC&sortBy=published' if incremental else ''
+
+    url_exp = [(f'https://justjoin.it/all-locations/{category}/experience-level_{exp}{sorting}', exp)
+               for category in categories_list for exp in experience_list]
+
+    results = scrape_all_jjit([url for url, _ in url_exp], pool, known=known, journal=journal,
+                              stop_after=INCREMENTAL_STOP_AFTER if incremental else None)
 
-            url = f'https://justjoin.it/all-locations/{category}/experience-level_{exp}'
-            offers_all = merge_new_offers_jjit(url, exp, offers_all)
+    # offers of all urls are concatenated at once, instead of growing the DataFrame url by url
+    # (urls without offers give empty DataFrames, which keep the columns when no url has any offer)
+    offers_all = concat_offers([clear_new_offers_jjit(results[url], exp) for url, exp in url_exp])
 
     offers_all['site'] = "justjoin.it"
+    offers_all['fingerprint'] = offer_fingerprints(offers_all)
 
     offers_all = offers_all[['site', 'experience', 'name', 'company', 'location', 'work_mode', 'salary_avg',
-                             'salary_low', 'salary_high', 'technologies', 'link']].reset_index(drop=True)
+                             'salary_low', 'salary_high', 'technologies', 'link', 'fingerprint']].reset_index(drop=True)
 
-    return offers_all
+    return apply_offers_schema(offers_all)
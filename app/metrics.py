@@ -0,0 +1,169 @@
+import contextvars
+import cProfile
+import json
+import os
+import threading
+import time
+import yaml
+from contextlib import contextmanager
+from datetime import datetime
+
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
+
+METRICS_PATH = config['METRICS_PATH']
+METRICS_PROMETHEUS_PATH = config['METRICS_PROMETHEUS_PATH']
+METRICS_PROFILER = config['METRICS_PROFILER']
+METRICS_PROFILE_DIR = config['METRICS_PROFILE_DIR']
+
+# prefix of the metric names in the Prometheus text file
+PROMETHEUS_PREFIX = 'scraper_'
+
+
+class Metrics:
+    """
+    Thread-safe registry of the metrics of one run of the pipeline. Every metric is a number accumulated
+    under its name and labels (e.g. site and category), so counters ('pages_fetched', 'bytes_downloaded')
+    and measured times ('parse_seconds') are recorded the same way. Labels set with 'labels' apply to all
+    metrics recorded in the current thread within the block, so deeply nested functions don't need to know
+    which site or category they work for.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        self.context = contextvars.ContextVar('metrics_labels', default={})
+        self.run = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """
+        Adds the value to the metric with the given name and labels (merged with the labels of the context).
+        """
+        labels = {**self.context.get(), **labels}
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    @contextmanager
+    def labels(self, **labels):
+        """
+        Applies the labels to all metrics recorded in the current thread within the block.
+        """
+        token = self.context.set({**self.context.get(), **labels})
+        try:
+            yield
+        finally:
+            self.context.reset(token)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Measures the time spent within the block and adds it to the '<name>_seconds' metric.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(f"{name}_seconds", time.perf_counter() - start_time, **labels)
+
+    def total(self, name: str):
+        """
+        Returns the sum of the metric over all labels.
+        """
+        with self.lock:
+            return sum(value for (metric, _), value in self.values.items() if metric == name)
+
+    def records(self):
+        """
+        Returns all metrics as a list of dictionaries with 'metric', 'labels' and 'value' keys.
+        """
+        with self.lock:
+            return [{'metric': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.values.items())]
+
+    def reset(self):
+        """
+        Removes all metrics and starts a new run.
+        """
+        with self.lock:
+            self.values = {}
+            self.run = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def stage(name: str, profiler: str = METRICS_PROFILER):
+    """
+    Measures a stage of the pipeline ('stage_seconds' metric with the 'stage' label). If a profiler is
+    chosen ('cprofile' or 'pyinstrument', METRICS_PROFILER in config), the stage is also profiled and
+    the profile is saved to METRICS_PROFILE_DIR: cProfile statistics ('.prof', e.g. for snakeviz) or
+    a pyinstrument HTML report. cProfile sees only the calling thread, pyinstrument samples it as well.
+    """
+    profile = None
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        profile.enable()
+    elif profiler == 'pyinstrument':
+        from pyinstrument import Profiler
+        profile = Profiler()
+        profile.start()
+
+    try:
+        with metrics.timer('stage', stage=name):
+            yield
+    finally:
+        if profile is not None:
+            os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+            file_name = f"{metrics.run.replace(' ', '_').replace(':', '')}-{name}"
+            if profiler == 'cprofile':
+                profile.disable()
+                profile.dump_stats(os.path.join(METRICS_PROFILE_DIR, file_name + '.prof'))
+            else:
+                profile.stop()
+                with open(os.path.join(METRICS_PROFILE_DIR, file_name + '.html'), 'w') as profile_file:
+                    profile_file.write(profile.output_html())
+
+
+def escape_label(value):
+    """
+    This function escapes a label value for the Prometheus text format.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(records: list):
+    """
+    This function formats the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for name in sorted({record['metric'] for record in records}):
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} gauge")
+        for record in records:
+            if record['metric'] != name:
+                continue
+            labels = ','.join(f'{label}="{escape_label(value)}"' for label, value in record['labels'].items())
+            lines.append(f"{PROMETHEUS_PREFIX}{name}{{{labels}}} {record['value']}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics():
+    """
+    This function appends the metrics of the run to METRICS_PATH as JSON lines (one line per metric,
+    with the time of the run) and, if METRICS_PROMETHEUS_PATH is set, replaces the Prometheus text file
+    (e.g. for the textfile collector of node_exporter).
+    """
+    records = metrics.records()
+
+    os.makedirs(os.path.dirname(METRICS_PATH) or '.', exist_ok=True)
+    with open(METRICS_PATH, 'a') as metrics_file:
+        for record in records:
+            metrics_file.write(json.dumps({'run': metrics.run, **record}, ensure_ascii=False) + '\n')
+
+    if METRICS_PROMETHEUS_PATH:
+        with open(METRICS_PROMETHEUS_PATH + '.tmp', 'w') as prometheus_file:
+            prometheus_file.write(format_prometheus(records))
+        os.replace(METRICS_PROMETHEUS_PATH + '.tmp', METRICS_PROMETHEUS_PATH)
@@ -1,4 +1,3 @@
-import pickle
 import pandas as pd
 from datetime import datetime
 import yaml
@@ -6,57 +5,56 @@ import time
 
 from additional_data import get_geodata, geodata_todb, create_tech_dict
 from pracuj import search_pracuj
-from jjit import search_jjit
-from database import create_db_if_not_exists, save_to_db, load_from_db
+from jjit import search_jjit, JJIT_WORKERS
+from commons import show_duration, DriverPool, SeenLinks
+from database import create_db_if_not_exists, save_to_db, duplicates_columns
+from backup import create_backup
+from export import sync_parquet
+from cleaning import apply_offers_schema, concat_offers, offer_fingerprints, report_memory
+from metrics import metrics, stage, write_metrics
+from checkpoint import CrawlJournal, CRAWL_JOURNAL_PATH
 
 
 config_path = '../config.yaml'
 with open(config_path, 'r') as file:
     config = yaml.safe_load(file)
 
-BACKUP_PATH = config['BACKUP_PATH']
+SKIP_KNOWN_LINKS = config['SKIP_KNOWN_LINKS']
+INCREMENTAL_CRAWL = config['INCREMENTAL_CRAWL']
 
-# if columns below are the same we treat offer as duplicate
-duplicates_columns = ['site', 'experience', 'name', 'company']
 
-
-def save_and_backup(new_offers: pd.DataFrame, duplicates=duplicates_columns):
+def save_and_backup(new_offers: pd.DataFrame):
     """
-    This function updates the existing offers database with new offers. It first creates a backup
-    of the current database into pickle file and then appends the new offers to the database,
-    removing any duplicates based on specified columns.
+    This function updates the existing offers database with new offers. It first backs up the current
+    database (a compressed full backup or only the changes since the previous one, see 'create_backup')
+    and then upserts the new offers to the database.
+    Duplicates are handled by the database itself (UNIQUE index on fingerprints of the offers), so only
+    the offers from the current batch are written - the history is never re-inserted.
 
     Parameters:
     - new_offers (pd.DataFrame): A DataFrame containing new job offers to be added to the database.
-    - duplicates (list): A list of columns to consider when removing duplicates.
 
     Returns:
-    - int or str: The number of new offers added to the database, or a message indicating that a
-                  new database was created.
+    - tuple: The number of offers inserted to the database and the number of already stored
+             offers which were updated.
     """
-    backup_day = datetime.now().strftime("%Y-%m-%d")
-
-    offers_db = load_from_db()
-
-    backup_file_name = BACKUP_PATH + backup_day
-    with open(backup_file_name, 'wb') as backup_file:
-        pickle.dump(offers_db, backup_file)
+    backup = create_backup()
+    print(f"Created {backup['kind']} backup {backup['file']}")
 
-    offers_updated = pd.concat([offers_db, new_offers])
-    offers_updated = offers_updated.drop_duplicates(subset=duplicates)
-    new_offers_number = offers_updated.shape[0]
+    inserted, updated = save_to_db(new_offers.reset_index(drop=True))
+    metrics.inc('db_rows_inserted', inserted)
+    metrics.inc('db_rows_updated', updated)
 
-    save_to_db(offers_updated.reset_index(drop=True))
-
-    return new_offers_number
+    return inserted, updated
 
 
 def merge_offers(offers_jjit: pd.DataFrame, offers_pracuj: pd.DataFrame, duplicates=duplicates_columns):
     """
     This function combines job offers from JustJoin.It and Pracuj.pl into a single DataFrame.
-    It removes duplicates based on specified columns and adds a timestamp indicating when the
+    It removes duplicates based on fingerprints of the specified columns (computed while cleaning
+    the offers of each site for the default columns) and adds a timestamp indicating when the
     offers were added to the merged dataset. The offers have been standardized to a common format
-    in respectively files
+    (the typed offers schema) in respectively files, so categories are unified before concatenating
 
     Parameters:
     - offers_jjit (pd.DataFrame): A DataFrame containing job offers from JustJoin.It.
@@ -67,14 +65,18 @@ def merge_offers(offers_jjit: pd.DataFrame, offers_pracuj: pd.DataFrame, duplica
     - pd.DataFrame: A DataFrame containing the merged and deduplicated job offers, with an
                    added timestamp for each offer.
     """
-    new_offers = pd.concat([offers_jjit, offers_pracuj])
-    new_offers = new_offers.drop_duplicates(subset=duplicates)
+    new_offers = concat_offers([offers_jjit, offers_pracuj])
+    if 'fingerprint' not in new_offers.columns or duplicates != duplicates_columns:
+        new_offers['fingerprint'] = offer_fingerprints(new_offers, duplicates)
+    duplicated = new_offers['fingerprint'].duplicated()
+    metrics.inc('duplicates_merged', int(duplicated.sum()))
+    new_offers = new_offers[~duplicated]
 
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M")
 
     new_offers['added_at'] = current_time
 
-    return new_offers
+    return apply_offers_schema(new_offers)
 
 
 def split_categories(list_to_check: list, master_list: list):
@@ -124,17 +126,6 @@ def criteria_verification(categories_list: list = []):
     return categories
 
 
-def show_duration(end_time, start_time):
-    """
-    This function displays duration in seconds or minutes regradless which is more appropriate
-    """
-    duration = end_time - start_time
-    if duration > 60:
-        return str(round(duration/60, 1)) + ' minutes'
-    else:
-        return str(round(duration, 2)) + ' seconds'
-
-
 def get_new_data(categories_list: list, duplicates=duplicates_columns):
     """
     Compiles the entire process of data acquisition, processing, and storage.
@@ -142,44 +133,79 @@ def get_new_data(categories_list: list, duplicates=duplicates_columns):
     This function takes a list of categories and oversees the scraping of job offers from
     JustJoin.It and Pracuj.pl, based on verified categories. It merges the offers from both sources,
     removes duplicates, and saves the updated offers to the database. Additionally, the function
-    creates a technologies dictionary and gathers geographic data for the offers. Execution times
-    for each step are printed.
+    creates a technologies dictionary, gathers geographic data for the offers and exports changed
+    offers to the Parquet dataset used for analytics. Execution times for each step are printed.
+    If SKIP_KNOWN_LINKS is set, offers whose links are already stored in the database are skipped
+    by the scrapers. If INCREMENTAL_CRAWL is set, listings are sorted from the newest offers and the scrapers
+    stop paging or scrolling after INCREMENTAL_STOP_AFTER offers in a row which are already in the database.
+    Every step is measured as a stage of the run (and profiled if METRICS_PROFILER is set) and the
+    metrics of the run are written at the end (see 'write_metrics').
+    If CRAWL_JOURNAL_PATH is set, every scraped page is recorded in the crawl journal as soon as it is
+    scraped. A run which didn't finish (e.g. it crashed) is resumed by the next run with the same categories,
+    which scrapes only the pages missing in the journal. The journal is cleared when the whole run succeeds.
 
     Parameters:
     - categories_list (list): A list of categories based on which the job offers are scraped.
-    - duplicates (list, optional): Columns to consider when removing duplicates from the offers.
-                                   Defaults to `duplicates_columns`.
+    - duplicates (list, optional): Columns to consider when removing duplicates from the offers. Their
+                                   fingerprints are also the key of the offers in the database, so offers
+                                   stored with other columns are not matched. Defaults to `duplicates_columns`.
     """
     verified_categories = criteria_verification(categories_list)
+    metrics.reset()
 
-    print("--SCRAPING JUSTJOIN.IT--")
-    start_time = time.time()
-    offers_jjit = search_jjit(verified_categories)
-    time1 = time.time()
-    print(f"Scraped {offers_jjit.shape[0]} offers in {show_duration(time1,start_time)}\n")
-
-    print("--SCRAPING PRACUJ.PL--")
-    offers_pracuj = search_pracuj(verified_categories)
-    time2 = time.time()
-    print(f"Scraped {offers_pracuj.shape[0]} offers in {show_duration(time2, time1)}\n")
+    create_db_if_not_exists()
+    known_links = SeenLinks.from_db() if SKIP_KNOWN_LINKS or INCREMENTAL_CRAWL else None
+    journal = CrawlJournal() if CRAWL_JOURNAL_PATH else None
+    if journal:
+        journal.start(verified_categories)
+
+    with DriverPool(size=JJIT_WORKERS) as pool:
+        print("--SCRAPING JUSTJOIN.IT--")
+        start_time = time.time()
+        with stage('scrape_jjit'):
+            offers_jjit = search_jjit(verified_categories, pool, known_links, journal)
+        time1 = time.time()
+        print(f"Scraped {offers_jjit.shape[0]} offers in {show_duration(time1,start_time)}")
+        report_memory("justjoin.it offers", offers_jjit)
+        print()
+
+        print("--SCRAPING PRACUJ.PL--")
+        with stage('scrape_pracuj'):
+            offers_pracuj = search_pracuj(verified_categories, pool, known=known_links, journal=journal)
+        time2 = time.time()
+        print(f"Scraped {offers_pracuj.shape[0]} offers in {show_duration(time2, time1)}")
+        report_memory("pracuj.pl offers", offers_pracuj)
+        print()
 
     print("--SAVING TO DATABSE--")
-    create_db_if_not_exists()
-    new_offers = merge_offers(offers_jjit, offers_pracuj)
-    new_offers_number = save_and_backup(new_offers, duplicates)
+    with stage('save'):
+        new_offers = merge_offers(offers_jjit, offers_pracuj, duplicates)
+        report_memory("merged offers", new_offers)
+        inserted, updated = save_and_backup(new_offers)
     time3 = time.time()
-    print(f"Added {new_offers_number} new offers in {show_duration(time3, time2)}\n")
+    print(f"Added {inserted} new offers and updated {updated} offers in {show_duration(time3, time2)}\n")
 
     print("--CREATING TECHNOLOGIES DICTIONARY--")
-    create_tech_dict()
+    with stage('tech_dict'):
+        create_tech_dict()
     time4 = time.time()
     print(f"Technologies dictionary created in {show_duration(time4, time3)}\n")
 
     print("--GATHERING GEOGRAPHIC DATA--")
-    get_geodata()
-    geodata_todb()
+    with stage('geodata'):
+        get_geodata()
+        geodata_todb()
     time5 = time.time()
     print(f"Geographic data added to database in {show_duration(time5, time4)}\n")
 
-    print(f"--WHOLE PROCESS FINISHED SUCESSFULLY IN {show_duration(time5, start_time)}--")
+    print("--EXPORTING TO PARQUET--")
+    with stage('export'):
+        metrics.inc('offers_exported', sync_parquet())
+    time6 = time.time()
+    print(f"Offers exported in {show_duration(time6, time5)}\n")
+
+    if journal:
+        journal.finish()
+    write_metrics()
+    print(f"--WHOLE PROCESS FINISHED SUCESSFULLY IN {show_duration(time6, start_time)}--")
 
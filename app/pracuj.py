@@ -1,115 +1,278 @@
-from bs4 import BeautifulSoup
 from bs4.element import Tag
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import re
+import requests
+import yaml
 
-from commons import get_driver
+from commons import get_driver, get_session, fetch_page, fetch_pages, DriverPool, SeenLinks, PageParser
+from metrics import metrics
+from checkpoint import CrawlJournal
+from cleaning import normalize_salaries, apply_offers_schema, offer_fingerprints
+from cleaning import SALARY_AMOUNT_PRACUJ, SALARY_HOURLY_PRACUJ
 
+config_path = '../config.yaml'
+with open(config_path, 'r') as file:
+    config = yaml.safe_load(file)
 
-def extract_features_pracuj(offer: Tag, links: list):
+PRACUJ_BACKEND = config['PRACUJ_BACKEND']
+HTTP_POOL_SIZE = config['HTTP_POOL_SIZE']
+INCREMENTAL_CRAWL = config['INCREMENTAL_CRAWL']
+INCREMENTAL_STOP_AFTER = config['INCREMENTAL_STOP_AFTER']
+
+parser_pracuj = PageParser('pracuj.pl')
+
+
+def extract_features_pracuj(offer: Tag, links: SeenLinks):
     """
     This function processes a BeautifulSoup Tag representing a job offer and extracts
-    various details. It also keeps track of processed links to avoid duplicates.
+    various details with the precompiled selectors of the site (see 'PageParser').
+    It also keeps track of processed links to avoid duplicates.
 
     Parameters:
     - offer (Tag): A BeautifulSoup Tag object representing the job offer.
-    - links (list): A list of links that have already been processed.
+    - links (SeenLinks): Links that have already been processed.
 
     Returns:
-    - tuple: A tuple containing the extracted offer details as a list and the updated list of links.
-              Returns (None, links) if the offer's link is already in the links list.
+    - tuple: A tuple containing the extracted offer details as a list and the updated set of links.
+              Returns (None, links) if the offer's link is already in the links set.
     """
-    whole_offer = offer.find('div', class_="c1fljezf")
-    offer_details = whole_offer.find('div', class_="c1wygkax")
-    keywords = whole_offer.find_all('div', class_='b1fdzgc4')
+    whole_offer = parser_pracuj.select_one('offer', offer)
+    offer_details = parser_pracuj.select_one('details', whole_offer)
+    keywords = parser_pracuj.select('keywords', whole_offer)
 
-    link = offer_details.a['href']
+    link = parser_pracuj.select_one('link', offer_details)['href']
+    links.track(link)
 
     if link in links:
+        metrics.inc('duplicates_skipped')
         return None, links
 
-    links.append(link)
+    links.add(link)
 
-    experience = offer_details.find('li').text
-    name = offer_details.h2.text
-    company = offer_details.h4.text
-    location = offer_details.h5.text
-    work_mode = offer_details.find_all('li')[-1].text
-    try:
-        salary = offer_details.find('span', class_="s1jki39v").text.replace(u'\xa0', u'')
-    except (IndexError, AttributeError):
-        salary = 'Undisclosed Salary'
-    techs = [keyword.text for keyword in keywords[0].find_all('span')] if keywords else []
+    experience = parser_pracuj.select_one('experience', offer_details).text
+    name = parser_pracuj.select_one('name', offer_details).text
+    company = parser_pracuj.select_one('company', offer_details).text
+    location = parser_pracuj.select_one('location', offer_details).text
+    work_mode = parser_pracuj.select('work_mode', offer_details)[-1].text
+    salary = parser_pracuj.text('salary', offer_details, default='Undisclosed Salary').replace(u'\xa0', u'')
+    techs = [keyword.text for keyword in parser_pracuj.select('keyword', keywords[0])] if keywords else []
 
     new_offer = [experience, name, company, location, work_mode, salary, techs, link]
 
     return new_offer, links
 
 
-def parse_data_pracuj(driver, url_page: str, offers: list, links: list):
+def parse_page_pracuj(page_source: str, offers: list, links: SeenLinks):
+    """
+    This function parses the offer cards of a listing page (see 'PageParser'). It iterates over each job offer
+    on the page, extracts relevant details using the 'extract_features_pracuj' function, and accumulates them
+    in a list. It is shared by both fetch backends (Selenium and HTTP), so they produce exactly the same rows.
+
+    Parameters:
+    - page_source (str): The HTML of the listing page.
+    - offers (list): A list used to accumulate extracted job offers.
+    - links (SeenLinks): Links that have already been processed to avoid duplicate processing.
+
+    Returns:
+    - tuple: A tuple containing the list of accumulated job offers and the updated set of processed links.
+    """
+    with metrics.timer('parse'):
+        for offer in parser_pracuj.parse(page_source):
+
+            new_offer, links = extract_features_pracuj(offer, links)
+            if new_offer:
+                offers.append(new_offer)
+
+    return offers, links
+
+
+def parse_data_pracuj(driver, url_page: str, offers: list, links: SeenLinks):
     """
     This function navigates to a specified URL using a Selenium WebDriver and parses the page's content
-    using BeautifulSoup. It iterates over each job offer on the page, extracts relevant details using the
-    'extract_features_pracuj' function, and accumulates them in a list.
+    with 'parse_page_pracuj'.
 
     Parameters:
     - driver: The Selenium WebDriver used for web navigation and content extraction.
     - url_page (str): The URL of the webpage to scrape job offers from.
     - offers (list): A list used to accumulate extracted job offers.
-    - links (list): A list of links that have already been processed to avoid duplicate processing.
+    - links (SeenLinks): Links that have already been processed to avoid duplicate processing.
 
     Returns:
-    - tuple: A tuple containing the list of accumulated job offers and the updated list of processed links.
+    - tuple: A tuple containing the list of accumulated job offers and the updated set of processed links.
     """
     driver.get(url_page)
+    page_source = driver.page_source
+    metrics.inc('pages_fetched')
+    metrics.inc('bytes_downloaded', len(page_source.encode()))
 
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
+    return parse_page_pracuj(page_source, offers, links)
 
-    for offer in soup.find_all('div', class_="be8lukl core_po9665q"):
 
-        new_offer, links = extract_features_pracuj(offer, links)
-        if new_offer:
-            offers.append(new_offer)
+def restore_page_pracuj(page_offers: list, offers: list, links: SeenLinks):
+    """
+    This function adds offers of a page read from the crawl journal to the accumulated offers, as if the page
+    was parsed again: their links are marked as processed, so the following pages skip them as duplicates.
+    """
+    for offer in page_offers:
+        links.add(offer[-1])
+        offers.append(offer)
+    metrics.inc('units_resumed')
 
     return offers, links
 
 
-def scrape_pracuj(url: str):
+def count_pages_pracuj(page_source: str):
+    """
+    This function reads the total number of listing pages from the pagination of the first page.
+    If the pagination is not present, the listing has only one page.
     """
-    This function initializes a Selenium WebDriver to navigate the provided URL.
-    It determies the total number of pages and iterating through each one.
-    For each page, it extracts job offers' details using the 'parse_data_pracuj' function.
-    It accumulates all the offers and their respective links to avoid duplicates.
+    try:
+        no_pages = int(parser_pracuj.parse(page_source, 'pagination')[0].find_all('span')[1].text)
+    except (IndexError, AttributeError):
+        no_pages = 1
+
+    return no_pages
+
+
+def skip_pages_pracuj(url: str, page: int, no_pages: int):
+    """
+    This function reports the pages of the URL skipped by the incremental crawl (from the given page to the last one)
+    in the 'pages_skipped' metric.
+    """
+    metrics.inc('pages_skipped', no_pages - page + 1)
+    print(f"Incremental crawl of {url}: stopped after {page - 1} of {no_pages} pages")
+
+
+def scrape_pracuj(url: str, driver=None, known: SeenLinks = None, journal: CrawlJournal = None,
+                  stop_after: int = None):
+    """
+    This function uses a Selenium WebDriver to navigate the provided URL (if no driver is given,
+    a new one is initialized and quit after scraping). It determies the total number of pages
+    and iterating through each one. For each page, it extracts job offers' details using the
+    'parse_data_pracuj' function. It accumulates all the offers and their respective links to
+    avoid duplicates. If a crawl journal is given, every parsed page is recorded in it and pages completed
+    by a resumed run are read from it instead of being scraped. If stop_after is given (incremental crawl
+    of offers sorted from the newest), paging stops after stop_after known offers in a row.
 
     Note: The function contains commented code for closing pop-ups which can be enabled if necessary.
 
     Parameters:
     - url (str): The base URL of the job listings on the Pracuj.pl website.
+    - driver (optional): The Selenium WebDriver to reuse.
+    - known (SeenLinks, optional): Links of offers to skip, e.g. offers already stored in the database.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl.
+    - stop_after (int, optional): Number of known offers in a row after which paging stops.
 
     Returns:
-    - tuple: A tuple containing a list of job offers and a list of processed links.
+    - tuple: A tuple containing a list of job offers and a set of processed links.
     """
-    driver = get_driver()
-    driver.get(url)
+    completed = journal.get('pracuj.pl', url) if journal else {}
 
-    # close_popup(driver, "div.popup_p1c6glb0")
-    # close_popup(driver, "button[data-test='button-submitCookie']")
+    own_driver = driver is None
+    if own_driver:
+        driver = get_driver()
 
-    soup = BeautifulSoup(driver.page_source, 'html.parser')
+    if 1 in completed:
+        no_pages = completed[1][1]
+    else:
+        driver.get(url)
+        metrics.inc('pages_fetched')
 
-    try:
-        no_pages = int(soup.find_all('div', class_="listing_w13k878q")[0].p.find_all('span')[1].text)
-    except (IndexError, AttributeError):
-        no_pages = 1
+        # close_popup(driver, "div.popup_p1c6glb0")
+        # close_popup(driver, "button[data-test='button-submitCookie']")
+
+        no_pages = count_pages_pracuj(driver.page_source)
 
     offers = []
-    links = []
+    links = SeenLinks(known=known, stop_after=stop_after)
 
     for page in range(1, no_pages + 1):
+        if links.exhausted:
+            skip_pages_pracuj(url, page, no_pages)
+            break
+
+        if page in completed:
+            offers, links = restore_page_pracuj(completed[page][0], offers, links)
+            continue
+
         url_page = url + '&pn=' + str(page)
+        offers_number = len(offers)
         offers, links = parse_data_pracuj(driver, url_page, offers, links)
+        if journal:
+            journal.record('pracuj.pl', url, page, offers[offers_number:], no_pages)
 
-    driver.quit()
+    if own_driver:
+        driver.quit()
+
+    return offers, links
+
+
+def scrape_pracuj_http(url: str, session: requests.Session, known: SeenLinks = None, journal: CrawlJournal = None,
+                       stop_after: int = None):
+    """
+    This function is the HTTP fast path of 'scrape_pracuj'. Listing pages of pracuj.pl are server-rendered,
+    so instead of driving a browser they are downloaded with a pooled HTTP session (keep-alive, gzip) and
+    parsed with the same 'parse_page_pracuj' function. If any page can't be downloaded, or the first page
+    doesn't contain any offer (e.g. the site served a bot check instead of the listing), None is returned
+    so the caller can fall back to Selenium. After the first page, the remaining pages are downloaded
+    concurrently and parsed in page order. If a crawl journal is given, every parsed page is recorded in it
+    and pages completed by a resumed run are read from it instead of being downloaded. In the incremental crawl
+    (stop_after is given) the pages are downloaded in batches of HTTP_POOL_SIZE, so paging stops after stop_after
+    known offers in a row without downloading the rest of the listing.
+
+    Parameters:
+    - url (str): The base URL of the job listings on the Pracuj.pl website.
+    - session (requests.Session): The HTTP session used to download pages.
+    - known (SeenLinks, optional): Links of offers to skip, e.g. offers already stored in the database.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl.
+    - stop_after (int, optional): Number of known offers in a row after which paging stops.
+
+    Returns:
+    - tuple or None: A tuple containing a list of job offers and a set of processed links, or None
+                     if the pages couldn't be fetched over HTTP.
+    """
+    completed = journal.get('pracuj.pl', url) if journal else {}
+
+    if 1 in completed:
+        no_pages = completed[1][1]
+        offers, links = restore_page_pracuj(completed[1][0], [], SeenLinks(known=known, stop_after=stop_after))
+    else:
+        first_page = fetch_page(session, url + '&pn=1')
+        if first_page is None:
+            return None
+
+        no_pages = count_pages_pracuj(first_page)
+
+        offers, links = parse_page_pracuj(first_page, [], SeenLinks(known=known, stop_after=stop_after))
+        if not offers and no_pages == 1 and not parser_pracuj.parse(first_page, 'offer'):
+            return None
+        if journal:
+            journal.record('pracuj.pl', url, 1, offers, no_pages)
+
+    pending = [page for page in range(2, no_pages + 1) if page not in completed]
+    batch_size = HTTP_POOL_SIZE if stop_after is not None else len(pending)
+    pages = {}
+
+    for page in range(2, no_pages + 1):
+        if links.exhausted:
+            skip_pages_pracuj(url, page, no_pages)
+            break
+
+        if page in completed:
+            offers, links = restore_page_pracuj(completed[page][0], offers, links)
+            continue
+
+        if page not in pages:
+            batch = pending[pending.index(page):][:batch_size]
+            pages.update(zip(batch, fetch_pages(session, [url + '&pn=' + str(batch_page) for batch_page in batch])))
+
+        if pages[page] is None:
+            return None
+        offers_number = len(offers)
+        offers, links = parse_page_pracuj(pages[page], offers, links)
+        if journal:
+            journal.record('pracuj.pl', url, page, offers[offers_number:], no_pages)
 
     return offers, links
 
@@ -128,6 +291,9 @@ def clear_salary_pracuj(row: str):
     - pd.Series: A pandas Series containing three elements: the lower bound of the salary range,
                  the upper bound of the salary range, and the average of these two values. If the
                  salary is undisclosed, all three elements are None.
+
+    Row-wise reference implementation - 'clear_data_pracuj' uses the vectorized 'normalize_salaries',
+    which gives the same results. It is kept to verify and benchmark the vectorized version.
     """
     if 'Undisclosed Salary' in row:
         return pd.Series([None, None, None])
@@ -174,8 +340,10 @@ def clear_data_pracuj(offers_list: list):
     """
     This function takes a list of job offers, each as a list of attributes, and converts it into
     a structured pandas DataFrame. It standardizes the experience level using a predefined mapping,
-    cleans and splits salary information into structured format using 'clear_salary_pracuj',
-    extracts and standardizes the location and work mode. It also adds a source site identifier.
+    cleans and splits salary information into structured format using 'normalize_salaries',
+    extracts and standardizes the location and work mode. It also adds a source site identifier
+    and fingerprints of the offers (see 'offer_fingerprints').
+    Columns are typed according to the offers schema (see 'apply_offers_schema').
 
     Parameters:
     - offers_list (list): A list of job offers, where each offer is a list of attributes.
@@ -199,14 +367,15 @@ def clear_data_pracuj(offers_list: list):
     columns = ['experience', 'name', 'company', 'location', 'work_mode', 'salary', 'technologies', 'link']
     offers_df = pd.DataFrame(data=offers_list, columns=columns)
     offers_df['experience'] = offers_df['experience'].apply(lambda x: x.split(',')[0]).map(exp_dict)
-    offers_df[['salary_low', 'salary_high', 'salary_avg']] = offers_df['salary'].apply(clear_salary_pracuj)
+    offers_df = offers_df.join(normalize_salaries(offers_df['salary'], SALARY_AMOUNT_PRACUJ, SALARY_HOURLY_PRACUJ))
     offers_df['location'] = offers_df['location'].apply(clear_location_pracuj)
     offers_df['work_mode'] = offers_df['work_mode'].apply(clear_mode_pracuj)
     offers_df['site'] = "pracuj.pl"
+    offers_df['fingerprint'] = offer_fingerprints(offers_df)
     offers_df = offers_df[['site', 'experience', 'name', 'company', 'location', 'work_mode',
-                           'salary_avg', 'salary_low', 'salary_high', 'technologies', 'link']]
+                           'salary_avg', 'salary_low', 'salary_high', 'technologies', 'link', 'fingerprint']]
 
-    return offers_df
+    return apply_offers_schema(offers_df)
 
 
 def separate_and_map(list_to_edit):
@@ -273,25 +442,85 @@ def separate_and_map(list_to_edit):
     return tech_url, spec_url
 
 
-def search_pracuj(categories_list: list):
+def scrape_url_pracuj(url: str, pool: DriverPool, session: requests.Session = None, known: SeenLinks = None,
+                      journal: CrawlJournal = None, stop_after: int = None):
+    """
+    This function scrapes one search URL with the HTTP backend if a session is given, and falls back to
+    Selenium (with a driver from the pool) if there is no session or the HTTP fetch failed. Metrics recorded
+    while scraping are labeled with the site and the kind of the URL ('technologies' or 'specializations').
+
+    Parameters:
+    - url (str): The base URL of the job listings on the Pracuj.pl website.
+    - pool (DriverPool): Pool of WebDriver sessions.
+    - session (requests.Session, optional): The HTTP session used by the HTTP backend.
+    - known (SeenLinks, optional): Links of offers to skip.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl.
+    - stop_after (int, optional): Number of known offers in a row after which paging stops (incremental crawl).
+
+    Returns:
+    - tuple: A tuple containing a list of job offers and a set of processed links.
+    """
+    category = 'technologies' if 'itth=' in url else 'specializations'
+
+    with metrics.labels(site='pracuj.pl', category=category):
+        scraped = scrape_pracuj_http(url, session, known, journal, stop_after) if session else None
+
+        if scraped is None:
+            if session:
+                print(f"HTTP fetch failed for {url} - falling back to Selenium")
+                metrics.inc('selenium_fallbacks')
+            with pool.driver() as driver:
+                scraped = scrape_pracuj(url, driver, known, journal, stop_after)
+
+        metrics.inc('offers_extracted', len(scraped[0]))
+
+    return scraped
+
+
+def search_pracuj(categories_list: list, pool: DriverPool = None, backend: str = PRACUJ_BACKEND,
+                  known: SeenLinks = None, journal: CrawlJournal = None, incremental: bool = INCREMENTAL_CRAWL):
     """
     This function compiles the whole process from preparing URLS, through scraping, cleaning data
-    and returning structured DataFrame of offers from pracuj.pl
+    and returning structured DataFrame of offers from pracuj.pl. With the 'http' backend pages are
+    downloaded without a browser ('scrape_pracuj_http'), and Selenium is used only as a fallback.
+    Selenium scraping uses drivers handed out by the pool of WebDriver sessions (a single-driver pool
+    is created if none is given). Technology and specialization URLs are scraped concurrently and
+    their offers are merged in the order of URLs.
 
     Parameters:
     - categories_list (list): A list of category keywords to search for.
+    - pool (DriverPool, optional): Pool of WebDriver sessions to use.
+    - backend (str, optional): 'http' or 'selenium'. Defaults to PRACUJ_BACKEND from config.
+    - known (SeenLinks, optional): Links of offers to skip, e.g. offers already stored in the database.
+    - journal (CrawlJournal, optional): Checkpoint of the crawl, used to resume an interrupted run.
+    - incremental (bool, optional): Whether to list offers from the newest and stop paging each URL after
+                                    INCREMENTAL_STOP_AFTER known offers in a row (requires known links).
+                                    Defaults to INCREMENTAL_CRAWL from config.
 
     Returns:
     - DataFrame: A pandas DataFrame containing structured data of the aggregated job offers from Pracuj.pl.
     """
+    incremental = incremental and known is not None
+    stop_after = INCREMENTAL_STOP_AFTER if incremental else None
+    # in the incremental mode the newest offers are listed first
+    sorting = '&sc=0' if incremental else ''
+
     base_url = 'https://it.pracuj.pl/praca?'
-    urls = [base_url + url for url in separate_and_map(categories_list) if url is not None]
+    urls = [base_url + url + sorting for url in separate_and_map(categories_list) if url is not None]
+
+    if pool is None:
+        with DriverPool() as own_pool:
+            return search_pracuj(categories_list, own_pool, backend, known, journal, incremental)
+
+    session = get_session() if backend == 'http' else None
 
     new_offers = []
 
-    for url in urls:
-        offers, _ = scrape_pracuj(url)
-        new_offers += offers
+    if urls:
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            for offers, _ in executor.map(
+                    lambda url: scrape_url_pracuj(url, pool, session, known, journal, stop_after), urls):
+                new_offers += offers
 
     offers_df = clear_data_pracuj(new_offers)
 
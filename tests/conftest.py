@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app')
+
+# modules of the app import each other by name and read '../config.yaml', as when they are run from the app directory
+os.chdir(APP_DIR)
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """
+    Points the database of the app to an empty file in a temporary directory, so tests never touch the real one.
+    """
+    import database
+
+    path = str(tmp_path / 'offers.sqlite')
+    monkeypatch.setattr(database, 'DB_PATH', path)
+
+    return path
+
+
+@pytest.fixture
+def make_offers():
+    """
+    Returns a function building typed offers of justjoin.it with the given names (also used in their links).
+    """
+    from cleaning import apply_offers_schema, offer_fingerprints
+
+    def make_offers(names: list, technologies: list, location: str = 'Warszawa'):
+        offers = pd.DataFrame({
+            'site': 'justjoin.it',
+            'experience': 'mid',
+            'name': names,
+            'company': 'company',
+            'location': location,
+            'work_mode': 'Fully remote',
+            'salary_avg': 15000.0,
+            'salary_low': 10000.0,
+            'salary_high': 20000.0,
+            'technologies': technologies,
+            'link': [f'https://justjoin.it/offers/{name}' for name in names],
+            'added_at': '2025-01-01 10:00',
+        })
+        offers['fingerprint'] = offer_fingerprints(offers)
+
+        return apply_offers_schema(offers)
+
+    return make_offers
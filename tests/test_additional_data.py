@@ -0,0 +1,196 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+import additional_data
+import database
+from commons import RateLimiter
+from metrics import metrics
+
+# answers of the mocked Nominatim; cities missing here are unknown to it
+NOMINATIM_ANSWERS = {
+    'Kraków': {'lat': '50.06', 'lon': '19.94',
+               'display_name': 'Kraków, powiat Kraków, województwo małopolskie, Polska'},
+    'Katowice': {'lat': '50.26', 'lon': '19.02',
+                 'display_name': 'Katowice, Górnośląsko-Zagłębiowska Metropolia, województwo śląskie, Polska'},
+    'Gdańsk': {'lat': '54.35', 'lon': '18.65', 'display_name': 'Gdańsk, województwo pomorskie, Polska'},
+    'Poznań': {'lat': '52.41', 'lon': '16.93', 'display_name': 'Poznań, województwo wielkopolskie, Polska'},
+    'Łódź': {'lat': '51.76', 'lon': '19.46', 'display_name': 'Łódź, województwo łódzkie, Polska'},
+}
+
+
+class FakeResponse:
+
+    def __init__(self, geodata: list, status_code: int = 200, headers: dict = None):
+        self.geodata = geodata
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+    def json(self):
+        return self.geodata
+
+
+class FakeNominatim:
+    """
+    Stand-in for the Nominatim session recording the looked up cities, their times and the sent headers.
+    Statuses queued in 'failures' under a city are answered to its first lookups.
+    """
+
+    def __init__(self):
+        self.cities = []
+        self.times = []
+        self.headers = None
+        self.retries = None
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        with self.lock:
+            self.cities.append(params['city'])
+            self.times.append(time.monotonic())
+            failures = self.failures.get(params['city'])
+            if failures:
+                return FakeResponse([], status_code=failures.pop(0))
+        answer = NOMINATIM_ANSWERS.get(params['city'])
+
+        return FakeResponse([answer] if answer else [])
+
+
+@pytest.fixture
+def nominatim(db_path, tmp_path, monkeypatch):
+    database.create_db_if_not_exists()
+    monkeypatch.setattr(additional_data, 'GEO_DICT_PATH', str(tmp_path / 'geo_dict'))
+    monkeypatch.setattr(additional_data, 'nominatim_limiter', RateLimiter(0, name='nominatim'))
+    metrics.reset()
+
+    fake = FakeNominatim()
+
+    def get_session(pool_size, headers=None, retries=3):
+        fake.headers = headers
+        fake.retries = retries
+        return fake
+
+    monkeypatch.setattr(additional_data, 'get_session', get_session)
+
+    return fake
+
+
+def save_offers(make_offers, locations: list):
+    database.save_to_db(make_offers([f'offer {i}' for i in range(len(locations))], [[]] * len(locations),
+                                    location=locations))
+
+
+def cache(cities: dict, updated_at: datetime):
+    database.save_geocodes({
+        database.normalize_city(city): {'city': city, 'found': int(geo is not None), 'lat': geo and geo[0],
+                                        'lon': geo and geo[1], 'voivodeship': geo and geo[2]}
+        for city, geo in cities.items()
+    }, updated_at.strftime("%Y-%m-%d %H:%M"))
+
+
+def test_cached_cities_are_not_looked_up(nominatim, make_offers):
+    save_offers(make_offers, ['Kraków', ' kraków', 'Atlantyda'])
+    cache({'Kraków': (50.06, 19.94, 'małopolskie'), 'Atlantyda': None}, datetime.now())
+
+    additional_data.get_geodata()
+
+    assert nominatim.cities == []
+    assert metrics.total('geocode_cache_hits') == 3
+    assert metrics.total('geocode_cache_misses') == 0
+
+
+def test_new_cities_are_looked_up_once(nominatim, make_offers):
+    save_offers(make_offers, ['Kraków', 'kraków ', 'Gdańsk', 'Atlantyda'])
+
+    additional_data.get_geodata()
+    additional_data.get_geodata()
+
+    assert sorted(nominatim.cities) == ['Atlantyda', 'Gdańsk', 'Kraków']
+    assert 'Mozilla' not in nominatim.headers['User-Agent']
+    assert nominatim.headers['User-Agent'].startswith(additional_data.NOMINATIM_APP_NAME)
+
+    geocodes = database.load_geocodes(include_misses=True)
+    assert geocodes['kraków']['voivodeship'] == 'małopolskie'
+    assert geocodes['atlantyda']['found'] == 0
+
+
+def test_expired_misses_are_looked_up_again(nominatim, make_offers):
+    save_offers(make_offers, ['Atlantyda', 'Łódź'])
+    expired = datetime.now() - timedelta(days=additional_data.GEO_MISS_TTL_DAYS + 1)
+    recent = datetime.now() - timedelta(days=additional_data.GEO_MISS_TTL_DAYS - 1)
+    cache({'Atlantyda': None}, recent)
+    cache({'Łódź': None}, expired)
+
+    additional_data.get_geodata()
+
+    # the expired miss was found this time, the recent one is still cached
+    assert nominatim.cities == ['Łódź']
+    assert database.load_geocodes()['łódź']['voivodeship'] == 'łódzkie'
+
+
+def test_lookups_are_rate_limited(nominatim, make_offers, monkeypatch):
+    rate = 20
+    monkeypatch.setattr(additional_data, 'nominatim_limiter', RateLimiter(rate, name='nominatim'))
+    save_offers(make_offers, ['Kraków', 'Katowice', 'Gdańsk', 'Poznań', 'Łódź'])
+
+    additional_data.get_geodata()
+
+    assert len(nominatim.times) == 5
+    # requests of all workers together are spaced out by the shared limiter (with a margin for thread scheduling)
+    times = sorted(nominatim.times)
+    assert times[-1] - times[0] >= 4 / rate * 0.9
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.5 / rate
+    assert metrics.total('sleep_seconds') > 0
+
+
+def test_failed_lookups_are_retried_through_the_limiter(nominatim, make_offers, monkeypatch):
+    rate = 20
+    monkeypatch.setattr(additional_data, 'nominatim_limiter', RateLimiter(rate, name='nominatim'))
+    monkeypatch.setattr(additional_data, 'get_retry_delay', lambda response, attempt: 0)
+    nominatim.failures = {'Kraków': [503, 429], 'Gdańsk': [404]}
+    save_offers(make_offers, ['Kraków', 'Gdańsk'])
+
+    additional_data.get_geodata()
+
+    # the session doesn't retry on its own, so every attempt waits for the limiter
+    assert nominatim.retries == 0
+    assert sorted(nominatim.cities) == ['Gdańsk', 'Kraków', 'Kraków', 'Kraków']
+    times = sorted(nominatim.times)
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.5 / rate
+    assert metrics.total('geocode_lookups_retried') == 2
+    # 404 is not retried and the city is not cached
+    assert metrics.total('geocode_lookups_failed') == 1
+    assert set(database.load_geocodes(include_misses=True)) == {'kraków'}
+
+
+def test_retry_delay():
+    assert additional_data.get_retry_delay(None, 0, backoff=1) == 1
+    assert additional_data.get_retry_delay(FakeResponse([], 503), 2, backoff=1) == 4
+    assert additional_data.get_retry_delay(FakeResponse([], 429, {'Retry-After': '30'}), 0, backoff=1) == 30
+    assert additional_data.get_retry_delay(FakeResponse([], 429, {'Retry-After': 'soon'}), 1, backoff=1) == 2
+
+
+def test_geodata_todb(nominatim, make_offers):
+    save_offers(make_offers, ['Kraków', ' kraków', 'KRAKÓW ', 'Katowice', 'Atlantyda', 'Szczecin'])
+    cache({'Kraków': (50.06, 19.94, 'małopolskie'), 'Katowice': (50.26, 19.02, 'śląskie'), 'Atlantyda': None},
+          datetime.now())
+
+    additional_data.geodata_todb()
+
+    offers = database.query_offers(['name', 'voivodeship', 'lat', 'lon'], order_by='id')
+    voivodeships = offers['voivodeship'].astype(object).where(offers['voivodeship'].notna(), None).tolist()
+    assert voivodeships == ['małopolskie'] * 3 + ['śląskie', 'Not specified', None]
+    assert offers['lat'].tolist()[:4] == [50.06, 50.06, 50.06, 50.26]
+    assert offers['lon'].isna().tolist() == [False] * 4 + [True, True]
+    assert metrics.total('geodata_updated') == 5
+
+    # filled offers are not read again, the one of the uncached city stays missing
+    additional_data.geodata_todb()
+    assert metrics.total('geodata_updated') == 5
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from checkpoint import CrawlJournal
+from database import get_connection, TIMESTAMP_FORMAT
+
+URL = 'https://it.pracuj.pl/praca?itth=37'
+OFFERS = [['mid', 'Python Developer', 'Acme', 'Warszawa', 'Praca zdalna', 'Undisclosed Salary', ['Python'],
+           'https://www.pracuj.pl/praca/1']]
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'crawl_journal.sqlite')
+
+
+def interrupted_run(path: str, categories: list, hours_ago: float = 0):
+    """
+    Records the first page of URL in a run which is never finished, started the given number of hours ago.
+    """
+    journal = CrawlJournal(path)
+    journal.start(categories)
+    journal.record('pracuj.pl', URL, 1, OFFERS, 3)
+
+    started_at = (datetime.now() - timedelta(hours=hours_ago)).strftime(TIMESTAMP_FORMAT)
+    with get_connection(path) as connection:
+        connection.execute("UPDATE crawl_runs SET started_at = ? WHERE id = ?", (started_at, journal.run_id))
+    connection.close()
+
+
+def test_interrupted_run_is_resumed(journal_path):
+    interrupted_run(journal_path, ['python', 'java'], hours_ago=1)
+
+    journal = CrawlJournal(journal_path, max_age=12)
+
+    assert journal.start(['java', 'python']) == 1
+    assert journal.get('pracuj.pl', URL) == {1: (OFFERS, 3)}
+
+
+def test_stale_run_is_discarded(journal_path):
+    interrupted_run(journal_path, ['python'], hours_ago=13)
+
+    journal = CrawlJournal(journal_path, max_age=12)
+
+    assert journal.start(['python']) == 0
+    assert journal.get('pracuj.pl', URL) == {}
+    with get_connection(journal_path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM crawl_runs").fetchone()[0] == 1
+        assert connection.execute("SELECT COUNT(*) FROM crawl_units").fetchone()[0] == 0
+    connection.close()
+
+
+def test_run_of_other_categories_is_discarded(journal_path):
+    interrupted_run(journal_path, ['python'])
+
+    journal = CrawlJournal(journal_path)
+
+    assert journal.start(['java']) == 0
+    assert journal.get('pracuj.pl', URL) == {}
+
+
+def test_finished_run_is_not_resumed(journal_path):
+    journal = CrawlJournal(journal_path)
+    journal.start(['python'])
+    journal.record('pracuj.pl', URL, 1, OFFERS, 3)
+    journal.finish()
+
+    journal = CrawlJournal(journal_path)
+
+    assert journal.start(['python']) == 0
+    assert journal.get('pracuj.pl', URL) == {}
@@ -0,0 +1,91 @@
+import pandas as pd
+
+from cleaning import apply_offers_schema, concat_offers, offer_fingerprints
+import jjit
+from jjit import clear_new_offers_jjit
+from pracuj import clear_data_pracuj
+from new_data import merge_offers
+
+# BLAKE2b of 'justjoin.it\x1fmid\x1fpython developer\x1facme' as a signed little-endian 64-bit integer
+FINGERPRINT = -1407951694117448400
+
+
+def typed_offers(experience: list, site: str = 'justjoin.it'):
+    return apply_offers_schema(pd.DataFrame({
+        'site': site,
+        'experience': experience,
+        'name': [f'offer {i}' for i in range(len(experience))],
+        'company': 'company',
+        'link': [f'{site}/{i}' for i in range(len(experience))],
+    }))
+
+
+def test_concat_offers_skips_empty_frames():
+    untyped = pd.DataFrame(columns=['site', 'experience', 'name', 'company', 'link'])
+
+    offers = concat_offers([untyped, typed_offers(['junior']), typed_offers(['mid', 'junior'], 'pracuj.pl')])
+
+    assert len(offers) == 3
+    assert isinstance(offers['experience'].dtype, pd.CategoricalDtype)
+    assert list(offers['experience'].cat.categories) == ['junior', 'mid']
+    assert list(offers['site'].astype(str)) == ['justjoin.it', 'pracuj.pl', 'pracuj.pl']
+
+
+def test_concat_offers_of_empty_frames_is_typed():
+    offers = concat_offers([clear_new_offers_jjit([], 'junior'), clear_data_pracuj([])])
+
+    assert offers.empty
+    assert 'technologies' in offers.columns
+    assert isinstance(offers['location'].dtype, pd.CategoricalDtype)
+    assert offers['salary_avg'].dtype == 'float32'
+
+
+def test_merge_offers_without_offers():
+    offers_jjit = concat_offers([clear_new_offers_jjit([], 'junior')])
+    offers_jjit['site'] = 'justjoin.it'
+
+    offers = merge_offers(offers_jjit, clear_data_pracuj([]))
+
+    assert offers.empty
+    assert 'added_at' in offers.columns
+
+
+def test_merge_offers_with_one_empty_site():
+    offers_jjit = typed_offers(['junior', 'mid'])
+    offers_jjit['fingerprint'] = [1, 2]
+
+    offers = merge_offers(offers_jjit, clear_data_pracuj([]))
+
+    assert len(offers) == 2
+    assert list(offers['experience'].cat.categories) == ['junior', 'mid']
+
+
+def test_search_jjit_with_and_without_offers(monkeypatch):
+    offer = ['name', 'company', '10 000 - 20 000 PLN', 'Warszawa', 'Fully remote', ['Python']]
+    scraped = {'junior': [offer + [f'https://justjoin.it/offers/{i}'] for i in range(20)]}
+    monkeypatch.setattr(jjit, 'scrape_all_jjit', lambda urls, pool, **kwargs: {
+        url: scraped.get(url.rsplit('_', 1)[-1], []) for url in urls})
+
+    offers = jjit.search_jjit(['python'], pool=object())
+
+    assert len(offers) == 20
+    assert set(offers['experience']) == {'junior'}
+    assert isinstance(offers['experience'].dtype, pd.CategoricalDtype)
+
+    scraped.clear()
+    offers = jjit.search_jjit(['python'], pool=object())
+
+    assert offers.empty
+    assert list(offers.columns) == ['site', 'experience', 'name', 'company', 'location', 'work_mode', 'salary_avg',
+                                    'salary_low', 'salary_high', 'technologies', 'link', 'fingerprint']
+
+
+def test_fingerprints_are_stable():
+    offers = pd.DataFrame({'site': ['justjoin.it', ' JustJoin.it'], 'experience': ['mid', 'MID'],
+                           'name': ['Python  Developer', 'python developer '], 'company': ['Acme', 'acme']})
+
+    fingerprints = offer_fingerprints(offers)
+
+    # fingerprints are stored in the database, so they must not change with versions of the libraries
+    assert fingerprints.tolist() == [FINGERPRINT, FINGERPRINT]
+    assert offer_fingerprints(offers.iloc[:0]).dtype == 'int64'
@@ -0,0 +1,66 @@
+import commons
+from commons import DriverPool
+
+
+class FakeChrome:
+    """
+    Stand-in for the Chrome WebDriver recording DevTools commands.
+    """
+
+    def __init__(self, service=None, options=None):
+        self.options = options
+        self.commands = []
+        self.origin = 'https://it.pracuj.pl'
+        self.url = None
+
+    @property
+    def current_url(self):
+        return self.url
+
+    def set_window_size(self, width, height):
+        pass
+
+    def execute_cdp_cmd(self, command, params):
+        self.commands.append((command, params))
+
+    def execute_script(self, script):
+        return self.origin
+
+    def get(self, url):
+        self.url = url
+
+    def delete_all_cookies(self):
+        raise AssertionError("cookies of other domains would be kept")
+
+
+def test_css_is_blocked_through_devtools(monkeypatch):
+    monkeypatch.setattr(commons.webdriver, 'Chrome', FakeChrome)
+
+    driver = commons.get_driver(disable_images=True, disable_css=True)
+
+    assert ('Network.setBlockedURLs', {'urls': commons.STYLESHEET_PATTERNS}) in driver.commands
+    assert driver.commands[0] == ('Network.enable', {})
+    prefs = driver.options.experimental_options['prefs']
+    assert prefs == {'profile.managed_default_content_settings.images': 2}
+
+    assert commons.get_driver(disable_css=False).commands == []
+
+
+def test_released_driver_is_cleared(monkeypatch):
+    monkeypatch.setattr(commons.webdriver, 'Chrome', FakeChrome)
+    pool = DriverPool(size=1, disable_css=False)
+
+    with pool.driver() as driver:
+        driver.get('https://it.pracuj.pl/praca?pn=1')
+
+    assert driver.commands == [
+        ('Network.clearBrowserCookies', {}),
+        ('Storage.clearDataForOrigin', {'origin': 'https://it.pracuj.pl',
+                                        'storageTypes': commons.CLEARED_STORAGE_TYPES}),
+    ]
+    assert driver.url == 'about:blank'
+
+    # the same warm driver is handed out again
+    with pool.driver() as reused:
+        assert reused is driver
+
@@ -0,0 +1,146 @@
+import os
+import shutil
+
+import pytest
+
+import database
+from cleaning import offer_fingerprints
+from new_data import merge_offers
+
+
+@pytest.fixture
+def offers_db(db_path, monkeypatch):
+    database.create_db_if_not_exists()
+    # small chunks, so technologies of a few offers are loaded with several queries
+    monkeypatch.setattr(database, 'SQL_MAX_VARIABLES', 2)
+
+    return db_path
+
+
+def stored_technologies():
+    offers = database.query_offers(['name', 'technologies'], order_by='id')
+
+    return dict(zip(offers['name'], offers['technologies']))
+
+
+def test_technologies_round_trip(offers_db, make_offers):
+    technologies = [['Python', 'SQL', 'Docker'], [], ['SQL', 'Python'], ['Java']]
+
+    inserted, updated = database.save_to_db(make_offers(['a', 'b', 'c', 'd'], technologies))
+
+    assert (inserted, updated) == (4, 0)
+    assert stored_technologies() == {'a': ['Python', 'SQL', 'Docker'], 'b': [], 'c': ['SQL', 'Python'], 'd': ['Java']}
+    assert sorted(database.query_offers_with_technology('Python')['name']) == ['a', 'c']
+
+
+def test_technologies_of_sparse_ids(offers_db, make_offers):
+    database.save_to_db(make_offers([f'old {i}' for i in range(6)], [['Go']] * 6))
+    with database.get_connection() as connection:
+        connection.execute("DELETE FROM offers WHERE name IN ('old 1', 'old 2', 'old 3', 'old 4')")
+        connection.commit()
+    connection.close()
+
+    # an old offer with changed technologies next to new ones
+    offers = make_offers(['old 0', 'new 0', 'new 1'], [['Go', 'Rust'], ['Python'], []])
+    inserted, updated = database.save_to_db(offers)
+
+    assert (inserted, updated) == (2, 1)
+    assert stored_technologies() == {'old 0': ['Go', 'Rust'], 'old 5': ['Go'], 'new 0': ['Python'], 'new 1': []}
+
+    with database.get_connection() as connection:
+        ids = [offer_id for offer_id, in connection.execute("SELECT id FROM offers ORDER BY id")]
+        assert database.load_technologies(connection, ids[::-1] + ids) == {
+            ids[0]: ['Go', 'Rust'], ids[1]: ['Go'], ids[2]: ['Python']}
+        assert database.load_technologies(connection, []) == {}
+    connection.close()
+
+
+def test_unchanged_offers_are_not_updated(offers_db, make_offers):
+    offers = make_offers(['a', 'b'], [['Python'], ['SQL']])
+    database.save_to_db(offers)
+
+    assert database.save_to_db(offers) == (0, 0)
+    assert stored_technologies() == {'a': ['Python'], 'b': ['SQL']}
+
+
+def test_stored_fingerprints_are_kept(offers_db, make_offers):
+    offers = make_offers(['a', 'b'], [[], []])
+    offers.loc[0, 'fingerprint'] = 42
+    offers['fingerprint'] = offers['fingerprint'].astype('Int64')
+    offers.loc[1, 'fingerprint'] = None
+
+    database.save_to_db(offers)
+
+    stored = database.query_offers(['name', 'fingerprint'], order_by='id')
+    assert stored['fingerprint'].tolist() == [42, offer_fingerprints(offers.iloc[[1]]).iloc[0]]
+
+
+def test_custom_duplicates_are_the_stored_key(offers_db, make_offers):
+    offers = make_offers(['a', 'b'], [[], []])
+    offers['company'] = ['same', 'same']
+    duplicates = ['site', 'company']
+
+    assert database.save_to_db(merge_offers(offers, offers.iloc[:0], duplicates)) == (1, 0)
+    # the other offer of the same company is the same offer under this key, with a changed link
+    assert database.save_to_db(merge_offers(offers.iloc[[1]], offers.iloc[:0], duplicates)) == (0, 1)
+
+
+def test_rehash_fingerprints(offers_db, make_offers, capsys):
+    database.save_to_db(make_offers(['a', 'b', 'B '], [[], [], []]))
+    with database.get_connection() as connection:
+        # fingerprints of an older hash, under which 'b' and 'B ' were different offers
+        connection.execute("DROP INDEX idx_offers_fingerprint")
+        connection.execute("UPDATE offers SET fingerprint = id")
+        connection.execute("INSERT INTO offers (site, experience, name, company, fingerprint, updated_at) "
+                           "VALUES ('justjoin.it', 'mid', 'B', 'company', 100, '2025-01-01 10:00')")
+        connection.commit()
+        duplicate_id = connection.execute("SELECT MAX(id) FROM offers").fetchone()[0]
+
+        database.rehash_fingerprints(connection)
+        connection.commit()
+        indexes = [row[1] for row in connection.execute("PRAGMA index_list(offers)")]
+    connection.close()
+
+    stored = database.query_offers(['name', 'fingerprint'], order_by='id')
+    assert stored['name'].tolist() == ['a', 'b']
+    assert stored['fingerprint'].tolist() == offer_fingerprints(make_offers(['a', 'b'], [[], []])).tolist()
+    assert 'idx_offers_fingerprint' in indexes
+    assert f"Removed 1 duplicated offers from Database (ids: {duplicate_id})" in capsys.readouterr().out
+
+
+def test_pending_migration_leaves_snapshot(offers_db, make_offers, monkeypatch):
+    assert not os.path.exists(offers_db + '.pre-migration-1')
+
+    database.save_to_db(make_offers(['a', 'b'], [['Python'], []]))
+    with database.get_connection() as connection:
+        # a database from before migration 8, with 'B ' stored as a different offer than 'b'
+        connection.execute("DROP INDEX idx_offers_fingerprint")
+        connection.execute("INSERT INTO offers (site, experience, name, company, fingerprint, updated_at) "
+                           "VALUES ('justjoin.it', 'mid', 'B ', 'company', 100, '2025-01-01 10:00')")
+        connection.execute("DELETE FROM schema_version WHERE version = 8")
+        connection.commit()
+    connection.close()
+
+    database.create_db_if_not_exists()
+
+    snapshot_path = offers_db + '.pre-migration-8'
+    assert database.query_offers(['name'])['name'].tolist() == ['a', 'b']
+    assert os.path.exists(snapshot_path)
+
+    # the snapshot of the first attempt is kept when the migration runs again
+    with database.get_connection() as connection:
+        connection.execute("DELETE FROM schema_version WHERE version = 8")
+        connection.commit()
+    connection.close()
+    database.create_db_if_not_exists()
+
+    # the database is restored by replacing it with the snapshot
+    restored_path = offers_db.replace('offers.sqlite', 'restored.sqlite')
+    shutil.copy(snapshot_path, restored_path)
+    monkeypatch.setattr(database, 'DB_PATH', restored_path)
+    with database.get_connection() as connection:
+        versions = [version for version, in connection.execute("SELECT version FROM schema_version")]
+    connection.close()
+    assert 8 not in versions
+    assert database.query_offers(['name', 'technologies'], order_by='id').values.tolist() == [
+        ['a', ['Python']], ['b', []], ['B ', []]]
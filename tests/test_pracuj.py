@@ -0,0 +1,187 @@
+import gzip
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+import commons
+import pracuj
+from commons import SeenLinks, get_session
+from metrics import metrics
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'pracuj.pl')
+
+# rows produced by 'extract_features_pracuj' from the offers of page_1.html
+PAGE_1_OFFERS = [
+    ['Specjalista (Mid / Regular)', 'Python Developer', 'Acme Sp. z o.o.', 'Warszawa, Mokotów', 'Praca hybrydowa',
+     '12000–18000zł brutto / mies.', ['Python', 'Django', 'PostgreSQL'],
+     'https://www.pracuj.pl/praca/python-developer,oferta,1001'],
+    ['Młodszy specjalista (Junior), Asystent', 'Junior Data Analyst', 'DataCorp S.A.', 'Siedziba firmy: Kraków',
+     'Praca zdalna', 'Undisclosed Salary', ['SQL', 'Excel'],
+     'https://www.pracuj.pl/praca/junior-data-analyst,oferta,1002'],
+    ['Starszy specjalista (Senior)', 'DevOps Engineer', 'CloudOps', 'Gdańsk', 'Praca zdalna',
+     '150zł netto (+ VAT) / godz.', [], 'https://www.pracuj.pl/praca/devops-engineer,oferta,1003?s=abc'],
+]
+
+
+def read_fixture(name: str):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as fixture:
+        return fixture.read()
+
+
+def fixture_of(url: str):
+    """
+    Name of the fixture with the listing page of the url ('&pn=N' selects the page, the first one by default).
+    """
+    return f"page_{parse_qs(urlparse(url).query).get('pn', ['1'])[0]}.html"
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local stand-in for pracuj.pl serving the saved listing pages gzip-compressed. Pages in 'missing' are
+    answered with 404 and with 'bot_check' set every page is replaced with the bot check page.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.requests = []
+        self.missing = set()
+        self.bot_check = False
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/praca?itth=37'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        name = 'bot_check.html' if self.server.bot_check else fixture_of(self.path)
+
+        if name in self.server.missing or not os.path.exists(os.path.join(FIXTURES_DIR, name)):
+            self.send_error(404)
+            return
+
+        body = read_fixture(name).encode()
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeDriver:
+    """
+    Stand-in for a Selenium WebDriver, which renders the saved listing pages.
+    """
+
+    def __init__(self):
+        self.visited = []
+        self.page_source = None
+
+    def get(self, url: str):
+        self.visited.append(url)
+        self.page_source = read_fixture(fixture_of(url))
+
+
+class FakePool:
+
+    def __init__(self, driver: FakeDriver):
+        self.fake_driver = driver
+
+    @contextmanager
+    def driver(self):
+        yield self.fake_driver
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # no spacing between requests to the local server
+    monkeypatch.setattr(commons, 'rate_limiter', commons.RateLimiter(0))
+    metrics.reset()
+
+    stand_in = StandInServer()
+    thread = threading.Thread(target=stand_in.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield stand_in
+    stand_in.shutdown()
+    stand_in.server_close()
+
+
+def test_parse_fixture_page():
+    offers, links = pracuj.parse_page_pracuj(read_fixture('page_1.html'), [], SeenLinks())
+
+    assert offers == PAGE_1_OFFERS
+    assert len(links) == 3
+
+
+def test_count_pages():
+    assert pracuj.count_pages_pracuj(read_fixture('page_1.html')) == 3
+    assert pracuj.count_pages_pracuj(read_fixture('bot_check.html')) == 1
+
+
+def test_selenium_backend_on_fixtures():
+    driver = FakeDriver()
+
+    offers, _ = pracuj.scrape_pracuj('https://it.pracuj.pl/praca?itth=37', driver)
+
+    # the offer repeated on the second page is skipped
+    assert [offer[1] for offer in offers] == ['Python Developer', 'Junior Data Analyst', 'DevOps Engineer',
+                                              'Java Team Leader', 'QA Tester']
+    assert offers[:3] == PAGE_1_OFFERS
+
+
+def test_http_backend_matches_selenium(server):
+    offers, links = pracuj.scrape_pracuj_http(server.url, get_session())
+
+    assert sorted(server.requests) == [f'/praca?itth=37&pn={page}' for page in (1, 2, 3)]
+    assert metrics.total('pages_fetched') == 3
+    assert metrics.total('bytes_downloaded') > 0
+    assert len(links) == 5
+    assert offers == pracuj.scrape_pracuj(server.url, FakeDriver())[0]
+
+
+def test_http_backend_fails_on_missing_page(server):
+    server.missing.add('page_3.html')
+
+    assert pracuj.scrape_pracuj_http(server.url, get_session()) is None
+
+
+def test_http_backend_fails_on_bot_check(server):
+    server.bot_check = True
+
+    assert pracuj.scrape_pracuj_http(server.url, get_session()) is None
+
+
+def test_fallback_to_selenium(server):
+    server.bot_check = True
+    driver = FakeDriver()
+
+    offers, _ = pracuj.scrape_url_pracuj(server.url, FakePool(driver), get_session())
+
+    assert offers == pracuj.scrape_pracuj(server.url, FakeDriver())[0]
+    assert driver.visited[0] == server.url
+    assert metrics.total('selenium_fallbacks') == 1
+    assert metrics.total('offers_extracted') == 5
+
+
+def test_http_backend_without_fallback(server):
+    driver = FakeDriver()
+
+    offers, _ = pracuj.scrape_url_pracuj(server.url, FakePool(driver), get_session())
+
+    assert len(offers) == 5
+    assert driver.visited == []
+    assert metrics.total('selenium_fallbacks') == 0